@@ -8,7 +8,27 @@ class Client(object):
     def __init__(self, api_host, access_token):
         self.api_host = api_host
         self.access_token = access_token
+        # URLs, headers and middleware for this client's requests
+        self._context = lib.new_request_context(access_token, api_host)
 
+    def add_middleware(self, middleware, index=None):
+        """Add a middleware to the chain this client's requests go through.
+
+        See :mod:`api.client.context`.
+
+        Parameters
+        ----------
+        middleware : function
+            Takes a :class:`~api.client.context.Request` and the next handler in the chain, and
+            returns the response.
+        index : integer, optional
+            Position in the chain. Appended by default, closest to the transport.
+
+        """
+        self._context.add_middleware(middleware, index)
+
+    def remove_middleware(self, middleware):
+        self._context.remove_middleware(middleware)
 
     def get_available(self, entity_type):
         """List the first 5000 available entities of the given type.
@@ -28,7 +48,8 @@ class Client(object):
                 ... ]
 
         """
-        return lib.get_available(self.access_token, self.api_host, entity_type)
+        return lib.get_available(self.access_token, self.api_host, entity_type,
+                                 context=self._context)
 
 
     def list_available(self, selected_entities):
@@ -62,7 +83,8 @@ class Client(object):
                 ... ]
 
         """
-        return lib.list_available(self.access_token, self.api_host, selected_entities)
+        return lib.list_available(self.access_token, self.api_host, selected_entities,
+                                  context=self._context)
 
 
     def lookup(self, entity_type, entity_ids):
@@ -113,7 +135,8 @@ class Client(object):
                 }
 
         """
-        return lib.lookup(self.access_token, self.api_host, entity_type, entity_ids)
+        return lib.lookup(self.access_token, self.api_host, entity_type, entity_ids,
+                          context=self._context)
 
 
     def lookup_unit_abbreviation(self, unit_id):
@@ -134,8 +157,8 @@ class Client(object):
         list of unit ids
 
         """
-        return lib.get_allowed_units(self.access_token, self.api_host, metric_id,
-                                     item_id)
+        return lib.get_allowed_units(self.access_token, self.api_host, metric_id, item_id,
+                                     context=self._context)
 
     def get_data_series(self, **selection):
         """Get available data series for the given selections.
@@ -167,11 +190,13 @@ class Client(object):
                  }, { ... }, ... ]
 
         """
-        return lib.get_data_series(self.access_token, self.api_host, **selection)
+        return lib.get_data_series(self.access_token, self.api_host, context=self._context,
+                                   **selection)
 
 
     def get_data_points(self, **selection):
-        return lib.get_data_points(self.access_token, self.api_host, **selection)
+        return lib.get_data_points(self.access_token, self.api_host, context=self._context,
+                                   **selection)
 
 
     def search(self, entity_type, search_terms):
@@ -192,7 +217,7 @@ class Client(object):
 
         """
         return lib.search(self.access_token, self.api_host,
-                          entity_type, search_terms)
+                          entity_type, search_terms, context=self._context)
 
 
     def search_and_lookup(self, entity_type, search_terms, num_results=10):
@@ -224,7 +249,8 @@ class Client(object):
 
         """
         return lib.search_and_lookup(self.access_token, self.api_host,
-                                     entity_type, search_terms, num_results)
+                                     entity_type, search_terms, num_results,
+                                     context=self._context)
 
 
     def lookup_belongs(self, entity_type, entity_id):
@@ -249,7 +275,8 @@ class Client(object):
                   'level': 2 }
 
         """
-        return lib.lookup_belongs(self.access_token, self.api_host, entity_type, entity_id)
+        return lib.lookup_belongs(self.access_token, self.api_host, entity_type, entity_id,
+                                  context=self._context)
 
 
     def rank_series_by_source(self, selections_list):
@@ -268,7 +295,8 @@ class Client(object):
             The input series_list, expanded out to each possible source, ordered by coverage.
 
         """
-        return lib.rank_series_by_source(self.access_token, self.api_host, selections_list)
+        return lib.rank_series_by_source(self.access_token, self.api_host, selections_list,
+                                         context=self._context)
 
 
     def get_geo_centre(self, region_id):
@@ -287,7 +315,8 @@ class Client(object):
                 [{ 'centre': [ 45.7228, -112.996 ], 'regionId': 1215, 'regionName': 'United States' }]
 
         """
-        return lib.get_geo_centre(self.access_token, self.api_host, region_id)
+        return lib.get_geo_centre(self.access_token, self.api_host, region_id,
+                                  context=self._context)
 
 
     def get_geojson(self, region_id):
@@ -308,7 +337,8 @@ class Client(object):
                                 'coordinates': [[[[-38.394, -4.225], ...]]]}, ...]}
 
         """
-        return lib.get_geojson(self.access_token, self.api_host, region_id)
+        return lib.get_geojson(self.access_token, self.api_host, region_id,
+                               context=self._context)
 
 
     def get_descendant_regions(self, region_id, descendant_level=None,
@@ -353,7 +383,8 @@ class Client(object):
 
         """
         return lib.get_descendant_regions(self.access_token, self.api_host, region_id,
-                                          descendant_level, include_historical, include_details)
+                                          descendant_level, include_historical, include_details,
+                                          context=self._context)
 
 
     def get_available_timefrequency(self, **selection):
@@ -385,7 +416,7 @@ class Client(object):
                     'name': u'daily'}, ... ]
         """
         return lib.get_available_timefrequency(self.access_token, self.api_host,
-                                               **selection)
+                                               context=self._context, **selection)
 
     def get_top(self, entity_type, num_results=5, **selection):
         """Find the data series with the highest cumulative value for the given time range.
@@ -442,4 +473,5 @@ class Client(object):
             value the series are ranked by. You may then use the results to call
             :meth:`~.get_data_points` to get the individual time series points.
         """
-        return lib.get_top(self.access_token, self.api_host, entity_type, num_results, **selection)
+        return lib.get_top(self.access_token, self.api_host, entity_type, num_results,
+                           context=self._context, **selection)
@@ -0,0 +1,403 @@
+"""Asynchronous API client for applications built on asyncio.
+
+Requires Python 3.5+. Requests are made with Tornado's AsyncHTTPClient, which runs on whichever
+asyncio event loop is running when a method is awaited, so an AsyncGroClient can be shared with
+other asyncio libraries (aiohttp servers, etc.) and fan out many concurrent requests without
+threads.
+
+Example::
+
+    client = AsyncGroClient(API_HOST, ACCESS_TOKEN)
+    results = await asyncio.gather(*[client.get_data_points(**selection)
+                                      for selection in selections])
+"""
+
+import asyncio
+import copy
+import time
+from urllib.parse import urlencode
+
+from tornado.httpclient import AsyncHTTPClient, HTTPRequest
+
+from api.client import (cfg, circuit_breaker, disk_cache, json_backend, lib, offline, ontology,
+                        rate_limit, retry, series_store)
+from api.client.deadline import get_current_deadline
+from api.client.retry import get_backoff_delay
+from api.client.singleflight import request_key
+from api.client.utils import dict_reformat_keys, list_chunk, str_camel_to_snake, str_snake_to_camel
+
+# Requests in progress, by event loop and request key, for identical requests to share
+_in_flight = {}
+
+
+class AsyncGroClient(object):
+    """API client whose methods are coroutines mirroring those of :class:`~api.client.Client`.
+
+    Retries, 301 redirects and 204/206 responses are handled the same way as
+    :func:`api.client.lib.get_data`. So are deadlines: the deadline set with
+    :func:`api.client.deadline.deadline` when a method is called bounds the time spent on its
+    requests. Entities, data points and the other responses lib keeps locally are looked up in
+    the same entity store, disk cache and series store first, so they can be answered in offline
+    mode too. See :mod:`api.client.offline`.
+    """
+
+    def __init__(self, api_host, access_token):
+        self.api_host = api_host
+        self.access_token = access_token
+        self._logger = lib.get_default_logger()
+        # Precomputed URLs and headers. Its middleware chain is not used, since it is synchronous.
+        self._context = lib.new_request_context(access_token, api_host)
+
+    def get_logger(self):
+        return self._logger
+
+    def _url(self, *path):
+        return self._context.url('/'.join(path))
+
+    def _headers(self):
+        return dict(self._context.headers)
+
+    async def get_data(self, url, headers, params=None):
+        """General 'make api request' coroutine.
+
+        Assigns headers and builds in retries and logging. If an identical request is already in
+        progress on the same event loop, waits for it and returns a copy of its decoded result
+        instead of making another request. See :mod:`api.client.singleflight`.
+
+        Parameters
+        ----------
+        url : string
+        headers : dict
+        params : dict
+
+        Returns
+        -------
+        data : list or dict
+            The decoded JSON body of the response, or None if there is no body, as with a 204.
+
+        Raises
+        ------
+        api.client.lib.APIError
+        api.client.lib.DeadlineExceeded
+        api.client.lib.CircuitOpenError
+        api.client.lib.OfflineError
+
+        """
+        deadline = get_current_deadline()
+        if not cfg.COALESCE_REQUESTS:
+            return await self._get_data(url, headers, params, deadline)
+        key = (asyncio.get_event_loop(), request_key(url, params, self.access_token))
+        future = _in_flight.get(key)
+        if future is None:
+            future = asyncio.ensure_future(self._get_data(url, headers, params, deadline))
+            _in_flight[key] = future
+            future.add_done_callback(lambda _: _in_flight.pop(key, None))
+            # Cancelling one of the callers, e.g. with asyncio.wait_for, must not cancel the
+            # request for the others.
+            return await asyncio.shield(future)
+        # The request may have been started with a later deadline, or none
+        try:
+            result = await asyncio.wait_for(asyncio.shield(future),
+                                            deadline.remaining() if deadline is not None else None)
+        except asyncio.TimeoutError:
+            raise lib.DeadlineExceeded(None, 0, url, params)
+        # Callers may modify the result: the ones waiting for another's request get a copy
+        return copy.deepcopy(result)
+
+    async def _get_data_cached(self, kind, key_parts, url, params=None, field=None):
+        """Like :meth:`~get_data`, but uses the disk cache if it is enabled.
+
+        See :func:`api.client.lib.get_json_cached`.
+        """
+        context = self._context
+        cached = disk_cache.get_cached(kind, context.api_host, context.access_token, [key_parts])
+        if key_parts in cached:
+            return cached[key_parts]
+        result = await self.get_data(url, self._headers(), params)
+        if field is not None:
+            result = result[field]
+        disk_cache.set_cached(kind, context.api_host, context.access_token, {key_parts: result})
+        return result
+
+    async def _get_data(self, url, headers, params=None, deadline=None):
+        if offline.is_offline():
+            offline.record_miss(url, params)
+            raise lib.OfflineError(url, params)
+        base_log_record = dict(route=url, params=params)
+        retry_count = 0
+
+        # append version info
+        headers.update(lib.get_version_info())
+
+        self._logger.debug(url)
+        self._logger.debug(params)
+        http_client = AsyncHTTPClient()
+        breaker = circuit_breaker.get_circuit_breaker(url)
+        response = None
+        while retry_count <= cfg.MAX_RETRIES:
+            # Checked before taking a rate limit token, as in lib.get_data
+            if deadline is not None and deadline.remaining() <= 0:
+                raise lib.DeadlineExceeded(response, retry_count, url, params)
+            if breaker.retry_after():
+                raise lib.CircuitOpenError(response, retry_count, url, params,
+                                           breaker.retry_after())
+            delay = rate_limit.reserve(url, headers)
+            if deadline is not None and deadline.remaining() <= delay:
+                raise lib.DeadlineExceeded(response, retry_count, url, params)
+            if delay:
+                self._logger.debug('Rate limited, waiting {:.3f}s'.format(delay))
+                await asyncio.sleep(delay)
+            if not breaker.allow():
+                raise lib.CircuitOpenError(response, retry_count, url, params,
+                                           breaker.retry_after())
+            timeout = cfg.REQUEST_TIMEOUT
+            if deadline is not None:
+                timeout = (deadline.remaining() if timeout is None
+                           else min(timeout, deadline.remaining()))
+            start_time = time.time()
+            request_url = '{}?{}'.format(url, urlencode(params, doseq=True)) if params else url
+            http_request = HTTPRequest(request_url, method='GET', headers=headers,
+                                       request_timeout=timeout, connect_timeout=timeout,
+                                       decompress_response=True)
+            try:
+                response = await http_client.fetch(http_request, raise_error=False)
+            except Exception as e:
+                # socket.gaierror, timeouts, etc.
+                response = e
+            elapsed_time = time.time() - start_time
+            status_code = lib.get_status_code(response)
+            breaker.record(status_code)
+            log_record = dict(base_log_record)
+            log_record['elapsed_time_in_ms'] = 1000 * elapsed_time
+            log_record['retry_count'] = retry_count
+            log_record['status_code'] = status_code
+            action = retry.get_response_action(status_code)
+            if action == retry.SUCCESS:
+                self._logger.debug('OK', extra=log_record)
+                return lib.get_json_body(response) if response.body else None
+            if action == retry.WARNING:  # Success with a caveat
+                self._logger.warning(retry.WARNING_MESSAGES[status_code], extra=log_record)
+                return lib.get_json_body(response) if response.body else None
+            log_record['tag'] = 'failed_gro_api_request'
+            if retry_count < cfg.MAX_RETRIES:
+                self._logger.warning(getattr(response, 'error', None) or response,
+                                     extra=log_record)
+            if action == retry.FAIL:
+                break  # Do not retry
+            if action == retry.REDIRECT:
+                new_params = lib.redirect(params, lib.get_json_body(response)['data'][0])
+                self._logger.warning('Redirecting {} to {}'.format(params, new_params),
+                                     extra=log_record)
+                params = new_params
+            else:
+                self._logger.warning('{}'.format(response), extra=log_record)
+                if retry_count < cfg.MAX_RETRIES:
+                    # Retry immediately on first failure, unless asked to wait with Retry-After.
+                    # Jittered exponential backoff before retrying repeatedly failing requests.
+                    delay = get_backoff_delay(retry_count, response)
+                    if deadline is not None and deadline.remaining() <= delay:
+                        raise lib.DeadlineExceeded(response, retry_count, url, params)
+                    await asyncio.sleep(delay)
+            retry_count += 1
+        raise lib.APIError(response, retry_count, url, params)
+
+    async def get_available(self, entity_type):
+        """See :meth:`api.client.Client.get_available`."""
+        return await self._get_data_cached('available', (entity_type,),
+                                           self._url('v2', entity_type), field='data')
+
+    async def list_available(self, selected_entities):
+        """See :meth:`api.client.Client.list_available`."""
+        params = dict([(str_snake_to_camel(key), value)
+                       for (key, value) in list(selected_entities.items())])
+        return (await self.get_data(self._url('v2/entities/list'), self._headers(),
+                                    params))['data']
+
+    async def lookup(self, entity_type, entity_ids):
+        """See :meth:`api.client.Client.lookup`.
+
+        Entities in the entity store or the disk cache are not requested. When a list of ids is
+        given, the chunked requests for the others are made concurrently.
+        """
+        try:  # Convert iterable types like numpy arrays or tuples into plain lists
+            entity_ids = list(entity_ids)
+        except TypeError:  # Convert anything else, like strings or numpy integers, into integers
+            entity_ids = int(entity_ids)
+        all_results, missing_ids = lib.get_stored_entities(
+            self._context, entity_type, [entity_ids] if isinstance(entity_ids, int) else entity_ids)
+        if missing_ids:
+            url = self._url('v2', entity_type)
+            responses = await asyncio.gather(*[
+                self.get_data(url, self._headers(), {'ids': id_batch})
+                for id_batch in list_chunk(missing_ids)])
+            fetched = {}
+            for response in responses:
+                fetched.update(response['data'])
+            lib.store_entities(self._context, entity_type, fetched, missing_ids)
+            all_results.update(fetched)
+        if isinstance(entity_ids, int):
+            return all_results.get(str(entity_ids))
+        return all_results
+
+    async def lookup_unit_abbreviation(self, unit_id):
+        return (await self.lookup('units', unit_id))['abbreviation']
+
+    async def get_allowed_units(self, metric_id, item_id=None):
+        """See :meth:`api.client.Client.get_allowed_units`."""
+        params = {'metricIds': metric_id}
+        if item_id:
+            params['itemIds'] = item_id
+        allowed_units = await self._get_data_cached('allowed_units', (metric_id, item_id),
+                                                    self._url('v2/units/allowed'), params, 'data')
+        return [unit['id'] for unit in allowed_units]
+
+    async def get_data_series(self, **selection):
+        """See :meth:`api.client.Client.get_data_series`."""
+        params = lib.get_params_from_selection(**selection)
+        data_series = (await self.get_data(self._url('v2/data_series/list'), self._headers(),
+                                           params))['data']
+        if any((series.get('metadata', {}).get('includes_historical_region', False))
+               for series in data_series):
+            self._logger.warning('Data series have some historical regions, '
+                                 'see https://developers.gro-intelligence.com/faq.html')
+        return data_series
+
+    async def get_data_points(self, **selection):
+        """See :meth:`api.client.Client.get_data_points`."""
+        params = lib.get_data_call_params(**selection)
+        store = series_store.get_series_store()
+        if store is None or selection.get('at_time'):
+            list_of_series = await self.get_data(self._url('v2/data'), self._headers(), params)
+        else:
+            # Only the points that may have changed since the series were last requested are
+            # downloaded. See api.client.series_store.
+            refresh, request_params = store.start_refresh(
+                self._context.api_host, self._context.access_token, params)
+            response = None
+            if request_params is not None:
+                response = await self.get_data(self._url('v2/data'), self._headers(),
+                                               request_params)
+            list_of_series = store.finish_refresh(refresh, response)
+        include_historical = selection.get('include_historical', True)
+        return lib.list_of_series_to_single_series(list_of_series, False, include_historical)
+
+    async def search(self, entity_type, search_terms):
+        """See :meth:`api.client.Client.search`."""
+        return await self._get_data_cached('search', (entity_type, search_terms),
+                                           self._url('v2/search', entity_type),
+                                           {'q': search_terms})
+
+    async def search_and_lookup(self, entity_type, search_terms, num_results=10):
+        """See :meth:`api.client.Client.search_and_lookup`.
+
+        Returns a list rather than a generator.
+        """
+        search_results = (await self.search(entity_type, search_terms))[:num_results]
+        search_result_ids = [result['id'] for result in search_results]
+        search_result_details = await self.lookup(entity_type, search_result_ids)
+        return [search_result_details[str(search_result_id)]
+                for search_result_id in search_result_ids]
+
+    async def lookup_belongs(self, entity_type, entity_id):
+        """See :meth:`api.client.Client.lookup_belongs`.
+
+        Returns a list rather than a generator.
+        """
+        graph = ontology.get_graph(entity_type)
+        if graph is not None and entity_id in graph:
+            parent_ids = graph.belongs_to(entity_id).tolist()
+        else:
+            parent_ids = (await self.lookup(entity_type, entity_id))['belongsTo']
+        parent_details = await self.lookup(entity_type, parent_ids)
+        return [parent_details[str(parent_id)] for parent_id in parent_ids]
+
+    async def get_source_ranking(self, series):
+        params = dict((lib.make_key(k), v) for k, v in iter(list(
+            lib.get_params_from_selection(**series).items())))
+        return await self.get_data(self._url('v2/available/sources'), self._headers(), params)
+
+    async def rank_series_by_source(self, selections_list):
+        """See :meth:`api.client.Client.rank_series_by_source`.
+
+        The source rankings of all selections are requested concurrently. Returns a list rather
+        than a generator.
+        """
+        selections_list = [dict(series) for series in selections_list]
+        for series in selections_list:
+            # Remove source if selected, to consider all sources.
+            series.pop('source_name', None)
+            series.pop('source_id', None)
+        rankings = await asyncio.gather(*[self.get_source_ranking(series)
+                                          for series in selections_list])
+        ranked_series = []
+        for series, source_ids in zip(selections_list, rankings):
+            for source_id in source_ids or []:  # None if the response was empty
+                series_with_source = dict(series)
+                series_with_source['source_id'] = source_id
+                ranked_series.append(series_with_source)
+        return ranked_series
+
+    async def get_geo_centre(self, region_id):
+        """See :meth:`api.client.Client.get_geo_centre`."""
+        return (await self.get_data(self._url('v2/geocentres'), self._headers(),
+                                    {'regionIds': region_id}))['data']
+
+    async def get_geojson(self, region_id):
+        """See :meth:`api.client.Client.get_geojson`."""
+        response = await self.get_data(self._url('v2/geocentres'), self._headers(),
+                                       {'includeGeojson': True, 'regionIds': region_id})
+        for region in response['data']:
+            return json_backend.loads(region['geojson'])
+        return None
+
+    async def get_descendant_regions(self, region_id, descendant_level=None,
+                                     include_historical=True, include_details=True):
+        """See :meth:`api.client.Client.get_descendant_regions`."""
+        graph = ontology.get_graph('regions')
+        if graph is not None and region_id in graph:
+            # No request needed, see api.client.ontology
+            descendant_region_ids = graph.descendants(region_id, descendant_level or None,
+                                                      include_historical).tolist()
+            if not include_details:
+                return [{'id': descendant_region_id}
+                        for descendant_region_id in descendant_region_ids]
+            region_details = await self.lookup('regions', descendant_region_ids)
+            return [region_details[str(descendant_region_id)]
+                    for descendant_region_id in descendant_region_ids]
+
+        params = {'ids': [region_id]}
+        if descendant_level:
+            params['level'] = descendant_level
+        else:
+            params['distance'] = -1
+        response = await self.get_data(self._url('v2/regions/contains'), self._headers(), params)
+        descendant_region_ids = response['data'][str(region_id)]
+
+        # Filter out regions with the 'historical' flag set to true
+        if not include_historical or include_details:
+            region_details = await self.lookup('regions', descendant_region_ids)
+
+            if not include_historical:
+                descendant_region_ids = [region['id'] for region in region_details.values()
+                                         if not region['historical']]
+
+            if include_details:
+                return [region_details[str(region_id)] for region_id in descendant_region_ids]
+
+        return [{'id': descendant_region_id} for descendant_region_id in descendant_region_ids]
+
+    async def get_available_timefrequency(self, **selection):
+        """See :meth:`api.client.Client.get_available_timefrequency`."""
+        params = dict((lib.make_key(k), v) for k, v in iter(list(
+            lib.get_params_from_selection(**selection).items())))
+        response = await self.get_data(self._url('v2/available/time-frequencies'),
+                                       self._headers(), params)
+        if response is None:  # 204 No Content
+            return []
+        return [dict_reformat_keys(tf, str_camel_to_snake) for tf in response]
+
+    async def get_top(self, entity_type, num_results=5, **selection):
+        """See :meth:`api.client.Client.get_top`."""
+        params = lib.get_params_from_selection(**selection)
+        params['n'] = num_results
+        return await self.get_data(self._url('v2/top', entity_type), self._headers(), params)
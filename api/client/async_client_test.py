@@ -0,0 +1,296 @@
+import asyncio
+import json
+import os
+
+import mock
+import pytest
+
+from api.client import cfg, lib, offline, ontology, series_store
+from api.client.async_client import AsyncGroClient
+from api.client.deadline import deadline, get_current_deadline
+from api.client.ontology import EntityGraph
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.token'
+
+
+class MockResponse(object):
+    def __init__(self, code, body):
+        self.code = code
+        self.body = json.dumps(body).encode('utf-8') if body is not None else b''
+        self.error = None
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def mock_fetch(*responses):
+    """Patch AsyncHTTPClient so fetch() returns the given responses in order."""
+    requests = []
+    responses = list(responses)
+
+    async def fetch(http_request, raise_error=True):
+        requests.append(http_request)
+        return responses.pop(0)
+
+    patcher = mock.patch('api.client.async_client.AsyncHTTPClient')
+    http_client_class = patcher.start()
+    http_client_class.return_value.fetch.side_effect = fetch
+    return patcher, requests
+
+
+@pytest.fixture
+def no_sleep():
+    async def sleep(delay):
+        pass
+    with mock.patch('asyncio.sleep', side_effect=sleep) as sleep_mocked:
+        yield sleep_mocked
+
+
+def test_lookup():
+    patcher, requests = mock_fetch(
+        MockResponse(200, {'data': {'12345': {'id': 12345, 'name': 'Test'}}}))
+    try:
+        client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+        assert run(client.lookup('items', 12345)) == {'id': 12345, 'name': 'Test'}
+    finally:
+        patcher.stop()
+    assert requests[0].url == 'https://pytest.groclient.url/v2/items?ids=12345'
+    assert requests[0].headers['authorization'] == 'Bearer ' + MOCK_TOKEN
+
+
+def test_lookup_many_ids():
+    patcher, requests = mock_fetch(
+        MockResponse(200, {'data': {str(i): {'id': i} for i in range(50)}}),
+        MockResponse(200, {'data': {'50': {'id': 50}}}))
+    try:
+        client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+        result = run(client.lookup('regions', list(range(51))))
+    finally:
+        patcher.stop()
+    assert len(requests) == 2
+    assert sorted(result.keys()) == sorted(str(i) for i in range(51))
+
+
+def test_get_descendant_regions_uses_graph():
+    ontology.set_graph(EntityGraph.from_entities('regions', {
+        '1215': {'id': 1215, 'level': 3, 'contains': [13100], 'belongsTo': [0]},
+        '13100': {'id': 13100, 'level': 4, 'contains': [], 'belongsTo': [1215]}}))
+    patcher, requests = mock_fetch(
+        MockResponse(200, {'data': {'13100': {'id': 13100, 'name': 'Wisconsin'}}}))
+    try:
+        client = AsyncGroClient(MOCK_HOST, 'pytest.groclient.async_client.ontology.token')
+        assert run(client.get_descendant_regions(1215, 4, include_details=False)) == [
+            {'id': 13100}]
+        assert not requests
+        assert run(client.get_descendant_regions(1215, 4)) == [{'id': 13100,
+                                                                'name': 'Wisconsin'}]
+    finally:
+        ontology.clear_graphs()
+        patcher.stop()
+    # Only the details are requested
+    assert len(requests) == 1
+    assert '/v2/regions?' in requests[0].url
+
+
+def test_offline_lookup_belongs_uses_graph():
+    ontology.set_graph(EntityGraph.from_entities('regions', {
+        '13100': {'id': 13100, 'level': 4, 'contains': [], 'belongsTo': [1215]}}))
+    patcher, requests = mock_fetch(
+        MockResponse(200, {'data': {'1215': {'id': 1215, 'name': 'United States'}}}))
+    try:
+        client = AsyncGroClient(MOCK_HOST, 'pytest.groclient.async_client.ontology.token')
+        run(client.lookup('regions', [1215]))
+        offline.enable_offline_mode()
+        # The parents are found in the graph, and their details in the entity store
+        assert run(client.lookup_belongs('regions', 13100)) == [{'id': 1215,
+                                                                 'name': 'United States'}]
+    finally:
+        offline.disable_offline_mode()
+        ontology.clear_graphs()
+        patcher.stop()
+    assert len(requests) == 1
+
+
+def test_get_data_points():
+    patcher, _ = mock_fetch(MockResponse(200, [{
+        'series': {'metricId': 1, 'itemId': 2, 'regionId': 3, 'unitId': 4},
+        'data': [['2000-01-01', '2000-12-31', 1]]
+    }]))
+    try:
+        client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+        points = run(client.get_data_points(metric_id=1, item_id=2, region_id=3))
+    finally:
+        patcher.stop()
+    assert [(p['start_date'], p['value'], p['unit_id']) for p in points] == \
+        [('2000-01-01', 1, 4)]
+
+
+def test_get_data_points_uses_series_store(tmpdir):
+    store = series_store.enable_series_store(os.path.join(str(tmpdir), 'series.sqlite'))
+    patcher, requests = mock_fetch(*[MockResponse(200, [{
+        'series': {'metricId': 1, 'regionId': 3, 'unitId': 4},
+        'data': [['2000-01-01T00:00:00.000Z', '2000-12-31T00:00:00.000Z', value]]
+    }]) for value in (1, 2)])
+    try:
+        client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+        run(client.get_data_points(metric_id=1, region_id=3))
+        points = run(client.get_data_points(metric_id=1, region_id=3))
+    finally:
+        patcher.stop()
+        series_store.disable_series_store()
+    assert 'startDate' not in requests[0].url
+    assert 'startDate=2000-12-31' in requests[1].url
+    assert [point['value'] for point in points] == [2]
+    assert store.get_stats()['delta_downloads'] == 1
+
+
+def test_redirect():
+    patcher, requests = mock_fetch(
+        MockResponse(301, {'data': [{'old_metric_id': 1, 'new_metric_id': 2}]}),
+        MockResponse(200, {'data': []}))
+    try:
+        client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+        assert run(client.get_data_series(metric_id=1)) == []
+    finally:
+        patcher.stop()
+    assert requests[1].url.endswith('metricId=2')
+
+
+def test_no_content():
+    patcher, _ = mock_fetch(MockResponse(204, None))
+    try:
+        client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+        assert run(client.get_available_timefrequency(metric_id=1)) == []
+    finally:
+        patcher.stop()
+
+
+def test_retries(no_sleep):
+    patcher, requests = mock_fetch(*[MockResponse(503, None)] * 5)
+    try:
+        client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+        with pytest.raises(lib.APIError) as err:
+            run(client.get_top('items', metric_id=1))
+    finally:
+        patcher.stop()
+    assert err.value.status_code == 503
+    assert len(requests) == 5
+
+
+@mock.patch.object(cfg, 'BACKOFF_BASE', 10)
+def test_deadline(no_sleep):
+    patcher, requests = mock_fetch(*[MockResponse(503, None)] * 5)
+    try:
+        client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+        with pytest.raises(lib.DeadlineExceeded) as err:
+            with deadline(0.5):
+                run(client.get_top('items', metric_id=1))
+    finally:
+        patcher.stop()
+    assert err.value.status_code == 503
+    # Gave up instead of backing off past the deadline
+    assert len(requests) < 5
+    assert all(request.request_timeout <= 0.5 for request in requests)
+
+
+@mock.patch.object(cfg, 'REQUEST_TIMEOUT', None)
+def test_deadline_without_request_timeout():
+    patcher, requests = mock_fetch(MockResponse(200, {'data': {'12': {'id': 12}}}))
+    try:
+        # Own token, so that the rate limit doesn't eat into the deadline
+        client = AsyncGroClient(MOCK_HOST, 'pytest.groclient.async_deadline.token')
+        with deadline(0.5):
+            assert run(client.lookup('items', 12)) == {'id': 12}
+    finally:
+        patcher.stop()
+    assert 0 < requests[0].request_timeout <= 0.5
+
+
+def test_deadlines_of_concurrent_tasks():
+    async def remaining(timeout):
+        with deadline(timeout):
+            await asyncio.sleep(0)  # let the other task set its deadline
+            remaining = get_current_deadline().remaining()
+        assert get_current_deadline() is None
+        return remaining
+
+    async def both():
+        return await asyncio.gather(remaining(1), remaining(100))
+
+    short, long = run(both())
+    assert short <= 1
+    assert 1 < long <= 100
+
+
+def test_no_retry_on_bad_request():
+    patcher, requests = mock_fetch(MockResponse(400, {'error': 'Bad Request'}))
+    try:
+        client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+        with pytest.raises(lib.APIError) as err:
+            run(client.search('items', 'corn'))
+    finally:
+        patcher.stop()
+    assert err.value.message == 'Bad Request'
+    assert len(requests) == 1
+
+
+def test_identical_requests_are_coalesced():
+    patcher, requests = mock_fetch(
+        MockResponse(200, {'data': {'12345': {'id': 12345, 'name': 'Test'}}}))
+    try:
+        client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+        other_client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+
+        async def lookups():
+            return await asyncio.gather(client.lookup('items', 12345),
+                                        client.lookup('items', 12345),
+                                        other_client.lookup('items', 12345))
+        results = run(lookups())
+    finally:
+        patcher.stop()
+    assert len(requests) == 1
+    assert results == [{'id': 12345, 'name': 'Test'}] * 3
+
+
+@pytest.fixture
+def offline_mode():
+    offline.enable_offline_mode()
+    yield
+    offline.disable_offline_mode()
+
+
+def test_offline_requests_are_refused(offline_mode):
+    patcher, requests = mock_fetch()
+    try:
+        client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+        with pytest.raises(lib.OfflineError):
+            run(client.get_data_series(metric_id=1))
+    finally:
+        patcher.stop()
+    assert not requests
+    assert len(offline.get_misses()) == 1
+
+
+def test_offline_lookups_use_entity_store():
+    patcher, requests = mock_fetch(MockResponse(200, {'data': {'12': {'id': 12}}}))
+    try:
+        client = AsyncGroClient(MOCK_HOST, MOCK_TOKEN)
+        assert run(client.lookup('items', [12, 13])) == {'12': {'id': 12}}
+        offline.enable_offline_mode()
+        # Neither the entity found nor the one that doesn't exist is requested again
+        assert run(client.lookup('items', 12)) == {'id': 12}
+        assert run(client.lookup('items', [12, 13])) == {'12': {'id': 12}}
+        # The same store as the synchronous client's
+        assert lib.lookup(MOCK_TOKEN, MOCK_HOST, 'items', 12) == {'id': 12}
+        with pytest.raises(lib.OfflineError):
+            run(client.lookup('items', 14))
+    finally:
+        offline.disable_offline_mode()
+        patcher.stop()
+    assert len(requests) == 1
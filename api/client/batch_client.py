@@ -1,5 +1,6 @@
+from datetime import timedelta
+from math import ceil
 import time
-import json
 
 # Python3 support
 try:
@@ -10,36 +11,24 @@ except ImportError:
     from urllib import urlencode
 
 from tornado import gen
-from tornado.escape import json_decode
 from tornado.httpclient import AsyncHTTPClient, HTTPRequest, HTTPError
 from tornado.ioloop import IOLoop
+from tornado.locks import Event
 from tornado.queues import Queue
-from api.client import cfg, lib
+from api.client import cfg, circuit_breaker, lib, offline, rate_limit, retry, series_store
+from api.client.deadline import Deadline
+from api.client.retry import RetryBudget, get_backoff_delay
 from api.client.gro_client import GroClient
-from api.client.lib import APIError
+from api.client.lib import APIError, CircuitOpenError, DeadlineExceeded, OfflineError
+from api.client.utils import list_chunk
 
 
 class BatchError(APIError):
-    """Replicate the APIError interface given a Tornado HTTPError."""
-    def __init__(self, response, retry_count, url, params):
-        self.response = response
-        self.retry_count = retry_count
-        self.url = url
-        self.params = params
-        self.status_code = self.response.code if hasattr(self.response, 'code') else None
-        try:
-            json_content = json_decode(self.response.body)
-            # 'error' should be something like 'Not Found' or 'Bad Request'
-            self.message = json_content.get('error', '')
-            # Some error responses give additional info.
-            # For example, a 400 Bad Request might say "metricId is required"
-            if 'message' in json_content:
-                self.message += ': {}'.format(json_content['message'])
-        except Exception:
-            # If the error message can't be parsed, fall back to a generic "giving up" message.
-            self.message = 'Giving up on {} after {} {}: {}'.format(self.url, self.retry_count,
-                                                                    'retry' if self.retry_count == 1
-                                                                    else 'retries', response)
+    """Raised by BatchClient when a request fails.
+
+    APIError handles Tornado responses and HTTPErrors too. This subclass is kept so that code
+    catching BatchError keeps working.
+    """
 
 
 class BatchClient(GroClient):
@@ -47,6 +36,9 @@ class BatchClient(GroClient):
 
     _logger = None
     _http_client = None
+    _retry_budget = None
+    _batch_deadline = None
+    _batch = None
 
     def __init__(self, api_host, access_token):
         super(BatchClient, self).__init__(api_host, access_token)
@@ -73,61 +65,91 @@ class BatchClient(GroClient):
         Assigns headers and builds in retries and logging.
         """
         self._logger.debug(url)
+        if offline.is_offline():
+            offline.record_miss(url, params)
+            raise OfflineError(url, params)
 
         # append version info
         headers.update(lib.get_version_info())
 
-        # Initialize to -1 so first attempt will be retry 0
+        deadline = self._batch_deadline
+        breaker = circuit_breaker.get_circuit_breaker(url)
+        response = None
+
+        # Initialize to -1 so first attempt will be retry 0. Like lib.get_data, makes at most
+        # cfg.MAX_RETRIES + 1 attempts.
         retry_count = -1
-        while retry_count <= cfg.MAX_RETRIES:
+        while retry_count < cfg.MAX_RETRIES:
             retry_count += 1
+            # Checked before taking a rate limit token, as in lib.get_data
+            if deadline is not None and deadline.remaining() <= 0:
+                raise DeadlineExceeded(response, retry_count, url, params)
+            if breaker.retry_after():
+                raise CircuitOpenError(response, retry_count, url, params, breaker.retry_after())
+            delay = rate_limit.reserve(url, headers)
+            if deadline is not None and deadline.remaining() <= delay:
+                raise DeadlineExceeded(response, retry_count, url, params)
+            if delay:
+                self._logger.debug('Rate limited, waiting {:.3f}s'.format(delay))
+                yield gen.sleep(delay)
+            if not breaker.allow():
+                raise CircuitOpenError(response, retry_count, url, params, breaker.retry_after())
+            timeout = cfg.TIMEOUT
+            if deadline is not None:
+                timeout = (deadline.remaining() if timeout is None
+                           else min(timeout, deadline.remaining()))
             start_time = time.time()
-            http_request = HTTPRequest('{url}?{params}'.format(url=url, params=urlencode(params)),
+            # Lists, such as the ids of lookups, are encoded as repeated parameters, as requests
+            # does for the synchronous client.
+            request_url = '{url}?{params}'.format(url=url, params=urlencode(params, doseq=True))
+            http_request = HTTPRequest(request_url,
                                        method="GET",
                                        headers=headers,
-                                       request_timeout=cfg.TIMEOUT,
-                                       connect_timeout=cfg.TIMEOUT)
+                                       request_timeout=timeout,
+                                       connect_timeout=timeout,
+                                       decompress_response=True)
             try:
-                try:
-                    response = yield self._http_client.fetch(http_request)
-                    status_code = response.code
-                except HTTPError as e:
-                    # Catch non-200 codes that aren't errors
-                    status_code = e.code if hasattr(e, 'code') else None
-                    if status_code in [204, 206]:
-                        log_msg = {204: 'No Content', 206: 'Partial Content'}[status_code]
-                        response = e.response
-                        log_request(start_time, retry_count, log_msg, status_code)
-                        # Do not retry.
-                    elif status_code == 301:
-                        redirected_ids = json.loads(e.response.body.decode("utf-8"))['data'][0]
-                        new_params = lib.redirect(params, redirected_ids)
-                        log_request(start_time, retry_count,
-                                    'Redirecting {} to {}'.format(params, new_params), status_code)
-                        params = new_params
-                        continue  # retry
-                    else:  # Otherwise, propagate to error handling
-                        raise e
+                response = yield self._http_client.fetch(http_request)
+            except HTTPError as e:
+                # Raised for non-200 status codes, and for timeouts (599) without a response
+                response = e.response if e.response is not None else e
             except Exception as e:
-                # HTTPError raised when there's a non-200 status code
-                # socket.gaio error raised when there's a connection error
-                response = e.response if hasattr(e, 'response') else e
-                status_code = e.code if hasattr(e, 'code') else None
-                error_msg = e.response.error if (hasattr(e, 'response') and
-                                                 hasattr(e.response, 'error')) else e
-                log_request(start_time, retry_count, error_msg, status_code)
-                if status_code in [429, 500, 503, 504]:
-                    # First retry is immediate.
-                    # After that, exponential backoff before retrying.
-                    if retry_count > 0:
-                        time.sleep(2 ** retry_count)
-                    continue
-                elif status_code in [400, 401, 402, 404]:
-                    break  # Do not retry. Go right to raising an Exception.
-
-            # Request was successful
-            log_request(start_time, retry_count, 'OK', status_code)
-            raise gen.Return(json_decode(response.body) if hasattr(response, 'body') else None)
+                # socket.gaierror raised when there's a connection error
+                response = e
+            status_code = lib.get_status_code(response)
+            breaker.record(status_code)
+            action = retry.get_response_action(status_code)
+            if action == retry.SUCCESS:
+                log_request(start_time, retry_count, 'OK', status_code)
+                raise gen.Return(lib.get_json_body(response) if response.body else None)
+            if action == retry.WARNING:
+                log_request(start_time, retry_count, retry.WARNING_MESSAGES[status_code],
+                            status_code)
+                raise gen.Return(lib.get_json_body(response) if response.body else None)
+            if action == retry.REDIRECT:
+                new_params = lib.redirect(params, lib.get_json_body(response)['data'][0])
+                log_request(start_time, retry_count,
+                            'Redirecting {} to {}'.format(params, new_params), status_code)
+                params = new_params
+                continue
+            log_request(start_time, retry_count, getattr(response, 'error', None) or response,
+                        status_code)
+            if action == retry.FAIL:
+                break  # Do not retry. Go right to raising an Exception.
+            if retry_count >= cfg.MAX_RETRIES:
+                break  # No retries left
+            if self._retry_budget is not None and not self._retry_budget.spend():
+                self._logger.warning('Retry budget of the batch is exhausted, '
+                                     'giving up on {}'.format(url))
+                break
+            # First retry is immediate, unless asked to wait with Retry-After. After that,
+            # jittered exponential backoff before retrying. gen.sleep lets the other requests
+            # in the batch proceed in the meantime.
+            delay = get_backoff_delay(retry_count, response)
+            if deadline is not None and deadline.remaining() <= delay:
+                raise DeadlineExceeded(response, retry_count, url, params)
+            if delay:
+                yield gen.sleep(delay)
 
         # Retries failed. Raise exception
         raise BatchError(response, retry_count, url, params)
@@ -147,25 +169,74 @@ class BatchClient(GroClient):
                 data_series['show_revisions'] = True
         self.batch_async_queue(self.get_data_points, self._data_series_queue, None,
                                self.add_points_to_df)
-        return self._data_frame
+        return self._assemble_data_frame()
 
     # TODO: deprecate  the following  two methods, standardize  on one
     # approach with get_data_points and get_df
     @gen.coroutine
     def get_data_points_generator(self, **selection):
-        headers = {'authorization': 'Bearer ' + self.access_token}
-        url = '/'.join(['https:', '', self.api_host, 'v2/data'])
+        headers = dict(self._context.headers)
+        url = self._context.url('v2/data')
         params = lib.get_data_call_params(**selection)
+        store = series_store.get_series_store()
         try:
-            list_of_series_points = yield self.get_data(url, headers, params)
+            if store is None or selection.get('at_time'):
+                list_of_series_points = yield self.get_data(url, headers, params)
+            else:
+                # Only the points that may have changed since the series were last requested are
+                # downloaded. See api.client.series_store.
+                refresh, request_params = store.start_refresh(
+                    self._context.api_host, self._context.access_token, params)
+                response = None
+                if request_params is not None:
+                    response = yield self.get_data(url, headers, request_params)
+                list_of_series_points = store.finish_refresh(refresh, response)
             include_historical = selection.get('include_historical', True)
             points = lib.list_of_series_to_single_series(list_of_series_points, False,
                                                          include_historical)
+            if 'unit_id' in selection and isinstance(points, list):
+                # Look the units up without blocking the IOLoop, then convert all at once
+                yield self.load_unit_conversions([point.get('unit_id') for point in points] +
+                                                 [selection['unit_id']])
+                points = self.convert_unit_records(points, selection['unit_id'])
             raise gen.Return(points)
-        except BatchError as b:
+        except APIError as b:  # BatchError, DeadlineExceeded or CircuitOpenError
             raise gen.Return(b)
 
-    def batch_async_get_data_points(self, batched_args, output_list=None, map_result=None):
+    @gen.coroutine
+    def async_lookup(self, entity_type, entity_ids):
+        """Like :meth:`~.lookup` with a list of ids, without blocking the IOLoop.
+
+        Entities in the entity store or the disk cache are not requested. The chunked requests
+        for the others are made concurrently.
+        """
+        entities, missing_ids = lib.get_stored_entities(self._context, entity_type,
+                                                        list(entity_ids))
+        if missing_ids:
+            url = self._context.url('v2/' + entity_type)
+            responses = yield [self.get_data(url, dict(self._context.headers), {'ids': id_batch})
+                               for id_batch in list_chunk(missing_ids)]
+            fetched = {}
+            for response in responses:
+                fetched.update(response['data'])
+            lib.store_entities(self._context, entity_type, fetched, missing_ids)
+            entities.update(fetched)
+        raise gen.Return(entities)
+
+    @gen.coroutine
+    def load_unit_conversions(self, unit_ids):
+        """Look up the units that :meth:`~.convert_unit_records` would need, asynchronously.
+
+        See :class:`api.client.units.ConversionTable`.
+        """
+        unknown_ids = self._unit_conversions.get_unknown(unit_ids)
+        if unknown_ids:
+            units = yield self.async_lookup('units', unknown_ids)
+            for unit_id in unknown_ids:
+                self._unit_conversions.add_unit(unit_id, units.get(str(unit_id)))
+
+    def batch_async_get_data_points(self, batched_args, output_list=None, map_result=None,
+                                    timeout=None):
         """Make many :meth:`~get_data_points` requests asynchronously.
 
         Parameters
@@ -206,6 +277,10 @@ class BatchClient(GroClient):
                                                                   output_list=output_list,
                                                                   map_result=map_response)
 
+        timeout : float, optional
+            Seconds. If given, the batch stops after that time, including time spent retrying,
+            and the results gathered so far are returned. See :meth:`~batch_async_queue`.
+
         Returns
         -------
         any
@@ -227,9 +302,12 @@ class BatchClient(GroClient):
                     ],
                 ]
 
+            It can be turned into a data frame, e.g. to save it with
+            :func:`api.client.frames.save_df`, with :func:`api.client.frames.batch_output_to_df`.
+
         """
         return self.batch_async_queue(self.get_data_points_generator, batched_args, output_list,
-                                      map_result)
+                                      map_result, timeout)
 
     @gen.coroutine
     def async_rank_series_by_source(self, *selections_list):
@@ -238,7 +316,7 @@ class BatchClient(GroClient):
         raise gen.Return(list(response))
 
     def batch_async_rank_series_by_source(self, batched_args,
-                                          output_list=None, map_result=None):
+                                          output_list=None, map_result=None, timeout=None):
         """Perform multiple rank_series_by_source requests asynchronously.
 
         Parameters
@@ -248,9 +326,19 @@ class BatchClient(GroClient):
 
         """
         return self.batch_async_queue(self.async_rank_series_by_source, batched_args,
-                                      output_list, map_result)
+                                      output_list, map_result, timeout)
+
+    def cancel(self):
+        """Stop the batch in progress and make it return the results gathered so far.
 
-    def batch_async_queue(self, func, batched_args, output_list, map_result):
+        May be called from any thread, or from a map_result function. Requests in flight are
+        abandoned.
+        """
+        batch = self._batch
+        if batch is not None:
+            batch['io_loop'].add_callback(batch['cancel'])
+
+    def batch_async_queue(self, func, batched_args, output_list, map_result, timeout=None):
         """Asynchronously call func.
 
         Parameters
@@ -271,6 +359,12 @@ class BatchClient(GroClient):
             2. the element from batched_args
             3. the result from that input
             4. `output_list`. The accumulator of all results
+        timeout : float, optional
+            Deadline for the whole batch, in seconds. Request timeouts and retries are cut short
+            so that the batch returns in time. When it runs out, or when :meth:`~cancel` is
+            called, the batch returns early: map_result is only applied to the results that
+            finished, so with the default output_list the unfinished entries are left as 0.
+            Requests that ran out of time while retrying give a DeadlineExceeded result.
 
         """
         assert type(batched_args) is list, \
@@ -296,11 +390,13 @@ class BatchClient(GroClient):
                 return accumulator
 
         q = Queue()
+        cancelled = Event()
+        batch = {'io_loop': IOLoop.current(), 'cancel': cancelled.set, 'done': 0}
 
         @gen.coroutine
         def consumer():
             """Execute func on all items in queue asynchronously."""
-            while q.qsize():
+            while q.qsize() and not cancelled.is_set():
                 try:
                     idx, item = q.get().result()
                     self._logger.debug('Doing work on {}'.format(idx))
@@ -312,7 +408,10 @@ class BatchClient(GroClient):
                         result = yield func(*item)
                     else:
                         result = yield func(item)
+                    if cancelled.is_set():
+                        break  # The batch has already returned
                     output_data['result'] = map_result(idx, item, result, output_data['result'])
+                    batch['done'] += 1
                     self._logger.debug('Done with {}'.format(idx))
                     q.task_done()
                 except Exception:
@@ -335,8 +434,33 @@ class BatchClient(GroClient):
             for i in range(cfg.MAX_QUERIES_PER_SECOND):
                 IOLoop.current().spawn_callback(consumer)
             producer()  # Wait for producer to put all tasks.
-            yield q.join()  # Wait for consumer to finish all tasks.
-
-        IOLoop.current().run_sync(main)
+            # Wait for consumer to finish all tasks, unless cancelled or out of time first.
+            # Neither future can fail, so the one that loses is left pending without any error
+            # to report
+            finished = gen.WaitIterator(q.join(), cancelled.wait()).next()
+            if self._batch_deadline is not None:
+                finished = gen.with_timeout(
+                    timedelta(seconds=self._batch_deadline.remaining()), finished)
+            try:
+                yield finished
+            except gen.TimeoutError:
+                self._logger.warning('Batch deadline exceeded')
+            if batch['done'] < len(batched_args):
+                self._logger.warning('Returning partial results, {} of {} requests done'.format(
+                    batch['done'], len(batched_args)))
+            cancelled.set()  # Stop the consumers
+
+        # Retries shared by all requests of the batch, so that a widespread outage doesn't
+        # multiply the load on the API by cfg.MAX_RETRIES.
+        self._retry_budget = RetryBudget(
+            max(cfg.MAX_RETRIES, int(ceil(len(batched_args) * cfg.BATCH_RETRY_BUDGET))))
+        self._batch_deadline = Deadline(timeout) if timeout is not None else None
+        self._batch = batch
+        try:
+            IOLoop.current().run_sync(main)
+        finally:
+            self._retry_budget = None
+            self._batch_deadline = None
+            self._batch = None
 
         return output_data['result']
@@ -0,0 +1,47 @@
+import json
+
+import mock
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPRequest, HTTPResponse
+from tornado.httputil import HTTPHeaders
+
+from api.client.batch_client import BatchClient
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.batch_client.token'
+
+UNITS = {'10': {'id': 10, 'baseConvFactor': {'factor': 1}},
+         '14': {'id': 14, 'baseConvFactor': {'factor': 1000}}}
+
+
+def mock_fetch(requests):
+    """Respond to /v2/units requests with UNITS, and to others with one point in tonnes."""
+    def fetch(http_request):
+        requests.append(http_request.url)
+        if '/v2/units?' in http_request.url:
+            ids = [param.split('=')[1] for param in http_request.url.split('?')[1].split('&')]
+            body = {'data': dict((unit_id, UNITS[unit_id]) for unit_id in ids)}
+        else:
+            body = [{'series': {'metricId': 1, 'unitId': 14},
+                     'data': [['2000-01-01', '2000-12-31', 2]]}]
+        future = Future()
+        future.set_result(HTTPResponse(
+            HTTPRequest(http_request.url), 200, headers=HTTPHeaders(),
+            buffer=mock.Mock(getvalue=lambda: json.dumps(body).encode('utf-8'))))
+        return future
+    return fetch
+
+
+@mock.patch('requests.Session.get')
+def test_unit_conversion_doesnt_block(mock_requests_get):
+    requests = []
+    client = BatchClient(MOCK_HOST, MOCK_TOKEN)
+    client._http_client = mock.Mock()
+    client._http_client.fetch.side_effect = mock_fetch(requests)
+    results = client.batch_async_get_data_points([{'metric_id': 1, 'unit_id': 10},
+                                                  {'metric_id': 2, 'unit_id': 10}])
+    assert [[(point['value'], point['unit_id']) for point in points]
+            for points in results] == [[(2000, 10)], [(2000, 10)]]
+    # Units are looked up with the IOLoop's client, once
+    assert not mock_requests_get.called
+    assert len([url for url in requests if '/v2/units?' in url]) == 1
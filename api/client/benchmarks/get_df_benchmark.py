@@ -0,0 +1,62 @@
+"""Show how the time GroClient.get_df takes to assemble its data frame grows with the number of
+series.
+
+Usage::
+
+    $ python -m api.client.benchmarks.get_df_benchmark [--points 500]
+
+Points are added with add_points_to_df, as get_df does for each series it loads, so no requests
+are made. The data frame is assembled in a single concatenation, so the time per series should
+stay about the same as the number of series grows. For comparison, the time taken by
+concatenating the frame of each series to the data frame one at a time, as get_df used to, is
+shown too.
+"""
+
+from __future__ import print_function
+import argparse
+import datetime
+import timeit
+
+import pandas
+
+from api.client.gro_client import GroClient
+
+
+def make_points(region_id, num_points):
+    start = datetime.date(2000, 1, 1)
+    dates = [(start + datetime.timedelta(days=day)).strftime('%Y-%m-%dT00:00:00.000Z')
+             for day in range(num_points)]
+    return [{'start_date': date, 'end_date': date, 'value': float(day), 'unit_id': 36,
+             'reporting_date': None, 'metric_id': 2540047, 'item_id': 3457,
+             'region_id': region_id, 'partner_region_id': 0, 'frequency_id': 1}
+            for day, date in enumerate(dates)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--points', type=int, default=500, help='points per series')
+    parser.add_argument('--series', type=int, nargs='+', default=[250, 500, 1000, 2000])
+    args = parser.parse_args()
+
+    print('{:>8} {:>14} {:>14} {:>14}'.format('series', 'get_df (s)', 'per series (ms)',
+                                              'one by one (s)'))
+    for num_series in args.series:
+        client = GroClient('api.gro-intelligence.com', 'token')
+        frames = []
+        for region_id in range(num_series):
+            client.add_points_to_df(None, {'source_id': 1}, make_points(region_id, args.points))
+            frames.append(client._data_frame_chunks[-1])
+        seconds = timeit.timeit(client.get_df, number=1)
+
+        def concat_one_by_one():
+            df = pandas.DataFrame()
+            for frame in frames:
+                df = frame if df.empty else pandas.concat([df, frame])
+        one_by_one = timeit.timeit(concat_one_by_one, number=1)
+        print('{:>8} {:>14.3f} {:>14.3f} {:>14.3f}'.format(num_series, seconds,
+                                                           1000 * seconds / num_series,
+                                                           one_by_one))
+
+
+if __name__ == '__main__':
+    main()
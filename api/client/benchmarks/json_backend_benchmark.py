@@ -0,0 +1,64 @@
+"""Compare the time taken to decode /v2/data responses with each installed JSON backend.
+
+Usage::
+
+    $ python -m api.client.benchmarks.json_backend_benchmark [--series 200] [--points 2000]
+
+The payload is a list_of_series response like those of get_data_points for daily series of many
+regions. Each backend decodes it whole, and the standard json module also incrementally, as
+streamed responses are when no faster backend is installed.
+"""
+
+from __future__ import print_function
+import argparse
+import datetime
+import json
+import random
+import timeit
+
+from api.client import json_backend
+from api.client.streaming import iter_json_array
+
+
+def make_list_of_series(num_series, num_points):
+    start = datetime.date(2000, 1, 1)
+    dates = [(start + datetime.timedelta(days=day)).strftime('%Y-%m-%dT00:00:00.000Z')
+             for day in range(num_points)]
+    return [{
+        'series': {'metricId': 2540047, 'itemId': 3457, 'regionId': 1000 + region_id,
+                   'partnerRegionId': 0, 'frequencyId': 1, 'unitId': 36,
+                   'belongsTo': {'itemId': 3457}, 'metadata': {}},
+        'data': [[date, date, round(random.uniform(0, 100), 4), None] for date in dates],
+    } for region_id in range(num_series)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--series', type=int, default=200)
+    parser.add_argument('--points', type=int, default=2000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+
+    body = json.dumps(make_list_of_series(args.series, args.points)).encode('utf-8')
+    chunks = [body[start:start + 65536] for start in range(0, len(body), 65536)]
+    print('Payload: {} series of {} points, {:.1f} MB'.format(args.series, args.points,
+                                                              len(body) / 1e6))
+    timings = []
+    for name in json_backend.BACKENDS:
+        try:
+            json_backend.set_backend(name)
+        except ImportError:
+            print('{:<20} not installed'.format(name))
+            continue
+        timings.append((name, min(timeit.repeat(lambda: json_backend.loads(body),
+                                                number=1, repeat=args.repeat))))
+    timings.append(('json (incremental)', min(timeit.repeat(lambda: list(iter_json_array(chunks)),
+                                                            number=1, repeat=args.repeat))))
+    baseline = dict(timings)['json']
+    for name, seconds in timings:
+        print('{:<20} {:8.3f} s  {:5.1f}x'.format(name, seconds, baseline / seconds))
+    json_backend.set_backend()
+
+
+if __name__ == '__main__':
+    main()
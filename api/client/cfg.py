@@ -1,5 +1,35 @@
 MAX_RETRIES = 4
-MAX_QUERIES_PER_SECOND = 10
+MAX_QUERIES_PER_SECOND = 10  # default rate limit per access token, see rate_limit.py
 TIMEOUT=6000
 MAX_RESULT_COMBINATION_DEPTH=3
 MAX_SERIES_PER_COMB=1000
+POOL_CONNECTIONS = 10  # number of hosts to keep connection pools for
+POOL_MAXSIZE = 10  # keep-alive connections per host
+POOL_BLOCK = False
+BACKOFF_BASE = 1  # seconds, doubled on every retry
+MAX_BACKOFF = 30  # seconds
+BATCH_RETRY_BUDGET = 0.1  # retries allowed per request of a batch, on average
+STREAM_CHUNK_SIZE = 65536  # bytes of a streamed response body decoded at a time
+REQUEST_TIMEOUT = 300  # seconds without any data from the server before a request is retried
+COALESCE_REQUESTS = True  # share identical concurrent requests, see singleflight.py
+CIRCUIT_WINDOW = 20  # recent requests per endpoint the failure rate is computed over
+CIRCUIT_MIN_REQUESTS = 10  # requests needed before a circuit breaker may open
+CIRCUIT_FAILURE_RATE = 0.5  # share of server errors and timeouts that opens a circuit breaker
+CIRCUIT_RESET_TIMEOUT = 30  # seconds a circuit breaker stays open before probing the endpoint
+DISK_CACHE_MAX_SIZE = 256 * 1024 * 1024  # bytes of compressed responses, see disk_cache.py
+DISK_CACHE_LOCK_TIMEOUT = 30  # seconds to wait for another process writing to the disk cache
+DISK_CACHE_TOUCH_INTERVAL = 3600  # seconds before a read updates the last access time of an entry
+MEMORY_CACHE_MAXSIZE = 1024  # entries per cached lib function, see memory_cache.py
+MEMORY_CACHE_MAX_BYTES = 64 * 1024 * 1024  # approximate memory per cached lib function
+MEMORY_CACHE_TTL = 3600  # seconds
+GEOJSON_CACHE_MAX_BYTES = 256 * 1024 * 1024  # region geometries are large
+ENTITY_STORE_MAXSIZE = 100000  # entities kept in memory, see entity_store.py
+ENTITY_STORE_MISS_TTL = 60  # seconds ids of entities that don't exist are not requested again
+SHARED_CONTEXTS_MAXSIZE = 64  # access tokens lib functions called without a context keep one for
+SERIES_STORE_MAX_SIZE = 1024 * 1024 * 1024  # bytes of compressed series, see series_store.py
+SERIES_STORE_FULL_REFRESH_INTERVAL = 7 * 24 * 3600  # seconds before series are downloaded in full
+REVALIDATION_MAX_BYTES = 256 * 1024 * 1024  # response bodies kept in memory, see revalidation.py
+REVALIDATION_TTL = 30 * 24 * 3600  # seconds response bodies are kept on disk for revalidation
+JSON_BACKEND = None  # 'orjson', 'simdjson', 'ujson' or 'json', by default the first installed
+JSON_WHOLE_BODY_MAX_BYTES = 64 * 1024 * 1024  # bodies decoded at once by a fast JSON backend
+GET_DF_MAX_WORKERS = 1  # series GroClient.get_df requests at a time, at most POOL_MAXSIZE
@@ -0,0 +1,232 @@
+"""Circuit breakers that make requests to a failing endpoint fail fast.
+
+When the API is degraded, retrying every request with exponential backoff makes a large batch
+take hours to fail, and adds load to an API that is already struggling. Every request path
+(lib.get_data, BatchClient and AsyncGroClient) checks the circuit breaker of the endpoint before
+each attempt and reports the outcome after it.
+
+A breaker starts closed: requests go through, and the outcomes of the last cfg.CIRCUIT_WINDOW
+requests are kept. Server errors (5xx), timeouts and connection errors count as failures. Once at
+least cfg.CIRCUIT_MIN_REQUESTS outcomes are known and the share of failures reaches
+cfg.CIRCUIT_FAILURE_RATE, the breaker opens: requests fail immediately with
+:class:`~api.client.lib.CircuitOpenError` without being sent. After cfg.CIRCUIT_RESET_TIMEOUT
+seconds it is half-open: a single request is let through as a probe. If the probe succeeds the
+breaker closes again, otherwise it stays open for another cfg.CIRCUIT_RESET_TIMEOUT.
+
+The state of the breakers can be checked at any time::
+
+    circuit_breaker.get_circuit_states()
+    # {'api.gro-intelligence.com/v2/data': 'open', 'api.gro-intelligence.com/v2/items': 'closed'}
+"""
+
+from collections import deque
+import threading
+
+try:
+    # Python 3
+    from time import monotonic
+    from urllib.parse import urlparse
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+    from urlparse import urlparse
+
+from api.client import cfg
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+
+def is_failure(status_code):
+    """Whether a response indicates that the endpoint is unhealthy.
+
+    Client errors like 404, and rate limiting (429), say nothing about the health of the endpoint.
+
+    >>> is_failure(503)
+    True
+    >>> is_failure(None)  # timeout or connection error
+    True
+    >>> is_failure(404)
+    False
+
+    """
+    return status_code is None or status_code >= 500
+
+
+class CircuitBreaker(object):
+    """Closed/open/half-open state of one endpoint, driven by its recent failure rate.
+
+    Parameters
+    ----------
+    window : integer, optional
+        Number of most recent outcomes the failure rate is computed over
+    failure_rate : float, optional
+        Share of failures, between 0 and 1, at which the breaker opens
+    min_requests : integer, optional
+        Number of outcomes needed before the breaker may open
+    reset_timeout : float, optional
+        Seconds the breaker stays open before letting a probe request through
+
+    """
+
+    def __init__(self, window=None, failure_rate=None, min_requests=None, reset_timeout=None):
+        self.window = window or cfg.CIRCUIT_WINDOW
+        self.failure_rate = failure_rate or cfg.CIRCUIT_FAILURE_RATE
+        self.min_requests = min_requests or cfg.CIRCUIT_MIN_REQUESTS
+        self.reset_timeout = reset_timeout or cfg.CIRCUIT_RESET_TIMEOUT
+        self._lock = threading.Lock()
+        self._outcomes = deque(maxlen=self.window)  # True for each failure
+        self._state = CLOSED
+        self._opened_at = None
+        self._probe_started_at = None
+
+    def _update_state(self, now):
+        if self._state == OPEN and now >= self._opened_at + self.reset_timeout:
+            self._state = HALF_OPEN
+            self._probe_started_at = None
+
+    @property
+    def state(self):
+        """One of 'closed', 'open' or 'half-open'."""
+        with self._lock:
+            self._update_state(monotonic())
+            return self._state
+
+    def allow(self):
+        """Check whether a request may be made now.
+
+        In the half-open state, only one request is allowed at a time. If its outcome isn't
+        recorded within reset_timeout, e.g. because the caller gave up on it, another one is
+        allowed.
+
+        Returns
+        -------
+        boolean
+
+        """
+        with self._lock:
+            now = monotonic()
+            self._update_state(now)
+            if self._state == CLOSED:
+                return True
+            if self._state == HALF_OPEN and (
+                    self._probe_started_at is None or
+                    now >= self._probe_started_at + self.reset_timeout):
+                self._probe_started_at = now
+                return True
+            return False
+
+    def record(self, status_code):
+        """Record the outcome of a request allowed by :meth:`~allow`.
+
+        Parameters
+        ----------
+        status_code : integer or None
+            None if there was no response, e.g. on a timeout
+
+        """
+        failure = is_failure(status_code)
+        with self._lock:
+            now = monotonic()
+            self._update_state(now)
+            if self._state == HALF_OPEN:
+                if failure:
+                    self._open(now)
+                else:
+                    self._state = CLOSED
+                    self._outcomes.clear()
+                return
+            if self._state == OPEN:
+                return  # A request allowed before the breaker opened
+            self._outcomes.append(failure)
+            if (len(self._outcomes) >= self.min_requests and
+                    sum(self._outcomes) >= self.failure_rate * len(self._outcomes)):
+                self._open(now)
+
+    def _open(self, now):
+        self._state = OPEN
+        self._opened_at = now
+        self._probe_started_at = None
+        self._outcomes.clear()
+
+    def retry_after(self):
+        """Seconds until a probe request will be allowed, 0 if requests are allowed now."""
+        with self._lock:
+            now = monotonic()
+            self._update_state(now)
+            if self._state == OPEN:
+                return max(0.0, self._opened_at + self.reset_timeout - now)
+            if self._state == HALF_OPEN and self._probe_started_at is not None:
+                return max(0.0, self._probe_started_at + self.reset_timeout - now)
+            return 0.0
+
+    def reset(self):
+        """Close the breaker and forget past outcomes."""
+        with self._lock:
+            self._state = CLOSED
+            self._outcomes.clear()
+            self._opened_at = None
+            self._probe_started_at = None
+
+    def __repr__(self):
+        return 'CircuitBreaker({})'.format(self.state)
+
+
+_lock = threading.Lock()
+_breakers = {}
+
+
+def get_endpoint(url):
+    """Get the endpoint, host included, that a request url has a circuit breaker for.
+
+    >>> get_endpoint('https://api.gro-intelligence.com/v2/geocentres?regionIds=1215')
+    'api.gro-intelligence.com/v2/geocentres'
+
+    """
+    parsed_url = urlparse(url)
+    return parsed_url.netloc + '/' + parsed_url.path.strip('/')
+
+
+def get_circuit_breaker(url):
+    """Get the circuit breaker of the endpoint of a request url, creating it if necessary.
+
+    Returns
+    -------
+    CircuitBreaker
+
+    """
+    endpoint = get_endpoint(url)
+    breaker = _breakers.get(endpoint)
+    if breaker is None:
+        with _lock:
+            breaker = _breakers.setdefault(endpoint, CircuitBreaker())
+    return breaker
+
+
+def get_circuit_states():
+    """Get the state of the circuit breaker of every endpoint requested so far.
+
+    Returns
+    -------
+    dict
+        'closed', 'open' or 'half-open' by endpoint, e.g. 'api.gro-intelligence.com/v2/data'
+
+    """
+    with _lock:
+        breakers = list(_breakers.items())
+    return dict((endpoint, breaker.state) for endpoint, breaker in breakers)
+
+
+def reset_circuit_breakers():
+    """Close all circuit breakers, e.g. after an outage is known to be over."""
+    with _lock:
+        _breakers.clear()
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python circuit_breaker.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
@@ -0,0 +1,91 @@
+import mock
+import pytest
+from tornado.httpclient import HTTPError
+
+from api.client import circuit_breaker, lib
+from api.client.batch_client import BatchClient
+from api.client.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.token'
+
+
+def test_opens_on_failure_rate():
+    breaker = CircuitBreaker(window=10, failure_rate=0.5, min_requests=4, reset_timeout=30)
+    for status_code in [200, 503, 404]:
+        assert breaker.allow()
+        breaker.record(status_code)
+    assert breaker.state == CLOSED
+    assert breaker.allow()
+    breaker.record(None)  # 2 failures out of 4
+    assert breaker.state == OPEN
+    assert not breaker.allow()
+    assert 29 < breaker.retry_after() <= 30
+
+
+def test_half_open_probe():
+    breaker = CircuitBreaker(window=4, failure_rate=0.5, min_requests=2, reset_timeout=30)
+    with mock.patch('api.client.circuit_breaker.monotonic', return_value=1000):
+        breaker.record(500)
+        breaker.record(500)
+        assert breaker.state == OPEN
+    with mock.patch('api.client.circuit_breaker.monotonic', return_value=1031):
+        assert breaker.state == HALF_OPEN
+        # Only one probe at a time
+        assert breaker.allow()
+        assert not breaker.allow()
+        breaker.record(503)
+        assert breaker.state == OPEN
+    with mock.patch('api.client.circuit_breaker.monotonic', return_value=1062):
+        assert breaker.allow()
+        breaker.record(200)
+        assert breaker.state == CLOSED
+        assert breaker.allow()
+        assert breaker.allow()
+
+
+def test_abandoned_probe():
+    breaker = CircuitBreaker(window=4, failure_rate=0.5, min_requests=2, reset_timeout=30)
+    with mock.patch('api.client.circuit_breaker.monotonic', return_value=1000):
+        breaker.record(500)
+        breaker.record(500)
+    with mock.patch('api.client.circuit_breaker.monotonic', return_value=1031):
+        assert breaker.allow()
+    with mock.patch('api.client.circuit_breaker.monotonic', return_value=1062):
+        assert breaker.allow()
+
+
+@mock.patch('requests.Session.get')
+@mock.patch('time.sleep')
+def test_get_data_fails_fast_when_open(sleep_mocked, mock_requests_get):
+    mock_requests_get.return_value = mock.Mock(status_code=503, headers={})
+    url = 'https://{}/v2/data'.format(MOCK_HOST)
+    headers = {'authorization': 'Bearer ' + MOCK_TOKEN}
+    with mock.patch.multiple('api.client.cfg', CIRCUIT_MIN_REQUESTS=4, MAX_RETRIES=10):
+        with pytest.raises(lib.CircuitOpenError) as error:
+            lib.get_data(url, headers)
+        assert mock_requests_get.call_count == 4
+        assert error.value.retry_after > 0
+        assert circuit_breaker.get_circuit_states() == {MOCK_HOST + '/v2/data': OPEN}
+
+        # Further requests are not sent while the breaker is open
+        with pytest.raises(lib.CircuitOpenError):
+            lib.get_data(url, headers)
+        assert mock_requests_get.call_count == 4
+
+        # Other endpoints are unaffected
+        mock_requests_get.return_value = mock.Mock(status_code=200)
+        lib.get_data('https://{}/v2/items'.format(MOCK_HOST), headers)
+        assert mock_requests_get.call_count == 5
+
+
+def test_batch_fails_fast_when_open():
+    client = BatchClient(MOCK_HOST, MOCK_TOKEN)
+    client._http_client = mock.Mock()
+    client._http_client.fetch.side_effect = HTTPError(503)
+    with mock.patch.multiple('api.client.cfg', CIRCUIT_MIN_REQUESTS=4, MAX_RETRIES=0):
+        results = client.batch_async_get_data_points([{'metric_id': i} for i in range(10)])
+    # Requests stop being sent once the breaker opens, the rest of the batch fails immediately
+    assert client._http_client.fetch.call_count == 4
+    assert all(isinstance(result, lib.APIError) for result in results)
+    assert sum(isinstance(result, lib.CircuitOpenError) for result in results) >= 6
@@ -0,0 +1,172 @@
+"""Columnar decoding of data points, into NumPy arrays or a pandas DataFrame.
+
+By default, :meth:`~api.client.Client.get_data_points` returns a dict per point, which
+:meth:`~api.client.gro_client.GroClient.get_df` turns back into a DataFrame. For pulls of millions
+of points, building those dicts is most of the work. With format='columns' or
+format='dataframe', the list_of_series response is decoded straight into typed arrays instead::
+
+    client.get_data_points(metric_id=2540047, item_id=3457, region_id=[...], frequency_id=1,
+                           source_id=26, format='dataframe')
+
+    columns = client.get_data_points(..., format='columns')
+    columns['value'].mean()
+
+Arrays are:
+- start_date, end_date, reporting_date: datetime64[ns], NaT if missing. In DataFrames they are
+  localized to UTC, like the dates of DataFrames built from points.
+- value: float64, NaN if missing.
+- unit_id, metric_id, item_id, region_id, partner_region_id, frequency_id: int32, or float64
+  with NaN if some points don't have one.
+
+The deprecated input_unit_id and input_unit_scale fields of points are left out.
+"""
+
+from collections import OrderedDict
+try:
+    from collections.abc import Iterator
+except ImportError:
+    from collections import Iterator
+
+import numpy as np
+import pandas
+
+from api.client.dates import parse_dates
+
+RECORDS = 'records'  # list of dicts, one per point
+COLUMNS = 'columns'  # dict of NumPy arrays
+DATAFRAME = 'dataframe'  # pandas DataFrame
+COMPACT = 'compact'  # list of DataPoints, see api.client.points
+FORMATS = (RECORDS, COLUMNS, DATAFRAME, COMPACT)
+
+DATE_COLUMNS = ['start_date', 'end_date', 'reporting_date']
+
+# Series attributes repeated for each point: column, key in the response, default
+SERIES_COLUMNS = [
+    ('unit_id', 'unitId', None),
+    ('metric_id', 'metricId', None),
+    ('item_id', 'itemId', None),
+    ('region_id', 'regionId', None),
+    ('partner_region_id', 'partnerRegionId', 0),
+    ('frequency_id', 'frequencyId', None),
+]
+
+# In the order of the fields of points
+COLUMN_NAMES = ['start_date', 'end_date', 'value', 'unit_id', 'reporting_date', 'metric_id',
+                'item_id', 'region_id', 'partner_region_id', 'frequency_id']
+
+
+def check_format(data_format):
+    if data_format not in FORMATS:
+        raise ValueError('Unknown format {!r}, expected one of {}'.format(data_format,
+                                                                           ', '.join(FORMATS)))
+
+
+def is_included(series, include_historical=True):
+    """Whether a series of a list_of_series response is returned, or left out.
+
+    Elements that are not series are left out. So are series including historical regions, if
+    `include_historical` is False.
+    """
+    if not (isinstance(series, dict) and isinstance(series.get('data', []), list)):
+        return False
+    series_metadata = series.get('series', {}).get('metadata', {})
+    has_historical_regions = (series_metadata.get('includesHistoricalRegion', False) or
+                              series_metadata.get('includesHistoricalPartnerRegion', False))
+    return include_historical or not has_historical_regions
+
+
+def _to_id_array(ids):
+    if any(entity_id is None for entity_id in ids):
+        return np.array(ids, dtype=np.float64)
+    return np.array(ids, dtype=np.int32)
+
+
+def list_of_series_to_columns(series_list, include_historical=True):
+    """Decode a list_of_series response into arrays, one per field of the points.
+
+    >>> columns = list_of_series_to_columns([
+    ...     {'series': {'metricId': 1, 'itemId': 2, 'regionId': 3, 'unitId': 4},
+    ...      'data': [['2001-01-01T00:00:00.000Z', '2001-12-31T00:00:00.000Z', 123],
+    ...               ['2002-01-01T00:00:00.000Z', '2002-12-31T00:00:00.000Z', None,
+    ...                '2003-01-15T00:00:00.000Z']]},
+    ...     {'series': {'metricId': 1, 'itemId': 2, 'regionId': 5, 'unitId': 4},
+    ...      'data': [['2001-01-01T00:00:00.000Z', '2001-12-31T00:00:00.000Z', 7.5]]}])
+    >>> list(columns)
+    ['start_date', 'end_date', 'value', 'unit_id', 'reporting_date', 'metric_id', 'item_id',
+     'region_id', 'partner_region_id', 'frequency_id']
+    >>> columns['value']
+    array([123. ,   nan,   7.5])
+    >>> columns['region_id']
+    array([3, 3, 5], dtype=int32)
+    >>> [str(date)[:10] for date in columns['reporting_date']]
+    ['NaT', '2003-01-15', 'NaT']
+    >>> columns['frequency_id']
+    array([nan, nan, nan])
+
+    Parameters
+    ----------
+    series_list : list or iterator of dicts
+        As decoded from a /v2/data response, or returned by
+        :func:`api.client.streaming.decode_json_stream`
+    include_historical : boolean, optional
+
+    Returns
+    -------
+    OrderedDict of NumPy arrays
+        See the module docstring. If `series_list` is not a list, e.g. an error body, it is
+        returned as is.
+
+    """
+    if not isinstance(series_list, (list, Iterator)):
+        return series_list
+    start_dates, end_dates, values, reporting_dates = [], [], [], []
+    attributes = dict((column, []) for column, _, _ in SERIES_COLUMNS)
+    counts = []
+    for series in series_list:
+        if not is_included(series, include_historical):
+            continue
+        data = series.get('data', [])
+        counts.append(len(data))
+        start_dates.extend(point[0] for point in data)
+        end_dates.extend(point[1] for point in data)
+        values.extend(point[2] for point in data)
+        reporting_dates.extend(point[3] if len(point) > 3 else None for point in data)
+        series_attributes = series.get('series', {})
+        for column, key, default in SERIES_COLUMNS:
+            attributes[column].append(series_attributes.get(key, default))
+    counts = np.array(counts, dtype=np.int64)
+    columns = {
+        'start_date': parse_dates(start_dates),
+        'end_date': parse_dates(end_dates),
+        'value': np.array(values, dtype=np.float64),
+        'reporting_date': parse_dates(reporting_dates),
+    }
+    for column, _, _ in SERIES_COLUMNS:
+        # Decoded once per series, and repeated for each of its points
+        columns[column] = np.repeat(_to_id_array(attributes[column]), counts)
+    return OrderedDict((column, columns[column]) for column in COLUMN_NAMES)
+
+
+def to_data_frame(columns):
+    """Build a DataFrame from the arrays returned by :func:`~.list_of_series_to_columns`."""
+    columns = OrderedDict(columns)
+    for column in DATE_COLUMNS:
+        if column in columns:
+            columns[column] = pandas.DatetimeIndex(columns[column]).tz_localize('UTC')
+    return pandas.DataFrame(columns, columns=list(columns))
+
+
+def decode(series_list, data_format, include_historical=True):
+    """Decode a list_of_series response into the given format, other than RECORDS."""
+    if not isinstance(series_list, (list, Iterator)):
+        return series_list
+    columns = list_of_series_to_columns(series_list, include_historical)
+    return to_data_frame(columns) if data_format == DATAFRAME else columns
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python columnar.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
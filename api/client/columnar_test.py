@@ -0,0 +1,84 @@
+import json
+
+import mock
+import numpy as np
+import pandas
+import pytest
+
+from api.client import lib
+from api.client.gro_client import GroClient
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.columnar.token'
+
+LIST_OF_SERIES = [
+    {'series': {'metricId': 1, 'itemId': 2, 'regionId': 3, 'frequencyId': 9, 'unitId': 14},
+     'data': [['2017-01-01T00:00:00.000Z', '2017-12-31T00:00:00.000Z', 1.5],
+              ['2018-01-01T00:00:00.000Z', '2018-12-31T00:00:00.000Z', 2,
+               '2019-01-15T00:00:00.000Z']]},
+    {'series': {'metricId': 1, 'itemId': 2, 'regionId': 4, 'frequencyId': 9, 'unitId': 14,
+                'metadata': {'includesHistoricalRegion': True}},
+     'data': [['2017-01-01T00:00:00.000Z', '2017-12-31T00:00:00.000Z', None]]},
+]
+
+
+def mock_data_response(mock_requests_get, body=LIST_OF_SERIES):
+    def get(url, params=None, **kwargs):
+        response = mock.Mock(status_code=200)
+        response.iter_content.return_value = [json.dumps(body).encode('utf-8')]
+        return response
+    mock_requests_get.side_effect = get
+
+
+@mock.patch('requests.Session.get')
+def test_columns(mock_requests_get):
+    mock_data_response(mock_requests_get)
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    columns = client.get_data_points(metric_id=1, item_id=2, region_id=[3, 4], format='columns')
+    assert columns['start_date'].dtype == np.dtype('datetime64[ns]')
+    assert columns['region_id'].tolist() == [3, 3, 4]
+    assert columns['region_id'].dtype == np.int32
+    assert columns['partner_region_id'].tolist() == [0, 0, 0]
+    assert columns['value'][:2].tolist() == [1.5, 2]
+    assert np.isnan(columns['value'][2])
+    assert np.isnat(columns['reporting_date'][0])
+    assert str(columns['reporting_date'][1])[:10] == '2019-01-15'
+
+    columns = client.get_data_points(metric_id=1, item_id=2, region_id=[3, 4],
+                                     include_historical=False, format='columns')
+    assert columns['region_id'].tolist() == [3, 3]
+
+
+@mock.patch('requests.Session.get')
+def test_dataframe_matches_records(mock_requests_get):
+    mock_data_response(mock_requests_get)
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    df = client.get_data_points(metric_id=1, item_id=2, region_id=[3, 4], format='dataframe')
+    records = pandas.DataFrame(client.get_data_points(metric_id=1, item_id=2, region_id=[3, 4]))
+    for column in ['start_date', 'end_date', 'reporting_date']:
+        records[column] = pandas.to_datetime(records[column])
+        assert (df[column].dropna() == records[column].dropna()).all()
+    for column in ['value', 'unit_id', 'metric_id', 'region_id', 'frequency_id']:
+        assert df[column].tolist() == pytest.approx(records[column].tolist(), nan_ok=True)
+
+
+@mock.patch('requests.Session.get')
+def test_get_df(mock_requests_get):
+    mock_data_response(mock_requests_get, LIST_OF_SERIES[:1])
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    client.add_single_data_series({'metric_id': 1, 'item_id': 2, 'region_id': 3,
+                                   'partner_region_id': 0, 'frequency_id': 9, 'source_id': 5})
+    df = client.get_df(format='dataframe')
+    assert df['value'].tolist() == [1.5, 2]
+    assert df['source_id'].tolist() == [5, 5]
+    assert 'input_unit_scale' not in df.columns
+    assert mock_requests_get.call_args[1]['params'].get('format') is None
+    with pytest.raises(ValueError):
+        client.get_df(format='csv')
+
+
+@mock.patch('requests.Session.get')
+def test_error_body_is_passed_through(mock_requests_get):
+    mock_data_response(mock_requests_get, {'error': 'Bad Request'})
+    assert lib.get_data_points(MOCK_TOKEN, MOCK_HOST, metric_id=1,
+                               format='dataframe') == {'error': 'Bad Request'}
@@ -0,0 +1,28 @@
+import sys
+
+import pytest
+
+from api.client import circuit_breaker, lib
+
+collect_ignore = []
+if sys.version_info < (3, 5):
+    # async/await syntax
+    collect_ignore.append('async_client_test.py')
+
+
+@pytest.fixture(autouse=True)
+def reset_circuit_breakers():
+    # Circuit breakers are process-wide, don't let failures simulated by one test open them for
+    # the next ones.
+    circuit_breaker.reset_circuit_breakers()
+    yield
+    circuit_breaker.reset_circuit_breakers()
+
+
+@pytest.fixture(autouse=True)
+def clear_entity_store():
+    # The entity store is process-wide too: entities mocked by one test must not be returned by
+    # lookups in the next ones.
+    lib.entity_store.clear()
+    yield
+    lib.entity_store.clear()
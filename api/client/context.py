@@ -0,0 +1,178 @@
+"""Per-client request state and the middleware chain requests pass through.
+
+A RequestContext is created once per client. It precomputes the URLs and static headers for the
+client's API host and access token, and sends every request through a chain of middleware before
+it reaches the transport (lib.get_data). Cross-cutting features like caching or metrics are added
+as middleware rather than by changing get_data.
+
+A middleware is any callable taking the Request and the next handler in the chain, and returning
+the response::
+
+    def log_slow_requests(request, next_handler):
+        start_time = time.time()
+        response = next_handler(request)
+        if time.time() - start_time > 10:
+            logger.warning('Slow request to {}'.format(request.url))
+        return response
+
+    client.add_middleware(log_slow_requests)
+"""
+
+import threading
+import time
+
+
+class Request(object):
+    """A request going through the middleware chain. Middleware may modify it."""
+
+    def __init__(self, url, headers, params=None, logger=None, stream=False):
+        self.url = url
+        self.headers = headers
+        self.params = params
+        self.logger = logger
+        self.stream = stream
+
+    def __repr__(self):
+        return 'Request({!r}, params={!r})'.format(self.url, self.params)
+
+
+class RequestContext(object):
+    """URLs, headers and middleware for the requests of one client.
+
+    Parameters
+    ----------
+    api_host : string
+    access_token : string
+    transport : function
+        The last handler of the chain, which actually makes the request. Takes a Request and
+        returns a response.
+    static_headers : dict, optional
+        Headers sent with every request, in addition to the authorization header.
+
+    """
+
+    def __init__(self, api_host, access_token, transport, static_headers=None):
+        self.api_host = api_host
+        self.access_token = access_token
+        self.base_url = 'https://{}/'.format(api_host)
+        self.headers = {'authorization': 'Bearer ' + access_token}
+        self.headers.update(static_headers or {})
+        self._transport = transport
+        self._urls = {}
+        self._middleware = []
+        self._lock = threading.Lock()
+        self._handler = transport
+
+    def url(self, path):
+        """Get the full URL of an endpoint, e.g. 'v2/data'."""
+        try:
+            return self._urls[path]
+        except KeyError:
+            return self._urls.setdefault(path, self.base_url + path)
+
+    def get_middleware(self):
+        return list(self._middleware)
+
+    def add_middleware(self, middleware, index=None):
+        """Add a middleware to the chain.
+
+        Parameters
+        ----------
+        middleware : function
+            Takes a Request and the next handler, returns a response.
+        index : integer, optional
+            Position in the chain, 0 being the first to see each request. Appended by default, so
+            that it is closest to the transport.
+
+        """
+        with self._lock:
+            if index is None:
+                self._middleware.append(middleware)
+            else:
+                self._middleware.insert(index, middleware)
+            self._build_chain()
+
+    def remove_middleware(self, middleware):
+        with self._lock:
+            self._middleware.remove(middleware)
+            self._build_chain()
+
+    def _build_chain(self):
+        handler = self._transport
+        for middleware in reversed(self._middleware):
+            handler = _bind(middleware, handler)
+        self._handler = handler
+
+    def send(self, request):
+        """Pass a request through the middleware chain."""
+        return self._handler(request)
+
+    def get(self, path, params=None, stream=False, logger=None):
+        """Make a GET request to an endpoint of the API host.
+
+        Parameters
+        ----------
+        path : string
+            e.g. 'v2/data'
+        params : dict, optional
+        stream : boolean, optional
+        logger : logging.Logger, optional
+
+        Returns
+        -------
+        requests.Response
+
+        """
+        return self.send(Request(self.url(path), dict(self.headers), params, logger, stream))
+
+
+def _bind(middleware, next_handler):
+    def handler(request):
+        return middleware(request, next_handler)
+    return handler
+
+
+class RequestMetrics(object):
+    """Middleware counting requests, failures and time spent per endpoint.
+
+    Example::
+
+        metrics = RequestMetrics()
+        client.add_middleware(metrics)
+        ...
+        metrics.get_stats()
+        # {'https://api.gro-intelligence.com/v2/data':
+        #     {'requests': 12, 'errors': 0, 'elapsed_time_in_ms': 5321.2}, ...}
+
+    Time spent waiting on retries is included, since it is measured around the whole call to the
+    next handler.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def __call__(self, request, next_handler):
+        start_time = time.time()
+        errors = 0
+        try:
+            return next_handler(request)
+        except Exception:
+            errors = 1
+            raise
+        finally:
+            elapsed_time = time.time() - start_time
+            with self._lock:
+                stats = self._stats.setdefault(request.url, {'requests': 0, 'errors': 0,
+                                                             'elapsed_time_in_ms': 0.0})
+                stats['requests'] += 1
+                stats['errors'] += errors
+                stats['elapsed_time_in_ms'] += 1000 * elapsed_time
+
+    def get_stats(self):
+        with self._lock:
+            return dict((url, dict(stats)) for url, stats in self._stats.items())
+
+    def reset(self):
+        with self._lock:
+            self._stats.clear()
@@ -0,0 +1,78 @@
+import mock
+
+from api.client import Client, lib
+from api.client.context import Request, RequestContext, RequestMetrics
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.token'
+
+
+def test_url_and_headers():
+    context = RequestContext(MOCK_HOST, MOCK_TOKEN, None, {'python-version': '3'})
+    assert context.url('v2/data') == 'https://pytest.groclient.url/v2/data'
+    assert context.url('v2/data') is context.url('v2/data')
+    assert context.headers == {'authorization': 'Bearer ' + MOCK_TOKEN, 'python-version': '3'}
+
+
+def test_middleware_order():
+    calls = []
+
+    def transport(request):
+        calls.append(('transport', request.params))
+        return 'response'
+
+    def middleware(name):
+        def handler(request, next_handler):
+            calls.append((name, dict(request.params)))
+            request.params[name] = True
+            return next_handler(request)
+        return handler
+
+    context = RequestContext(MOCK_HOST, MOCK_TOKEN, transport)
+    second = middleware('second')
+    context.add_middleware(second)
+    context.add_middleware(middleware('first'), 0)
+    assert context.get('v2/items', {}) == 'response'
+    assert calls == [('first', {}),
+                     ('second', {'first': True}),
+                     ('transport', {'first': True, 'second': True})]
+
+    context.remove_middleware(second)
+    del calls[:]
+    context.get('v2/items', {})
+    assert [name for name, _ in calls] == ['first', 'transport']
+
+
+def test_request_metrics():
+    metrics = RequestMetrics()
+    metrics(Request('https://host/v2/data', {}), lambda request: None)
+    try:
+        metrics(Request('https://host/v2/data', {}), mock.Mock(side_effect=ValueError))
+    except ValueError:
+        pass
+    stats = metrics.get_stats()['https://host/v2/data']
+    assert stats['requests'] == 2
+    assert stats['errors'] == 1
+
+
+@mock.patch('requests.Session.get')
+def test_client_middleware(mock_requests_get):
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.json.return_value = {'data': {'1': {'id': 1}}}
+    seen = []
+
+    def middleware(request, next_handler):
+        seen.append(request.url)
+        return next_handler(request)
+
+    client = Client(MOCK_HOST, MOCK_TOKEN)
+    client.add_middleware(middleware)
+    assert client.lookup('items', 1) == {'id': 1}
+    assert seen == ['https://pytest.groclient.url/v2/items']
+    # Other clients and lib functions called directly are not affected
+    Client(MOCK_HOST, MOCK_TOKEN).lookup('items', 1)
+    lib.lookup(MOCK_TOKEN, MOCK_HOST, 'items', 1)
+    assert len(seen) == 1
+    headers = mock_requests_get.call_args[1]['headers']
+    assert headers['authorization'] == 'Bearer ' + MOCK_TOKEN
+    assert 'python-version' in headers
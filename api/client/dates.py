@@ -0,0 +1,74 @@
+"""Vectorized parsing of the API's dates.
+
+Dates in API responses have a fixed format, e.g. '2017-01-01T00:00:00.000Z'. Rather than
+parsing them one at a time, as pandas.to_datetime() does for columns of strings,
+:func:`parse_dates` converts a whole column to a fixed-width array of bytes and has NumPy parse
+it in a single pass.
+"""
+
+import numpy as np
+import pandas
+
+
+def parse_dates(values, utc=False):
+    """Convert a column of dates, as returned by the API, to datetime64[ns] values.
+
+    >>> dates = parse_dates(['2017-01-01T00:00:00.000Z', None, '2018-02-28T12:30:15.250Z'])
+    >>> dates.dtype
+    dtype('<M8[ns]')
+    >>> [str(date) for date in dates]
+    ['2017-01-01T00:00:00.000000000', 'NaT', '2018-02-28T12:30:15.250000000']
+    >>> [str(date) for date in parse_dates(['2016-02-29', '1969-12-31'])]
+    ['2016-02-29T00:00:00.000000000', '1969-12-31T00:00:00.000000000']
+    >>> parse_dates(['2017-01-01T00:00:00.000Z'], utc=True)
+    DatetimeIndex(['2017-01-01 00:00:00+00:00'], dtype='datetime64[ns, UTC]', freq=None)
+
+    Parameters
+    ----------
+    values : list, NumPy array or pandas.Series
+        ISO 8601 date strings, or None for missing dates
+    utc : boolean, optional
+        If True, return a pandas.DatetimeIndex localized to UTC, the time zone of the API's
+        dates, as pandas.to_datetime() returns for them.
+
+    Returns
+    -------
+    NumPy array of datetime64[ns], or pandas.DatetimeIndex
+
+    Raises
+    ------
+    ValueError
+        If a value is not a valid date
+
+    """
+    values = np.asarray(values, dtype=object)
+    result = np.full(len(values), np.datetime64('NaT'), dtype='datetime64[ns]')
+    present = ~pandas.isnull(values)
+    strings = values[present]
+    if len(strings):
+        try:
+            encoded = strings.astype(np.bytes_)
+        except UnicodeEncodeError:
+            raise ValueError('Invalid dates in {}'.format(strings))
+        # NumPy doesn't parse time zones, the API's dates are all in UTC. When all the dates have
+        # the same length, as in API responses, 'Z' is dropped by making the array narrower.
+        lengths = np.char.str_len(encoded)
+        has_zone = np.char.endswith(encoded, b'Z')
+        if has_zone.any():
+            if has_zone.all() and (lengths == lengths[0]).all():
+                encoded = encoded.astype('S{}'.format(lengths[0] - 1))
+            else:
+                encoded = np.array([string[:-1] if string.endswith(b'Z') else string
+                                    for string in encoded])
+        result[present] = encoded.astype('datetime64[ns]')
+    if utc:
+        return pandas.DatetimeIndex(result).tz_localize('UTC')
+    return result
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python dates.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
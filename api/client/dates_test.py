@@ -0,0 +1,34 @@
+import numpy as np
+import pandas
+import pytest
+
+from api.client.dates import parse_dates
+
+DATES = ['2017-01-01T00:00:00.000Z', None, '2018-02-28T12:30:15.250Z', '2019-12-31']
+
+
+def test_matches_pandas():
+    expected = pandas.to_datetime(pandas.Series(DATES[:3]), utc=True)
+    result = parse_dates(DATES[:3], utc=True)
+    assert str(result.tz) == 'UTC'
+    # Recent versions of pandas may parse to another resolution than ns
+    assert [str(date) for date in result] == [str(date) for date in expected]
+
+
+def test_mixed_formats():
+    dates = parse_dates(pandas.Series(DATES))
+    assert [str(date)[:10] for date in dates] == ['2017-01-01', 'NaT', '2018-02-28',
+                                                  '2019-12-31']
+
+
+def test_missing_dates():
+    dates = parse_dates([None, float('nan')])
+    assert np.isnat(dates).all()
+    assert len(parse_dates([])) == 0
+
+
+def test_invalid_dates():
+    with pytest.raises(ValueError):
+        parse_dates(['2017-13-01T00:00:00.000Z'])
+    with pytest.raises(ValueError):
+        parse_dates([u'2017-01-01T00:00:00.000Z\u00e9'])
@@ -0,0 +1,119 @@
+"""Deadlines bounding the total time spent on a call, retries and backoff included.
+
+A deadline is set for a block of code with :func:`~.deadline`. Every request made in that block by
+the current thread, however many lib functions or Client methods it goes through, shares the same
+time budget: request timeouts and backoff delays are cut to the time remaining, and once it runs
+out :class:`~api.client.lib.DeadlineExceeded` is raised instead of retrying::
+
+    with deadline(5):
+        client.get_descendant_regions(1215, 4)  # contains + lookup requests, 5 seconds in total
+
+On Python 3.7+, the deadline is held in a context variable, so each asyncio task has its own: a
+deadline set in one coroutine does not apply to the others running on the same thread. Tasks
+started in the block inherit it. On older versions, it is held per thread.
+"""
+
+from contextlib import contextmanager
+import threading
+
+try:
+    # Python 3.7+
+    from contextvars import ContextVar
+except ImportError:
+    ContextVar = None
+
+try:
+    # Python 3
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+
+
+class Deadline(object):
+    """A point in time by which some work must be done."""
+
+    def __init__(self, timeout):
+        """
+        Parameters
+        ----------
+        timeout : float
+            Seconds from now
+
+        """
+        self.timeout = timeout
+        self.expires_at = monotonic() + timeout
+
+    def remaining(self):
+        """Seconds left before the deadline, 0 if it has passed."""
+        return max(0.0, self.expires_at - monotonic())
+
+    def expired(self):
+        return self.remaining() <= 0
+
+    def __repr__(self):
+        return 'Deadline({:.3f}s remaining)'.format(self.remaining())
+
+
+class _ThreadLocalVar(object):
+    """The part of the ContextVar interface used here, with one value per thread."""
+
+    def __init__(self, name, default=None):
+        self.name = name
+        self._default = default
+        self._local = threading.local()
+
+    def get(self):
+        return getattr(self._local, 'value', self._default)
+
+    def set(self, value):
+        token = self.get()
+        self._local.value = value
+        return token
+
+    def reset(self, token):
+        self._local.value = token
+
+
+_current_deadline = (ContextVar or _ThreadLocalVar)('deadline', default=None)
+
+
+def get_current_deadline():
+    """Get the deadline set for the current task or thread, if any.
+
+    Returns
+    -------
+    Deadline or None
+
+    """
+    return _current_deadline.get()
+
+
+@contextmanager
+def deadline(timeout):
+    """Bound the time spent on all requests made in a block by the current task or thread.
+
+    Nested deadlines can only shorten the enclosing one.
+
+    Parameters
+    ----------
+    timeout : float or None
+        Seconds. None sets no deadline.
+
+    Yields
+    ------
+    Deadline or None
+        The deadline in effect in the block
+
+    """
+    outer = get_current_deadline()
+    inner = outer
+    if timeout is not None:
+        inner = Deadline(timeout)
+        if outer is not None and outer.expires_at < inner.expires_at:
+            inner = outer
+    token = _current_deadline.set(inner)
+    try:
+        yield inner
+    finally:
+        _current_deadline.reset(token)
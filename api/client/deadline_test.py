@@ -0,0 +1,112 @@
+import gc
+import json
+import time
+
+import mock
+import pytest
+from tornado import gen
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPRequest, HTTPResponse
+from tornado.httputil import HTTPHeaders
+from tornado.ioloop import IOLoop
+
+from api.client import cfg, lib
+from api.client.batch_client import BatchClient
+from api.client.deadline import deadline, get_current_deadline
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.token'
+
+
+def test_nested_deadlines():
+    assert get_current_deadline() is None
+    with deadline(10) as outer:
+        assert get_current_deadline() is outer
+        with deadline(100) as inner:
+            # Can't extend the enclosing deadline
+            assert inner is outer
+        with deadline(1) as inner:
+            assert inner.remaining() <= 1
+            assert get_current_deadline() is inner
+        with deadline(None) as inner:
+            assert inner is outer
+        assert get_current_deadline() is outer
+    assert get_current_deadline() is None
+
+
+@mock.patch.object(cfg, 'BACKOFF_BASE', 10)
+@mock.patch('requests.Session.get')
+def test_get_data_deadline(mock_requests_get):
+    mock_requests_get.return_value.status_code = 503
+    start_time = time.time()
+    with pytest.raises(lib.DeadlineExceeded) as err:
+        with deadline(0.5):
+            lib.get_data('https://{}/v2/items'.format(MOCK_HOST),
+                         {'authorization': 'Bearer deadline.token'})
+    assert time.time() - start_time < 0.5
+    assert err.value.status_code == 503
+    for call in mock_requests_get.call_args_list:
+        assert call[1]['timeout'] <= 0.5
+
+
+def mock_response(body):
+    request = HTTPRequest('https://{}/v2/data'.format(MOCK_HOST))
+    return HTTPResponse(request, 200, headers=HTTPHeaders(),
+                        buffer=mock.Mock(getvalue=lambda: json.dumps(body).encode('utf-8')))
+
+
+def mock_fetch(hanging_metric_ids):
+    """Requests for the given metric ids never complete, others return one point."""
+    def fetch(http_request):
+        future = Future()
+        metric_id = int(http_request.url.split('metricId=')[1].split('&')[0])
+        if metric_id not in hanging_metric_ids:
+            future.set_result(mock_response([{'series': {},
+                                              'data': [['2000-01-01', '2000-12-31', 1]]}]))
+        return future
+    return fetch
+
+
+def test_batch_deadline():
+    # Own token, so that the rate limit doesn't eat into the deadline
+    client = BatchClient(MOCK_HOST, 'batch.deadline.token')
+    client._http_client = mock.Mock()
+    client._http_client.fetch.side_effect = mock_fetch(hanging_metric_ids=[2, 3])
+    start_time = time.time()
+    results = client.batch_async_get_data_points([{'metric_id': i} for i in range(5)],
+                                                 timeout=0.3)
+    assert time.time() - start_time < 1
+    assert [len(result) if result else result for result in results] == [1, 1, 0, 0, 1]
+
+
+def test_batch_cancel():
+    client = BatchClient(MOCK_HOST, MOCK_TOKEN)
+    client._http_client = mock.Mock()
+    client._http_client.fetch.side_effect = mock_fetch(hanging_metric_ids=[1, 2, 3, 4])
+
+    def map_result(idx, query, response, accumulator):
+        accumulator.append(idx)
+        client.cancel()
+        return accumulator
+
+    assert client.batch_async_get_data_points([{'metric_id': i} for i in range(5)],
+                                              output_list=[], map_result=map_result) == [0]
+
+
+def test_batch_cancel_before_deadline(caplog):
+    client = BatchClient(MOCK_HOST, 'batch.cancel.deadline.token')
+    client._http_client = mock.Mock()
+    client._http_client.fetch.side_effect = mock_fetch(hanging_metric_ids=[1, 2, 3, 4])
+
+    def map_result(idx, query, response, accumulator):
+        accumulator.append(idx)
+        client.cancel()
+        return accumulator
+
+    assert client.batch_async_get_data_points([{'metric_id': i} for i in range(5)],
+                                              output_list=[], map_result=map_result,
+                                              timeout=0.1) == [0]
+    # Past the deadline of the cancelled batch, nothing is left to time out
+    IOLoop.current().run_sync(lambda: gen.sleep(0.2))
+    gc.collect()
+    assert 'never retrieved' not in caplog.text
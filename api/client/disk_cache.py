@@ -0,0 +1,387 @@
+"""Persistent cache of ontology responses, shared by all processes on a machine.
+
+Entity metadata (lookup, get_available, search, get_allowed_units) rarely changes, but every new
+process downloads it again. With the disk cache enabled, those responses are kept in a SQLite
+database, so that short-lived processes start with a warm cache::
+
+    from api.client import disk_cache
+    disk_cache.enable_disk_cache()  # ~/.cache/gro/api-client.sqlite by default
+
+Entries expire after a time that depends on the kind of response, see :data:`DEFAULT_TTLS`.
+Entries are kept per API host and access token, with only a hash of the token stored. When the
+database grows beyond its maximum size, the least recently used entries are evicted. So that
+reads don't need the write lock, the last access time of an entry is only updated by reads once
+it is more than cfg.DISK_CACHE_TOUCH_INTERVAL old.
+
+Any number of threads and processes may use the same database: SQLite serializes writes, and
+readers are not blocked by writers in WAL mode. If the database can't be used, e.g. because the
+disk is full or the file is corrupt, requests are made as if the cache was disabled.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+from api.client import cfg, json_backend, offline
+
+# Bumped when the layout of the database or of the cached values changes. Databases with another
+# version are emptied and recreated.
+SCHEMA_VERSION = 1
+
+# Seconds before cached entries of each kind expire
+DEFAULT_TTLS = {
+    'entities': 7 * 24 * 3600,  # lookup
+    'available': 24 * 3600,  # get_available
+    'allowed_units': 7 * 24 * 3600,  # get_allowed_units
+    'search': 24 * 3600,  # search, universal_search
+}
+
+_logger = logging.getLogger(__name__)
+
+
+def get_default_path():
+    """Get the default location of the cache database, in the user's cache directory."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),
+                                                                   '.cache')
+    return os.path.join(cache_home, 'gro', 'api-client.sqlite')
+
+
+def hash_token(access_token):
+    """Get a digest of an access token, to scope cached entries without storing the token."""
+    return hashlib.sha256(access_token.encode('utf-8')).hexdigest()[:32]
+
+
+class DiskCache(object):
+    """A size-bounded key-value store in a SQLite database, with expiring entries.
+
+    Values are anything that can be encoded as JSON. They are stored compressed.
+
+    Parameters
+    ----------
+    path : string
+        Location of the database file. Created if it doesn't exist.
+    max_size : integer, optional
+        Maximum total size of the stored values, in bytes
+
+    touch_interval : float, optional
+        Seconds before a read updates the last access time of an entry, which decides the order
+        of eviction. Defaults to cfg.DISK_CACHE_TOUCH_INTERVAL.
+
+    """
+
+    def __init__(self, path, max_size=None, touch_interval=None):
+        self.path = path
+        self.max_size = max_size or cfg.DISK_CACHE_MAX_SIZE
+        self.touch_interval = (touch_interval if touch_interval is not None
+                               else cfg.DISK_CACHE_TOUCH_INTERVAL)
+        self._local = threading.local()
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                if not os.path.isdir(directory):  # Not created concurrently by another process
+                    raise
+        self._create_schema(self._connect())
+
+    def _connect(self):
+        # sqlite3 connections can't be shared between threads, nor between processes after a
+        # fork.
+        connection = getattr(self._local, 'connection', None)
+        if connection is None or self._local.pid != os.getpid():
+            connection = sqlite3.connect(self.path, timeout=cfg.DISK_CACHE_LOCK_TIMEOUT,
+                                         isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _create_schema(self, connection):
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            version = connection.execute('PRAGMA user_version').fetchone()[0]
+            if version != SCHEMA_VERSION:
+                connection.execute('DROP TABLE IF EXISTS entries')
+            connection.execute('CREATE TABLE IF NOT EXISTS entries ('
+                               'key TEXT PRIMARY KEY, '
+                               'value BLOB NOT NULL, '
+                               'size INTEGER NOT NULL, '
+                               'expires_at REAL NOT NULL, '
+                               'accessed_at REAL NOT NULL)')
+            connection.execute('CREATE INDEX IF NOT EXISTS entries_accessed_at '
+                               'ON entries (accessed_at)')
+            connection.execute('PRAGMA user_version = {:d}'.format(SCHEMA_VERSION))
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def get_many(self, keys):
+        """Get the values of the keys that are in the cache and have not expired.
+
+        In offline mode (see :mod:`api.client.offline`), expired values are returned too: they
+        are kept until the next write, and are better than nothing.
+
+        Parameters
+        ----------
+        keys : list of strings
+
+        Returns
+        -------
+        dict
+            Values by key. Keys that are missing or expired are left out.
+
+        """
+        keys = list(keys)
+        now = time.time()
+        min_expiry = 0 if offline.is_offline() else now
+        values = {}
+        touched = []
+        connection = self._connect()
+        # Stay below SQLite's limit on the number of query parameters
+        for start in range(0, len(keys), 500):
+            batch = keys[start:start + 500]
+            placeholders = ','.join('?' * len(batch))
+            rows = connection.execute(
+                'SELECT key, value, accessed_at FROM entries '
+                'WHERE expires_at > ? AND key IN ({})'.format(placeholders),
+                [min_expiry] + batch).fetchall()
+            for key, value, accessed_at in rows:
+                try:
+                    values[key] = json_backend.loads(zlib.decompress(value))
+                except (zlib.error, ValueError) as e:
+                    # Corrupt entry: a miss, replaced when the response is cached again
+                    _logger.warning('Ignoring corrupt disk cache entry: {}'.format(e))
+                    continue
+                if accessed_at < now - self.touch_interval:
+                    touched.append(key)
+        for start in range(0, len(touched), 500):
+            batch = touched[start:start + 500]
+            connection.execute('UPDATE entries SET accessed_at = ? WHERE key IN ({})'.format(
+                ','.join('?' * len(batch))), [now] + batch)
+        return values
+
+    def get(self, key, default=None):
+        return self.get_many([key]).get(key, default)
+
+    def set_many(self, items, ttl):
+        """Store values.
+
+        Parameters
+        ----------
+        items : dict
+            Values by key
+        ttl : float
+            Seconds before the values expire
+
+        """
+        now = time.time()
+        rows = []
+        for key, value in items.items():
+            blob = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+            rows.append((key, sqlite3.Binary(blob), len(blob), now + ttl, now))
+        if not rows:
+            return
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            connection.executemany('INSERT OR REPLACE INTO entries '
+                                   '(key, value, size, expires_at, accessed_at) '
+                                   'VALUES (?, ?, ?, ?, ?)', rows)
+            self._evict(connection, now)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def set(self, key, value, ttl):
+        self.set_many({key: value}, ttl)
+
+    def update(self, key, value):
+        """Replace the value of an entry, keeping its expiry time. Does nothing if it is missing.
+
+        Returns
+        -------
+        boolean
+            Whether the entry was there
+
+        """
+        now = time.time()
+        blob = zlib.compress(json.dumps(value, separators=(',', ':')).encode('utf-8'))
+        connection = self._connect()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            updated = connection.execute(
+                'UPDATE entries SET value = ?, size = ?, accessed_at = ? '
+                'WHERE key = ? AND expires_at > ?',
+                (sqlite3.Binary(blob), len(blob), now, key, now)).rowcount
+            self._evict(connection, now)
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+        return updated > 0
+
+    def _evict(self, connection, now):
+        connection.execute('DELETE FROM entries WHERE expires_at <= ?', (now,))
+        total_size = connection.execute('SELECT COALESCE(SUM(size), 0) FROM entries').fetchone()[0]
+        if total_size <= self.max_size:
+            return
+        # Evict down to 90% of the maximum, so that eviction doesn't run on every write
+        excess = total_size - int(0.9 * self.max_size)
+        evicted = 0
+        keys = []
+        for key, size in connection.execute('SELECT key, size FROM entries '
+                                            'ORDER BY accessed_at'):
+            keys.append(key)
+            evicted += size
+            if evicted >= excess:
+                break
+        connection.executemany('DELETE FROM entries WHERE key = ?', [(key,) for key in keys])
+        _logger.debug('Evicted {} entries from the disk cache'.format(len(keys)))
+
+    def delete(self, keys):
+        self._connect().executemany('DELETE FROM entries WHERE key = ?',
+                                    [(key,) for key in keys])
+
+    def clear(self):
+        self._connect().execute('DELETE FROM entries')
+
+    def get_stats(self):
+        """Get the number of entries and their total size in bytes."""
+        count, size = self._connect().execute(
+            'SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries').fetchone()
+        return {'entries': count, 'size': size}
+
+    def close(self):
+        connection = getattr(self._local, 'connection', None)
+        if connection is not None and self._local.pid == os.getpid():
+            connection.close()
+        self._local.connection = None
+
+
+_cache = None
+
+
+def enable_disk_cache(path=None, max_size=None):
+    """Keep ontology responses in a database on disk, shared by all processes.
+
+    Parameters
+    ----------
+    path : string, optional
+        Location of the database. Defaults to :func:`~get_default_path`.
+    max_size : integer, optional
+        Maximum size of the cached responses in bytes. Defaults to cfg.DISK_CACHE_MAX_SIZE.
+
+    Returns
+    -------
+    DiskCache or None
+        None if the database can't be used, e.g. because the file is corrupt. Requests are then
+        made as if the cache was disabled.
+
+    """
+    global _cache
+    disable_disk_cache()
+    path = path or get_default_path()
+    try:
+        _cache = DiskCache(path, max_size)
+    except sqlite3.Error as e:
+        _logger.warning('Disk cache {} disabled: {}'.format(path, e))
+    return _cache
+
+
+def disable_disk_cache():
+    global _cache
+    cache, _cache = _cache, None
+    if cache is not None:
+        cache.close()
+
+
+def get_disk_cache():
+    """Get the enabled disk cache.
+
+    Returns
+    -------
+    DiskCache or None
+
+    """
+    return _cache
+
+
+def make_key(kind, api_host, access_token, *parts):
+    """Get the key of a cached response.
+
+    >>> make_key('entities', 'api.gro-intelligence.com', 'token', 'regions', 1215)
+    '["entities", "api.gro-intelligence.com", "3c469e9d6c5875d37a43f353d4f88e61", "regions", 1215]'
+
+    """
+    # default=str for numpy integers and the like
+    return json.dumps([kind, api_host, hash_token(access_token)] + list(parts), default=str)
+
+
+def get_cached(kind, api_host, access_token, keys_parts):
+    """Look up cached responses in the enabled disk cache.
+
+    Parameters
+    ----------
+    kind : string
+        One of the keys of DEFAULT_TTLS
+    api_host : string
+    access_token : string
+    keys_parts : list of tuples
+        What identifies each response, e.g. (entity_type, entity_id)
+
+    Returns
+    -------
+    dict
+        Cached values by their key parts. Empty if the cache is disabled or can't be read.
+
+    """
+    cache = _cache
+    if cache is None or not keys_parts:
+        return {}
+    keys = dict((make_key(kind, api_host, access_token, *parts), parts) for parts in keys_parts)
+    try:
+        values = cache.get_many(keys)
+    except (sqlite3.Error, zlib.error, ValueError) as e:
+        _logger.warning('Disk cache read failed: {}'.format(e))
+        return {}
+    return dict((keys[key], value) for key, value in values.items())
+
+
+def set_cached(kind, api_host, access_token, values):
+    """Store responses in the enabled disk cache, if any.
+
+    Parameters
+    ----------
+    kind : string
+        One of the keys of DEFAULT_TTLS
+    api_host : string
+    access_token : string
+    values : dict
+        Values by their key parts, see :func:`~get_cached`
+
+    """
+    cache = _cache
+    if cache is None or not values:
+        return
+    try:
+        cache.set_many(dict((make_key(kind, api_host, access_token, *parts), value)
+                            for parts, value in values.items()),
+                       DEFAULT_TTLS[kind])
+    except sqlite3.Error as e:
+        _logger.warning('Disk cache write failed: {}'.format(e))
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python disk_cache.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
@@ -0,0 +1,138 @@
+import os
+import sqlite3
+import time
+import zlib
+
+import mock
+import pytest
+
+from api.client import disk_cache, lib
+from api.client.disk_cache import DiskCache
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.disk_cache.token'
+
+
+@pytest.fixture
+def cache(tmpdir):
+    cache = disk_cache.enable_disk_cache(os.path.join(str(tmpdir), 'gro', 'cache.sqlite'))
+    yield cache
+    disk_cache.disable_disk_cache()
+
+
+def test_get_set(tmpdir):
+    cache = DiskCache(os.path.join(str(tmpdir), 'cache.sqlite'))
+    cache.set('a', {'id': 1, 'name': 'a'}, ttl=60)
+    assert cache.get('a') == {'id': 1, 'name': 'a'}
+    assert cache.get('b') is None
+    cache.set('b', [1, 2], ttl=-1)  # already expired
+    assert cache.get_many(['a', 'b']) == {'a': {'id': 1, 'name': 'a'}}
+    # Shared with other connections to the same database, e.g. in other processes
+    other_cache = DiskCache(cache.path)
+    assert other_cache.get('a') == {'id': 1, 'name': 'a'}
+
+
+def test_eviction(tmpdir):
+    cache = DiskCache(os.path.join(str(tmpdir), 'cache.sqlite'), max_size=1000)
+    value = os.urandom(200).hex() if hasattr(bytes, 'hex') else os.urandom(200).encode('hex')
+    start_time = time.time()
+    for i in range(10):
+        with mock.patch('time.time', return_value=start_time - 100 + i):
+            cache.set(str(i), value, ttl=3600)
+    assert cache.get_stats()['size'] <= 1000
+    # The least recently used entries are evicted first
+    assert cache.get('0') is None
+    assert cache.get('9') == value
+
+
+def test_reads_only_touch_stale_entries(tmpdir):
+    cache = DiskCache(os.path.join(str(tmpdir), 'cache.sqlite'), touch_interval=60)
+    cache.set_many({'a': 1, 'b': 2}, ttl=3600)
+    connection = cache._connect()
+    connection.execute('UPDATE entries SET accessed_at = accessed_at - 120 WHERE key = ?', ('b',))
+    accessed_at = dict(connection.execute('SELECT key, accessed_at FROM entries'))
+    assert cache.get_many(['a', 'b']) == {'a': 1, 'b': 2}
+    new_accessed_at = dict(connection.execute('SELECT key, accessed_at FROM entries'))
+    # Recently accessed entries are not written to on every read
+    assert new_accessed_at['a'] == accessed_at['a']
+    assert new_accessed_at['b'] > accessed_at['b']
+
+
+def test_corrupt_entries_are_misses(tmpdir):
+    cache = DiskCache(os.path.join(str(tmpdir), 'cache.sqlite'))
+    cache.set_many({'a': 1, 'b': 2, 'c': 3}, ttl=3600)
+    connection = cache._connect()
+    connection.execute('UPDATE entries SET value = ? WHERE key = ?',
+                       (sqlite3.Binary(b'not zlib'), 'a'))
+    connection.execute('UPDATE entries SET value = ? WHERE key = ?',
+                       (sqlite3.Binary(zlib.compress(b'{not json')), 'b'))
+    assert cache.get_many(['a', 'b', 'c']) == {'c': 3}
+
+
+def test_schema_version(tmpdir):
+    path = os.path.join(str(tmpdir), 'cache.sqlite')
+    DiskCache(path).set('a', 1, ttl=60)
+    with mock.patch('api.client.disk_cache.SCHEMA_VERSION', disk_cache.SCHEMA_VERSION + 1):
+        assert DiskCache(path).get('a') is None
+
+
+@mock.patch('requests.Session.get')
+def test_corrupt_database_is_ignored(mock_requests_get, tmpdir):
+    path = os.path.join(str(tmpdir), 'cache.sqlite')
+    with open(path, 'wb') as garbage:
+        garbage.write(b'not a database' * 100)
+    assert disk_cache.enable_disk_cache(path) is None
+    assert disk_cache.get_disk_cache() is None
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.json.return_value = {'data': {'1': {'id': 1}}}
+    assert lib.lookup(MOCK_TOKEN, MOCK_HOST, 'items', 1) == {'id': 1}
+
+
+@mock.patch('requests.Session.get')
+def test_lookup_uses_disk_cache(mock_requests_get, cache):
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.json.return_value = {
+        'data': {'1': {'id': 1, 'name': 'one'}, '2': {'id': 2, 'name': 'two'}}}
+    assert lib.lookup(MOCK_TOKEN, MOCK_HOST, 'items', [1, 2]) == {
+        '1': {'id': 1, 'name': 'one'}, '2': {'id': 2, 'name': 'two'}}
+    assert mock_requests_get.call_count == 1
+
+    # Cached entities are not requested again, also when looked up individually
+    assert lib.lookup(MOCK_TOKEN, MOCK_HOST, 'items', 2) == {'id': 2, 'name': 'two'}
+    mock_requests_get.return_value.json.return_value = {'data': {'3': {'id': 3}}}
+    assert lib.lookup(MOCK_TOKEN, MOCK_HOST, 'items', [1, 3]) == {
+        '1': {'id': 1, 'name': 'one'}, '3': {'id': 3}}
+    assert mock_requests_get.call_count == 2
+    assert mock_requests_get.call_args[1]['params'] == {'ids': [3]}
+
+    # Entries are per access token
+    lib.lookup(MOCK_TOKEN + '2', MOCK_HOST, 'items', 3)
+    assert mock_requests_get.call_count == 3
+
+
+@mock.patch('requests.Session.get')
+def test_search_uses_disk_cache(mock_requests_get, cache):
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.json.return_value = [{'id': 274}]
+    context = lib.new_request_context(MOCK_TOKEN, MOCK_HOST)
+    # Bypass the in-memory cache to simulate a new process
+    search = lib.search.__wrapped__
+    assert search(MOCK_TOKEN, MOCK_HOST, 'items', 'corn', context) == [{'id': 274}]
+    assert search(MOCK_TOKEN, MOCK_HOST, 'items', 'corn', context) == [{'id': 274}]
+    assert mock_requests_get.call_count == 1
+
+
+@mock.patch('requests.Session.get')
+def test_unusable_cache_is_ignored(mock_requests_get, cache):
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.json.return_value = {'data': {'1': {'id': 1}}}
+    with mock.patch.object(DiskCache, 'get_many', side_effect=sqlite3.OperationalError('locked')):
+        assert lib.lookup(MOCK_TOKEN, MOCK_HOST, 'items', 1) == {'id': 1}
+
+
+@mock.patch('requests.Session.get')
+def test_undecodable_cache_is_ignored(mock_requests_get, cache):
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.json.return_value = {'data': {'1': {'id': 1}}}
+    with mock.patch.object(DiskCache, 'get_many', side_effect=zlib.error('corrupt')):
+        assert lib.lookup(MOCK_TOKEN, MOCK_HOST, 'items', 1) == {'id': 1}
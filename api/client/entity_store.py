@@ -0,0 +1,244 @@
+"""In-memory store of entity details, for lookup().
+
+Entity details are looked up over and over: unit conversion looks up the units of every data
+point, and names are looked up per key of every selection. The store keeps the entities it has
+seen by (entity_type, id), so that lookups of known entities don't make any request. Ids that
+turned out not to exist are remembered for cfg.ENTITY_STORE_MISS_TTL seconds too, so that
+looking them up again and again doesn't make a request each time. Callers get their own copies of
+the stored entities, which they may modify.
+
+Entities that are not in the store are fetched in batches. While a batch of an entity type is
+being fetched, the ids missed by other threads in the meantime are queued, and fetched together
+in the next batch, so that many threads looking up different entities at the same time make a
+few chunked requests rather than one request each.
+
+A batch is fetched by one of the waiting threads, with its own fetch function. If that fails,
+only that thread gets the error: the ids of the other threads are queued again and fetched by
+one of them, so that a short deadline or a failing middleware of one caller doesn't make the
+lookups of unrelated callers fail.
+"""
+
+import copy
+import threading
+
+from api.client import cfg
+from api.client.deadline import get_current_deadline
+from api.client.memory_cache import LRUCache
+from api.client.singleflight import WaitTimeout
+from api.client.utils import list_chunk
+
+
+class _Waiter(object):
+    """An entity being waited for by one or more callers."""
+
+    def __init__(self, entity_id):
+        self.entity_id = entity_id
+        self.done = False
+        self.entity = None
+        self.found = False
+        self.callers = set()
+        self.errors = {}  # caller -> exception raised by the fetch function of that caller
+
+
+class EntityStore(object):
+    """Entities by (scope, entity_type, id), fetching the missing ones in batches.
+
+    Parameters
+    ----------
+    maxsize : integer, optional
+        Maximum number of entities kept, for all scopes together. Defaults to
+        cfg.ENTITY_STORE_MAXSIZE.
+    ttl : float, optional
+        Seconds after which entities are fetched again. Defaults to cfg.MEMORY_CACHE_TTL.
+    miss_ttl : float, optional
+        Seconds after which the ids of entities that don't exist are fetched again. Defaults to
+        cfg.ENTITY_STORE_MISS_TTL.
+
+    """
+
+    def __init__(self, maxsize=None, ttl=None, miss_ttl=None):
+        self._entities = LRUCache(maxsize or cfg.ENTITY_STORE_MAXSIZE,
+                                  ttl=ttl or cfg.MEMORY_CACHE_TTL)
+        # (scope, entity_type, id) of entities that don't exist
+        self._misses = LRUCache(maxsize or cfg.ENTITY_STORE_MAXSIZE,
+                                ttl=miss_ttl if miss_ttl is not None else cfg.ENTITY_STORE_MISS_TTL)
+        self._condition = threading.Condition()
+        self._waiters = {}  # (scope, entity_type, id) -> _Waiter, queued or being fetched
+        self._queued = {}  # (scope, entity_type) -> waiters to fetch in the next batch
+        self._fetching = set()  # (scope, entity_type) with a batch being fetched
+
+    def get_many(self, entity_type, entity_ids, fetch, scope=None):
+        """Get entities from the store, fetching those that are missing.
+
+        Parameters
+        ----------
+        entity_type : string
+            e.g. 'units'
+        entity_ids : list of integers
+        fetch : function
+            Takes a list of at most 50 ids and returns a dict of entities keyed by id string, like
+            the 'data' of a /v2/{entity_type} response. May be called with ids requested by other
+            threads too.
+        scope : hashable, optional
+            Entities are only shared between calls with the same scope, e.g. the same API host
+            and access token.
+
+        Returns
+        -------
+        dict
+            Copies of the entities, keyed by id string. Ids of entities that don't exist are left
+            out.
+
+        Raises
+        ------
+        WaitTimeout
+            If a deadline is set and ran out while waiting for another thread to fetch entities
+        Exception
+            Whatever exception `fetch` raised
+
+        """
+        caller = object()
+        batch_key = (scope, entity_type)
+        results = {}
+        waiters = {}
+        missing = object()
+        with self._condition:
+            for entity_id in entity_ids:
+                id_str = str(entity_id)
+                key = (scope, entity_type, id_str)
+                entity = self._entities.get(key, missing)
+                if entity is not missing:
+                    results[id_str] = entity
+                    continue
+                if self._misses.get(key):
+                    continue
+                waiter = self._waiters.get(key)
+                if waiter is None:
+                    waiter = self._waiters[key] = _Waiter(entity_id)
+                    self._queued.setdefault(batch_key, []).append(waiter)
+                waiter.callers.add(caller)
+                waiters[id_str] = waiter
+        deadline = get_current_deadline()
+        try:
+            while True:
+                with self._condition:
+                    pending = [waiter for waiter in waiters.values()
+                               if not waiter.done and caller not in waiter.errors]
+                    if not pending:
+                        break
+                    batch = None
+                    if self._queued.get(batch_key) and batch_key not in self._fetching:
+                        # Fetch everything queued so far, including the ids of other threads
+                        batch = self._queued.pop(batch_key)
+                        self._fetching.add(batch_key)
+                    else:
+                        if deadline is not None and deadline.expired():
+                            raise WaitTimeout(entity_type)
+                        self._condition.wait(
+                            deadline.remaining() if deadline is not None else None)
+                if batch is not None:
+                    try:
+                        self._fetch(scope, entity_type, batch, fetch, caller)
+                    finally:
+                        with self._condition:
+                            self._fetching.discard(batch_key)
+                            self._condition.notify_all()
+        finally:
+            with self._condition:
+                for waiter in waiters.values():
+                    waiter.callers.discard(caller)
+        for id_str, waiter in waiters.items():
+            if caller in waiter.errors:
+                raise waiter.errors[caller]
+            if waiter.found:
+                results[id_str] = waiter.entity
+        # The stored entities are shared by all callers
+        return copy.deepcopy(results)
+
+    def get_stored(self, entity_type, entity_ids, scope=None):
+        """Get the entities that are in the store, without fetching the others.
+
+        For callers that fetch the missing entities themselves, e.g. asynchronously, and add them
+        with :meth:`~add`.
+
+        Returns
+        -------
+        tuple
+            Copies of the stored entities keyed by id string, and the list of the ids that are
+            neither stored nor known not to exist
+
+        """
+        results = {}
+        missing_ids = []
+        missing = object()
+        for entity_id in entity_ids:
+            key = (scope, entity_type, str(entity_id))
+            entity = self._entities.get(key, missing)
+            if entity is not missing:
+                results[str(entity_id)] = entity
+            elif not self._misses.get(key):
+                missing_ids.append(entity_id)
+        return copy.deepcopy(results), missing_ids
+
+    def _fetch(self, scope, entity_type, batch, fetch, caller):
+        for waiter_batch in list_chunk(batch):
+            try:
+                entities = fetch([waiter.entity_id for waiter in waiter_batch])
+                error = None
+            except Exception as e:
+                entities = {}
+                error = e
+            with self._condition:
+                for id_str, entity in entities.items():
+                    self._entities.set((scope, entity_type, id_str), entity)
+                for waiter in waiter_batch:
+                    if error is None:
+                        id_str = str(waiter.entity_id)
+                        self._waiters.pop((scope, entity_type, id_str), None)
+                        waiter.found = id_str in entities
+                        if not waiter.found:
+                            self._misses.set((scope, entity_type, id_str), True)
+                        waiter.entity = entities.get(id_str)
+                        waiter.done = True
+                        continue
+                    if caller in waiter.callers:
+                        waiter.errors[caller] = error
+                    if waiter.callers - set(waiter.errors):
+                        # Other callers wait for this entity: one of them fetches it again
+                        self._queued.setdefault((scope, entity_type), []).append(waiter)
+                    else:
+                        self._waiters.pop((scope, entity_type, str(waiter.entity_id)), None)
+                self._condition.notify_all()
+
+    def add(self, entity_type, entities, scope=None, missing_ids=()):
+        """Add entities to the store, e.g. from another response that includes their details.
+
+        Parameters
+        ----------
+        entity_type : string
+        entities : dict
+            Entities keyed by id. Copies of them are stored.
+        scope : hashable, optional
+        missing_ids : list of integers, optional
+            Ids of entities that turned out not to exist
+
+        """
+        for entity_id, entity in entities.items():
+            key = (scope, entity_type, str(entity_id))
+            self._entities.set(key, copy.deepcopy(entity))
+            self._misses.invalidate(key)
+        for entity_id in missing_ids:
+            self._misses.set((scope, entity_type, str(entity_id)), True)
+
+    def invalidate(self, entity_type, entity_id, scope=None):
+        key = (scope, entity_type, str(entity_id))
+        missed = self._misses.invalidate(key)
+        return self._entities.invalidate(key) or missed
+
+    def clear(self):
+        self._entities.clear()
+        self._misses.clear()
+
+    def get_stats(self):
+        """See :meth:`api.client.memory_cache.LRUCache.get_stats`."""
+        return self._entities.get_stats()
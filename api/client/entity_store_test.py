@@ -0,0 +1,163 @@
+import threading
+
+import mock
+import pytest
+
+from api.client import lib
+from api.client.deadline import deadline
+from api.client.entity_store import EntityStore
+from api.client.singleflight import WaitTimeout
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.entity_store.token'
+
+
+def make_fetch(calls, release=None, error=None):
+    def fetch(ids):
+        calls.append(list(ids))
+        if release is not None:
+            release.wait()
+        if error is not None:
+            raise error
+        return dict((str(entity_id), {'id': entity_id}) for entity_id in ids if entity_id < 100)
+    return fetch
+
+
+def test_hits_and_misses():
+    store = EntityStore()
+    calls = []
+    assert store.get_many('units', [1, 2, 100], make_fetch(calls)) == {
+        '1': {'id': 1}, '2': {'id': 2}}
+    # Only the missing entity is fetched. Entities that don't exist are remembered as such.
+    assert store.get_many('units', [2, 3, 100], make_fetch(calls)) == {
+        '2': {'id': 2}, '3': {'id': 3}}
+    assert calls == [[1, 2, 100], [3]]
+    assert store.get_stats()['hits'] == 1
+    # Scopes don't share entities
+    assert store.get_many('units', [1], make_fetch(calls), scope='other') == {'1': {'id': 1}}
+    assert calls[-1] == [1]
+
+
+def test_misses_expire():
+    store = EntityStore(miss_ttl=0)
+    calls = []
+    for _ in range(2):
+        assert store.get_many('units', [100], make_fetch(calls)) == {}
+    assert calls == [[100], [100]]
+
+
+def test_callers_get_copies():
+    store = EntityStore()
+    store.get_many('units', [1], make_fetch([]))['1']['id'] = 2
+    assert store.get_many('units', [1], make_fetch([])) == {'1': {'id': 1}}
+
+
+def test_misses_of_concurrent_callers_are_batched():
+    store = EntityStore()
+    calls = []
+    release = threading.Event()
+    results = {}
+
+    def lookup(entity_id):
+        results[entity_id] = store.get_many('units', [entity_id], make_fetch(calls, release))
+
+    # The first caller starts fetching, the misses of the others queue up meanwhile
+    first = threading.Thread(target=lookup, args=(1,))
+    first.start()
+    while not calls:
+        release.wait(0.01)
+    others = [threading.Thread(target=lookup, args=(entity_id,)) for entity_id in range(2, 12)]
+    for thread in others:
+        thread.start()
+    while sum(len(queued) for queued in store._queued.values()) < 10:
+        release.wait(0.01)
+    release.set()
+    for thread in [first] + others:
+        thread.join()
+    assert len(calls) == 2
+    assert sorted(calls[1]) == list(range(2, 12))
+    assert results == dict((entity_id, {str(entity_id): {'id': entity_id}})
+                           for entity_id in range(1, 12))
+
+
+def test_errors_only_reach_the_fetching_caller():
+    store = EntityStore()
+    calls = []
+    release = threading.Event()
+    errors = []
+
+    def failing_lookup():
+        try:
+            store.get_many('units', [1], make_fetch(calls, release, ValueError('failed')))
+        except ValueError as e:
+            errors.append(e)
+
+    first = threading.Thread(target=failing_lookup)
+    first.start()
+    while not calls:
+        release.wait(0.01)
+    # Queued while the first batch fails, then fetched with this caller's own fetch function
+    results = []
+    second = threading.Thread(target=lambda: results.append(
+        store.get_many('units', [1, 2], make_fetch(calls))))
+    second.start()
+    while not store._queued:
+        release.wait(0.01)
+    release.set()
+    first.join()
+    second.join()
+    assert len(errors) == 1
+    assert results == [{'1': {'id': 1}, '2': {'id': 2}}]
+
+    # The error of a caller's own fetch is raised
+    with pytest.raises(ValueError):
+        store.get_many('units', [3], make_fetch(calls, error=ValueError('failed')))
+
+
+@mock.patch('requests.Session.get')
+def test_lookup_uses_entity_store(mock_requests_get):
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.json.return_value = {'data': {'10': {'id': 10, 'name': 'kg'}}}
+    for _ in range(5):
+        assert lib.lookup(MOCK_TOKEN, MOCK_HOST, 'units', 10) == {'id': 10, 'name': 'kg'}
+    assert mock_requests_get.call_count == 1
+    assert lib.lookup(MOCK_TOKEN, MOCK_HOST, 'units', [10]) == {'10': {'id': 10, 'name': 'kg'}}
+    assert mock_requests_get.call_count == 1
+
+
+@mock.patch('requests.Session.get')
+def test_lookup_waiting_respects_deadline(mock_requests_get):
+    release = threading.Event()
+
+    def get(*args, **kwargs):
+        release.wait()
+        return mock.DEFAULT
+    mock_requests_get.side_effect = get
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.json.return_value = {'data': {'12': {'id': 12}}}
+
+    thread = threading.Thread(target=lib.lookup, args=(MOCK_TOKEN, MOCK_HOST, 'units', 12))
+    thread.start()
+    while not mock_requests_get.called:
+        release.wait(0.01)
+    with pytest.raises(lib.DeadlineExceeded):
+        with deadline(0.01):
+            lib.lookup(MOCK_TOKEN, MOCK_HOST, 'units', 12)
+    release.set()
+    thread.join()
+
+
+def test_wait_timeout():
+    store = EntityStore()
+    release = threading.Event()
+    calls = []
+    thread = threading.Thread(target=store.get_many, args=('units', [1],
+                                                            make_fetch(calls, release)))
+    thread.start()
+    while not calls:
+        release.wait(0.01)
+    with pytest.raises(WaitTimeout):
+        with deadline(0.01):
+            store.get_many('units', [1], make_fetch(calls))
+    release.set()
+    thread.join()
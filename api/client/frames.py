@@ -0,0 +1,218 @@
+"""Saving data frames of points to columnar files, and loading them back.
+
+Data frames returned by :meth:`~api.client.gro_client.GroClient.get_df` can be saved between the
+stages of a pipeline, and loaded back with the same columns and dtypes, without parsing dates or
+ids again::
+
+    client.save_df('corn.parquet')
+    df = frames.load_df('corn.parquet')
+
+Formats:
+- parquet, feather: written and read with pyarrow, which needs to be installed.
+- npz: a NumPy archive, available without pyarrow. Dates are kept as datetime64[ns] and ids as
+  int or float arrays. Other object columns, e.g. belongs_to, are stored as JSON strings.
+
+The format is taken from the extension of the file, unless given explicitly.
+"""
+
+import json
+
+import numpy as np
+import pandas
+
+from api.client import columnar
+from api.client.dates import parse_dates
+
+try:
+    import pyarrow
+    from pyarrow import feather, parquet
+except ImportError:
+    pyarrow = None
+
+PARQUET = 'parquet'
+FEATHER = 'feather'
+NPZ = 'npz'
+FILE_FORMATS = (PARQUET, FEATHER, NPZ)
+
+# Key of the description of the columns in npz files
+NPZ_METADATA_KEY = '__metadata__'
+
+
+def get_file_format(path, file_format=None):
+    """Get the format of a file from its extension, or check the format given.
+
+    >>> get_file_format('/tmp/corn.parquet')
+    'parquet'
+    >>> get_file_format('/tmp/corn.npz')
+    'npz'
+    >>> get_file_format('/tmp/corn.data', 'feather')
+    'feather'
+
+    """
+    if file_format is None:
+        file_format = path.rsplit('.', 1)[-1].lower()
+        if file_format == 'pq':
+            file_format = PARQUET
+    if file_format not in FILE_FORMATS:
+        raise ValueError('Unknown file format {!r}, expected one of {}'.format(
+            file_format, ', '.join(FILE_FORMATS)))
+    return file_format
+
+
+def _check_pyarrow(file_format):
+    if pyarrow is None:
+        raise ImportError('pyarrow is required to use {} files, use npz files or install '
+                          'pyarrow'.format(file_format))
+
+
+def data_points_to_df(data_points, data_series=None):
+    """Build a DataFrame from points, with their dates converted as in GroClient data frames.
+
+    Parameters
+    ----------
+    data_points : list of dicts
+        As returned by :meth:`~api.client.Client.get_data_points`
+    data_series : dict, optional
+        The selection the points were requested with. Its source_id is added as a column, since
+        points don't include it.
+
+    Returns
+    -------
+    pandas.DataFrame
+
+    """
+    df = pandas.DataFrame(data=data_points)
+    if df.empty:
+        return df
+    for column in columnar.DATE_COLUMNS:
+        if column in df.columns:
+            df[column] = parse_dates(df[column].values, utc=True)
+    if data_series is not None and 'source_id' in data_series:
+        df['source_id'] = data_series['source_id']
+    return df
+
+
+def batch_output_to_df(batched_args, output_list):
+    """Build a single DataFrame from the default output of
+    :meth:`~api.client.batch_client.BatchClient.batch_async_get_data_points`.
+
+    Parameters
+    ----------
+    batched_args : list of dicts
+        The selections passed to batch_async_get_data_points
+    output_list : list of lists of dicts
+        The points of each selection, as returned by batch_async_get_data_points. Selections
+        that were not finished, left as 0, are skipped.
+
+    Returns
+    -------
+    pandas.DataFrame
+
+    """
+    frames = [data_points_to_df(data_points, data_series)
+              for data_series, data_points in zip(batched_args, output_list)
+              if isinstance(data_points, list) and data_points]
+    if not frames:
+        return pandas.DataFrame()
+    return pandas.concat(frames, ignore_index=True)
+
+
+def save_df(df, path, file_format=None):
+    """Save a data frame of points to a file.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        As returned by :meth:`~api.client.gro_client.GroClient.get_df`, optionally indexed by
+        series
+    path : string
+    file_format : {'parquet', 'feather', 'npz'}, optional
+        By default, taken from the extension of `path`
+
+    """
+    file_format = get_file_format(path, file_format)
+    if file_format == NPZ:
+        _save_npz(df, path)
+        return
+    _check_pyarrow(file_format)
+    table = pyarrow.Table.from_pandas(df)
+    if file_format == PARQUET:
+        parquet.write_table(table, path)
+    else:
+        feather.write_feather(table, path)
+
+
+def load_df(path, file_format=None):
+    """Load a data frame saved with :func:`~.save_df`.
+
+    Parameters
+    ----------
+    path : string
+    file_format : {'parquet', 'feather', 'npz'}, optional
+        By default, taken from the extension of `path`
+
+    Returns
+    -------
+    pandas.DataFrame
+
+    """
+    file_format = get_file_format(path, file_format)
+    if file_format == NPZ:
+        return _load_npz(path)
+    _check_pyarrow(file_format)
+    if file_format == PARQUET:
+        return parquet.read_table(path).to_pandas()
+    return feather.read_table(path).to_pandas()
+
+
+def _save_npz(df, path):
+    index_columns, index_names = [], []
+    if not isinstance(df.index, pandas.RangeIndex):
+        index_names = list(df.index.names)
+        df = df.reset_index()
+        index_columns = list(df.columns[:len(index_names)])
+    metadata = {'columns': [], 'index': index_columns, 'index_names': index_names}
+    arrays = {}
+    for position, column in enumerate(df.columns):
+        values = df[column]
+        description = {'name': column}
+        if getattr(values.dtype, 'tz', None) is not None:
+            description['tz'] = str(values.dtype.tz)
+            values = values.dt.tz_convert('UTC').dt.tz_localize(None)
+        if values.dtype == object:
+            description['json'] = True
+            array = np.array([json.dumps(value) for value in values], dtype='U')
+        else:
+            array = np.asarray(values)
+        metadata['columns'].append(description)
+        arrays['column_{}'.format(position)] = array
+    arrays[NPZ_METADATA_KEY] = np.array(json.dumps(metadata), dtype='U')
+    with open(path, 'wb') as npz_file:
+        np.savez_compressed(npz_file, **arrays)
+
+
+def _load_npz(path):
+    with np.load(path) as arrays:
+        metadata = json.loads(arrays[NPZ_METADATA_KEY].item())
+        columns = []
+        for position, description in enumerate(metadata['columns']):
+            array = arrays['column_{}'.format(position)]
+            if description.get('json'):
+                array = [json.loads(value) for value in array]
+            if 'tz' in description:
+                array = pandas.DatetimeIndex(array).tz_localize('UTC').tz_convert(
+                    description['tz'])
+            columns.append((description['name'], array))
+    df = pandas.DataFrame(dict(columns), columns=[name for name, _ in columns])
+    if metadata['index']:
+        df = df.set_index(metadata['index'])
+        df.index.names = metadata['index_names']
+    return df
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python frames.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
@@ -0,0 +1,66 @@
+import pandas
+import pytest
+
+from api.client import frames
+from api.client.gro_client import GroClient
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.frames.token'
+
+POINTS = [
+    {'start_date': '2017-01-01T00:00:00.000Z', 'end_date': '2017-12-31T00:00:00.000Z',
+     'value': 1.5, 'unit_id': 14, 'reporting_date': None, 'metric_id': 1, 'item_id': 2,
+     'region_id': 3, 'partner_region_id': 0, 'frequency_id': 9, 'belongs_to': {'item_id': 22}},
+    {'start_date': '2018-01-01T00:00:00.000Z', 'end_date': '2018-12-31T00:00:00.000Z',
+     'value': None, 'unit_id': 14, 'reporting_date': '2019-01-15T00:00:00.000Z', 'metric_id': 1,
+     'item_id': 2, 'region_id': 3, 'partner_region_id': 0, 'frequency_id': 9,
+     'belongs_to': {'item_id': 22}},
+]
+
+
+def assert_round_trip(df, path):
+    frames.save_df(df, str(path))
+    loaded = frames.load_df(str(path))
+    pandas.testing.assert_frame_equal(loaded, df)
+
+
+def test_data_points_to_df():
+    df = frames.data_points_to_df(POINTS, {'source_id': 5})
+    assert str(df['end_date'].dtype) == 'datetime64[ns, UTC]'
+    assert df['source_id'].tolist() == [5, 5]
+    assert frames.data_points_to_df([]).empty
+
+
+def test_batch_output_to_df():
+    df = frames.batch_output_to_df([{'source_id': 5}, {'source_id': 6}, {'source_id': 7}],
+                                   [POINTS, POINTS[:1], 0])
+    assert df['source_id'].tolist() == [5, 5, 6]
+    assert df.index.tolist() == [0, 1, 2]
+
+
+def test_npz_round_trip(tmpdir):
+    df = frames.data_points_to_df(POINTS, {'source_id': 5})
+    assert_round_trip(df, tmpdir.join('points.npz'))
+    indexed_df = df.set_index(['metric_id', 'item_id', 'region_id'])
+    assert_round_trip(indexed_df, tmpdir.join('indexed.npz'))
+
+
+@pytest.mark.parametrize('extension', ['parquet', 'feather'])
+def test_pyarrow_round_trip(tmpdir, extension):
+    pytest.importorskip('pyarrow')
+    df = frames.data_points_to_df(POINTS, {'source_id': 5}).drop(columns='belongs_to')
+    assert_round_trip(df, tmpdir.join('points.' + extension))
+
+
+def test_client_save_and_load(tmpdir):
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    client.add_points_to_df(None, {'source_id': 5}, POINTS)
+    path = str(tmpdir.join('client.npz'))
+    client.save_df(path)
+    other_client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    pandas.testing.assert_frame_equal(other_client.load_df(path), client.get_df())
+
+
+def test_unknown_format():
+    with pytest.raises(ValueError):
+        frames.save_df(pandas.DataFrame(), 'points.csv')
@@ -3,16 +3,18 @@ from builtins import str
 from builtins import zip
 from random import random
 import argparse
-import functools
 import getpass
 import itertools
+from multiprocessing.pool import ThreadPool
 import os
 import sys
 
-from api.client import cfg, lib, Client
+from api.client import cfg, columnar, frames, lib, units, Client
 from api.client.constants import DATA_SERIES_UNIQUE_TYPES_ID, ENTITY_KEY_TO_TYPE
+from api.client.deadline import deadline, get_current_deadline
 from api.client.utils import intersect
 
+import numpy
 import pandas
 import unicodecsv
 
@@ -21,6 +23,23 @@ API_HOST = 'api.gro-intelligence.com'
 OUTPUT_FILENAME = 'gro_client_output.csv'
 
 
+def _get_series_key(ids):
+    """Identify a series in the index of the rows of each series of GroClient's data frame.
+
+    Parameters
+    ----------
+    ids : iterable
+        In the order of DATA_SERIES_UNIQUE_TYPES_ID, None or NaN for missing ids
+
+    Returns
+    -------
+    tuple
+        With None for missing ids, since NaN isn't equal to itself
+
+    """
+    return tuple(None if pandas.isnull(entity_id) else entity_id for entity_id in ids)
+
+
 class GroClient(Client):
     """An extension of the Client class with extra convenience methods for some common operations.
 
@@ -38,11 +57,19 @@ class GroClient(Client):
         self._data_series_list = set()  # all that have been added
         self._data_series_queue = []  # added but not loaded in data frame
         self._data_frame = pandas.DataFrame()
+        self._data_frame_chunks = []  # frames of points added since the data frame was assembled
+        # Series key, as in DATA_SERIES_UNIQUE_TYPES_ID, to arrays of the positions of its rows in
+        # the data frame
+        self._series_rows = {}
+        self._indexed_data_frame = None  # the data frame indexed by series, once requested
+        self._unit_conversions = units.ConversionTable(
+            lambda unit_id: self.lookup('units', unit_id))
 
     def get_logger(self):
         return self._logger
 
-    def get_df(self, show_revisions=False, index_by_series=False):
+    def get_df(self, show_revisions=False, index_by_series=False, format=columnar.RECORDS,
+               max_workers=None):
         """Call :meth:`~.get_data_points` for each saved data series and return as a combined
         dataframe.
 
@@ -50,6 +77,19 @@ class GroClient(Client):
         :meth:`~.add_single_data_series` to save data series into the GroClient's data_series_list.
         You can inspect the client's saved list using :meth:`~.get_data_series_list`.
 
+        Parameters
+        ----------
+        show_revisions : boolean, optional
+        index_by_series : boolean, optional
+        format : {'records', 'dataframe'}, optional
+            How the points of the series are decoded, see :meth:`~.get_data_points`. With
+            'dataframe' (or 'columns'), they are decoded straight into typed columns, which is
+            faster and takes less memory for large series. The deprecated input_unit_id and
+            input_unit_scale columns are then left out.
+        max_workers : integer, optional
+            Number of series requested at a time, cfg.GET_DF_MAX_WORKERS (1) by default. Requests
+            are still subject to the rate limit and retried like any other.
+
         Returns
         -------
         pandas.DataFrame
@@ -58,19 +98,85 @@ class GroClient(Client):
             See https://developers.gro-intelligence.com/data-point-definition.html
             If index_by_series is set, the dataframe is indexed by series.
             See https://developers.gro-intelligence.com/data-series-definition.html
+
+        Raises
+        ------
+        Exception
+            The first error raised by :meth:`~.get_data_points`. The points of the series fetched
+            successfully are kept in the dataframe. The series that failed, and with a single
+            worker those after it that were not requested yet, are left in the queue for the next
+            call.
         """
+        columnar.check_format(format)
+        queued, selections = [], []
         while self._data_series_queue:
             data_series = self._data_series_queue.pop()
+            queued.append(data_series)
             if show_revisions:
                 data_series['show_revisions'] = True
-            self.add_points_to_df(None, data_series, self.get_data_points(**data_series))
+            if format != columnar.RECORDS:
+                data_series = dict(data_series, format=columnar.DATAFRAME)
+            selections.append(data_series)
+        if max_workers is None:
+            max_workers = cfg.GET_DF_MAX_WORKERS
+        pool = None
+        if max_workers > 1 and len(selections) > 1:
+            pool = ThreadPool(min(max_workers, len(selections)))
+        failed = []
+        first_error = None
+        try:
+            results = self._fetch_data_points(selections, pool)
+            for position, (data_points, error) in enumerate(results):
+                if error is None:
+                    self.add_points_to_df(None, selections[position], data_points)
+                    continue
+                failed.append(queued[position])
+                first_error = first_error or error
+                if pool is None:
+                    # Requested one at a time: the series after the failed one aren't requested
+                    failed.extend(queued[position + 1:])
+                    break
+        finally:
+            if pool is not None:
+                pool.terminate()
+                pool.join()
+            # Left in the queue for the next call, in the same order
+            self._data_series_queue.extend(reversed(failed))
+        self._assemble_data_frame()
+        if first_error is not None:
+            raise first_error
         if index_by_series:
-            indexed_df = self._data_frame.set_index(intersect(DATA_SERIES_UNIQUE_TYPES_ID,
-                                                              self._data_frame.columns))
-            indexed_df.index.set_names(DATA_SERIES_UNIQUE_TYPES_ID, inplace=True)
-            return indexed_df.sort_index()
+            if self._indexed_data_frame is None:
+                indexed_df = self._data_frame.set_index(intersect(DATA_SERIES_UNIQUE_TYPES_ID,
+                                                                  self._data_frame.columns))
+                indexed_df.index.set_names(DATA_SERIES_UNIQUE_TYPES_ID, inplace=True)
+                self._indexed_data_frame = indexed_df.sort_index()
+            # Kept for the next calls, which callers modifying the returned frame must not affect
+            return self._indexed_data_frame.copy()
         return self._data_frame
 
+    def _fetch_data_points(self, selections, pool=None):
+        """Call :meth:`~.get_data_points` for each selection, concurrently if given a pool.
+
+        Returns
+        -------
+        iterator of tuples
+            (data points, None) or (None, exception) for each selection, in order
+
+        """
+        # Deadlines are per thread, see api.client.deadline
+        current_deadline = get_current_deadline()
+
+        def fetch(selection):
+            try:
+                with deadline(current_deadline.remaining() if current_deadline else None):
+                    return self.get_data_points(**selection), None
+            except Exception as e:
+                return None, e
+        if pool is None:
+            return (fetch(selection) for selection in selections)
+        return pool.imap(fetch, selections)
+
     def add_points_to_df(self, index, data_series, data_points, *args):
         """Add the given datapoints to a pandas dataframe.
 
@@ -78,27 +184,136 @@ class GroClient(Client):
         -----------
         index : unused
         data_series : dict
-        data_points : list of dicts
+        data_points : list of dicts or pandas.DataFrame
+            As returned by :meth:`~.get_data_points` with format 'records' or 'dataframe'
 
         """
-        tmp = pandas.DataFrame(data=data_points)
-        if tmp.empty:
-            return
+        if isinstance(data_points, pandas.DataFrame):
+            # Dates are already converted
+            tmp = data_points
+            if tmp.empty:
+                return
+        else:
+            tmp = frames.data_points_to_df(data_points)
+            if tmp.empty:
+                return
         # get_data_points response doesn't include the
         # source_id. We add it as a column, in case we have
         # several selections series which differ only by source id.
         tmp['source_id'] = data_series['source_id']
-        if 'end_date' in tmp.columns:
-            tmp.end_date = pandas.to_datetime(tmp.end_date)
-        if 'start_date' in tmp.columns:
-            tmp.start_date = pandas.to_datetime(tmp.start_date)
-        if 'reporting_date' in tmp.columns:
-            tmp.reporting_date = pandas.to_datetime(tmp.reporting_date)
-
-        if self._data_frame.empty:
-            self._data_frame = tmp
-        else:
-            self._data_frame = pandas.concat([self._data_frame, tmp])
+        self._data_frame_chunks.append(tmp)
+
+    def _assemble_data_frame(self):
+        """Append the points added since the last call to the data frame.
+
+        Concatenating the frames of all the series at once, rather than one at a time, copies the
+        points once instead of once per series.
+        """
+        if self._data_frame_chunks:
+            chunks = self._data_frame_chunks
+            offset = len(self._data_frame)
+            for chunk in chunks:
+                self._index_series_rows(chunk, offset)
+                offset += len(chunk)
+            if not self._data_frame.empty:
+                chunks = [self._data_frame] + chunks
+            self._data_frame = chunks[0] if len(chunks) == 1 else pandas.concat(chunks)
+            self._data_frame_chunks = []
+            self._indexed_data_frame = None
+        return self._data_frame
+
+    def _index_series_rows(self, chunk, offset):
+        """Record the positions of the rows of each series of a frame appended to the data frame
+        at the given offset."""
+        if chunk.empty:
+            return
+        # Missing ids, e.g. of series without a partner region, are None in the keys
+        keys = [chunk[column].values if column in chunk.columns else None
+                for column in DATA_SERIES_UNIQUE_TYPES_ID]
+        if all(key is None or pandas.isnull(key).all() or (key == key[0]).all()
+               for key in keys):
+            # Usually the points of a single series, no need to group them
+            series_key = _get_series_key(key[0] if key is not None else None for key in keys)
+            self._series_rows.setdefault(series_key, []).append(numpy.arange(len(chunk)) + offset)
+            return
+        # Like groupby().indices, without leaving out the rows with missing ids
+        codes, uniques = zip(*[pandas.factorize(key) if key is not None
+                               else (numpy.full(len(chunk), -1), []) for key in keys])
+        group_codes, groups = numpy.unique(numpy.column_stack(codes), axis=0,
+                                           return_inverse=True)
+        groups = groups.ravel()
+        rows = numpy.argsort(groups, kind='mergesort')
+        for group_code, positions in zip(group_codes, numpy.split(
+                rows, numpy.cumsum(numpy.bincount(groups))[:-1])):
+            series_key = _get_series_key(values[code] if code >= 0 else None
+                                        for values, code in zip(uniques, group_code))
+            self._series_rows.setdefault(series_key, []).append(positions + offset)
+
+    def _get_series_df(self, series_key):
+        """Get the rows of the data frame of one series, without going through all of it.
+
+        Parameters
+        ----------
+        series_key : tuple
+            Ids of the series, in the order of DATA_SERIES_UNIQUE_TYPES_ID, None or NaN for those
+            it doesn't have
+
+        Returns
+        -------
+        pandas.DataFrame or None
+            Indexed by series like the data frame returned by get_df(index_by_series=True), or
+            None if the series has no points
+
+        """
+        positions = self._series_rows.get(_get_series_key(series_key))
+        if not positions:
+            return None
+        if len(positions) > 1:
+            # Points of the series were added by several calls, merge them for the next lookups
+            positions[:] = [numpy.sort(numpy.concatenate(positions))]
+        # Only the ids the data frame has, e.g. not partner_region_id if no series has one
+        return self._data_frame.iloc[positions[0]].set_index(
+            intersect(DATA_SERIES_UNIQUE_TYPES_ID, self._data_frame.columns))
+
+    def save_df(self, path, file_format=None, **get_df_args):
+        """Save the data frame of the saved data series to a Parquet, Feather or npz file.
+
+        Dates, ids and the other columns are loaded back by :meth:`~.load_df` with the same
+        dtypes. See :mod:`api.client.frames`.
+
+        Parameters
+        ----------
+        path : string
+        file_format : {'parquet', 'feather', 'npz'}, optional
+            By default, taken from the extension of `path`. Parquet and Feather need pyarrow.
+        get_df_args : optional
+            Passed to :meth:`~.get_df`, which is called first to load any queued series
+
+        """
+        frames.save_df(self.get_df(**get_df_args), path, file_format)
+
+    def load_df(self, path, file_format=None):
+        """Add the points of a file saved with :meth:`~.save_df` to the data frame.
+
+        Parameters
+        ----------
+        path : string
+        file_format : {'parquet', 'feather', 'npz'}, optional
+            By default, taken from the extension of `path`
+
+        Returns
+        -------
+        pandas.DataFrame
+            The data frame with the points loaded, as returned by :meth:`~.get_df`
+
+        """
+        df = frames.load_df(path, file_format)
+        if any(name is not None for name in df.index.names):
+            # Saved with index_by_series=True
+            df = df.reset_index()
+        if not df.empty:
+            self._data_frame_chunks.append(df)
+        return self._assemble_data_frame()
 
     def get_data_points(self, **selections):
         """Get all the data points for a given selection.
@@ -212,17 +427,28 @@ class GroClient(Client):
             :sample:`at-time-query-examples.ipynb` for more details.
         include_historical : boolean, optional
             True by default, will include historical regions that are part of your selections
+        format : {'records', 'columns', 'dataframe', 'compact'}, optional
+            'records' by default. 'columns' returns a dict of NumPy arrays, one per field of the
+            points, and 'dataframe' a pandas DataFrame, both decoded straight from the response.
+            See :mod:`api.client.columnar`. 'compact' returns dict-like points taking several
+            times less memory than dicts, see :mod:`api.client.points`.
 
         Returns
         -------
         list of dicts
+            Or dict of NumPy arrays, pandas.DataFrame, or list of
+            :class:`~api.client.points.DataPoint`, depending on `format`
 
         """
         data_points = super(GroClient, self).get_data_points(**selections)
         # Apply unit conversion if a unit is specified
         if 'unit_id' in selections:
-            return list(map(functools.partial(self.convert_unit,
-                                              target_unit_id=selections['unit_id']), data_points))
+            data_format = selections.get('format', columnar.RECORDS)
+            if data_format == columnar.COMPACT:
+                return self.convert_unit_points(data_points, selections['unit_id'])
+            if data_format != columnar.RECORDS:
+                return self.convert_unit_columns(data_points, selections['unit_id'])
+            return self.convert_unit_records(data_points, selections['unit_id'])
         # Return data points in input units if not unit is specified
         return data_points
 
@@ -262,10 +488,11 @@ class GroClient(Client):
                 selection[key] = value
 
         self.add_single_data_series(selection)
-        try:
-            return self.get_df(index_by_series=True).loc[[tuple(entity_ids)], :]
-        except KeyError as e:
+        self.get_df()
+        series_df = self._get_series_df(tuple(entity_ids))
+        if series_df is None:
             return pandas.DataFrame()
+        return series_df
 
     def get_data_series_list(self):
         """Inspect the current list of saved data series contained in the GroClient.
@@ -561,6 +788,117 @@ class GroClient(Client):
                              point['value'],
                              self.lookup_unit_abbreviation(point['unit_id'])])
 
+    def get_unit_conversion(self, unit_id):
+        """Get the factor and offset converting values in a unit to its base unit.
+
+        Units are looked up once, see :class:`api.client.units.ConversionTable`.
+
+        Raises
+        ------
+        Exception
+            If the unit is not convertible
+
+        """
+        return self._unit_conversions.get_conversion(unit_id)
+
+    def convert_unit_columns(self, columns, target_unit_id):
+        """Convert the values of columnar data points to another unit.
+
+        Like :meth:`~.convert_unit`, for the output of :meth:`~.get_data_points` with format
+        'columns' or 'dataframe'.
+
+        Parameters
+        ----------
+        columns : dict of NumPy arrays or pandas.DataFrame
+            With 'value' and 'unit_id' columns. Modified in place.
+        target_unit_id : integer
+
+        Returns
+        -------
+        dict of NumPy arrays or pandas.DataFrame
+            `columns`, or whatever else was given, e.g. an error body
+
+        """
+        if (not isinstance(columns, (dict, pandas.DataFrame)) or
+                not len(columns.get('unit_id', []))):
+            return columns
+        unit_ids = numpy.asarray(columns['unit_id'])
+        columns['value'] = self._unit_conversions.convert(columns['value'], unit_ids,
+                                                          target_unit_id)
+        # Points without a unit keep none
+        columns['unit_id'] = numpy.where(pandas.isnull(unit_ids), unit_ids,
+                                         target_unit_id).astype(unit_ids.dtype)
+        return columns
+
+    def convert_unit_records(self, data_points, target_unit_id):
+        """Convert data points to another unit, all at once.
+
+        Like :meth:`~.convert_unit`, for a list of points as returned by
+        :meth:`~.get_data_points`, with one NumPy expression for all the values.
+
+        Parameters
+        ----------
+        data_points : list of dicts
+            Modified in place
+        target_unit_id : integer
+
+        Returns
+        -------
+        list of dicts
+            `data_points`, or whatever else was given, e.g. an error body
+
+        """
+        if not isinstance(data_points, list) or not data_points:
+            return data_points
+        unit_ids = numpy.array([point.get('unit_id') for point in data_points], dtype=object)
+        values = self._unit_conversions.convert([point.get('value') for point in data_points],
+                                                unit_ids, target_unit_id)
+        for point, value in zip(data_points, values.tolist()):
+            if point.get('unit_id') is None or point.get('unit_id') == target_unit_id:
+                continue
+            if point.get('value') is not None:
+                point['value'] = value
+            point['unit_id'] = target_unit_id
+        return data_points
+
+    def convert_unit_points(self, data_points, target_unit_id):
+        """Convert compact data points to another unit, one series at a time.
+
+        Like :meth:`~.convert_unit`, for the output of :meth:`~.get_data_points` with format
+        'compact'. The points of a series keep sharing their series attributes.
+
+        Parameters
+        ----------
+        data_points : list of api.client.points.DataPoint
+            Modified in place
+        target_unit_id : integer
+
+        Returns
+        -------
+        list of api.client.points.DataPoint
+            `data_points`, or whatever else was given, e.g. an error body
+
+        """
+        if not isinstance(data_points, list):
+            return data_points
+        # Converted attributes and conversion, by id of the original attributes. The originals
+        # are kept, so that their ids aren't reused.
+        converted_series = {}
+        for point in data_points:
+            series = point.series
+            if series.unit_id is None or series.unit_id == target_unit_id:
+                continue
+            if id(series) not in converted_series:
+                from_factor, from_offset = self.get_unit_conversion(series.unit_id)
+                to_factor, to_offset = self.get_unit_conversion(target_unit_id)
+                converted_series[id(series)] = (series, series.replace(unit_id=target_unit_id),
+                                                from_factor, from_offset, to_factor, to_offset)
+            _, point.series, from_factor, from_offset, to_factor, to_offset = \
+                converted_series[id(series)]
+            if point.value is not None:
+                point.value = float(point.value * from_factor + from_offset - to_offset) / to_factor
+        return data_points
+
     def convert_unit(self, point, target_unit_id):
         """Convert the data point from one unit to another unit.
 
@@ -586,27 +924,11 @@ class GroClient(Client):
         """
         if point.get('unit_id') is None or point.get('unit_id') == target_unit_id:
             return point
-        from_convert_factor = self.lookup(
-            'units', point['unit_id']
-        ).get('baseConvFactor')
-        if not from_convert_factor.get('factor'):
-            raise Exception(
-                'unit_id {} is not convertible'.format(point['unit_id'])
-            )
-        to_convert_factor = self.lookup(
-            'units', target_unit_id
-        ).get('baseConvFactor')
-        if not to_convert_factor.get('factor'):
-            raise Exception(
-                'unit_id {} is not convertible'.format(target_unit_id)
-            )
+        from_factor, from_offset = self.get_unit_conversion(point['unit_id'])
+        to_factor, to_offset = self.get_unit_conversion(target_unit_id)
         if point.get('value') is not None:
-            value_in_base_unit = (
-                point['value'] * from_convert_factor.get('factor')
-            ) + from_convert_factor.get('offset', 0)
-            point['value'] = float(
-                value_in_base_unit - to_convert_factor.get('offset', 0)
-            ) / to_convert_factor.get('factor')
+            point['value'] = (float(point['value'] * from_factor + from_offset - to_offset) /
+                              to_factor)
         point['unit_id'] = target_unit_id
         return point
 
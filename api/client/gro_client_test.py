@@ -1,11 +1,14 @@
 try:
     # Python 3.3+
-    from unittest.mock import MagicMock
+    from unittest.mock import MagicMock, patch
 except ImportError:
     # Python 2.7
-    from mock import MagicMock
+    from mock import MagicMock, patch
 
+import numpy as np
+import pandas
 import pytest
+from api.client.constants import DATA_SERIES_UNIQUE_TYPES_ID
 from api.client.gro_client import GroClient
 
 MOCK_HOST = 'pytest.groclient.url'
@@ -90,3 +93,171 @@ def test_convert_unit():
 
     with pytest.raises(Exception):
         assert client.convert_unit({ 'value': None, 'unit_id': 10 }, 43)
+
+
+def test_convert_unit_columns():
+    columns = {'value': np.array([3, np.nan, 1, 2]),
+               'unit_id': np.array([36, 36, 37, 10], dtype=np.int32)}
+    # Temperatures only, 10 would not be convertible to 36 in practice
+    client.convert_unit_columns(columns, 37)
+    assert columns['value'][0] == 42
+    assert np.isnan(columns['value'][1])
+    assert columns['value'][2] == 1
+    assert columns['value'][3] == (2 - 255) / 0.5
+    assert columns['unit_id'].tolist() == [37, 37, 37, 37]
+    assert columns['unit_id'].dtype == np.int32
+
+    with pytest.raises(Exception):
+        client.convert_unit_columns({'value': np.array([1.0]),
+                                     'unit_id': np.array([10], dtype=np.int32)}, 43)
+
+
+def test_get_df_concatenates_once():
+    df_client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    for region_id in range(3):
+        df_client.add_points_to_df(None, {'source_id': 2}, [
+            {'start_date': '2017-01-01T00:00:00.000Z', 'end_date': '2017-12-31T00:00:00.000Z',
+             'value': region_id, 'region_id': region_id}])
+    with patch('pandas.concat', wraps=pandas.concat) as concat:
+        df = df_client.get_df()
+        assert concat.call_count == 1
+        assert df['region_id'].tolist() == [0, 1, 2]
+        # Series added later are appended to the data frame assembled before
+        df_client.add_points_to_df(None, {'source_id': 2}, [
+            {'start_date': '2018-01-01T00:00:00.000Z', 'end_date': '2018-12-31T00:00:00.000Z',
+             'value': 3, 'region_id': 3}])
+        assert df_client.get_df()['region_id'].tolist() == [0, 1, 2, 3]
+        assert concat.call_count == 2
+        assert df_client.get_df() is df_client.get_df()
+        assert concat.call_count == 2
+
+
+def test_get_df_concurrent():
+    df_client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    for region_id in range(4):
+        df_client.add_single_data_series({'metric_id': 1, 'item_id': 2, 'region_id': region_id,
+                                          'frequency_id': 9, 'source_id': 3})
+    failing = set([1])
+
+    def get_data_points(**selection):
+        if selection['region_id'] in failing:
+            raise Exception('region {} failed'.format(selection['region_id']))
+        return [{'start_date': '2017-01-01T00:00:00.000Z',
+                 'end_date': '2017-12-31T00:00:00.000Z',
+                 'value': 1, 'region_id': selection['region_id']}]
+    df_client.get_data_points = MagicMock(side_effect=get_data_points)
+
+    with pytest.raises(Exception, match='region 1 failed'):
+        df_client.get_df(max_workers=4)
+    # The points of all the other series are kept, only the failed one is still queued
+    assert df_client._data_frame['region_id'].tolist() == [3, 2, 0]
+    assert [series['region_id'] for series in df_client._data_series_queue] == [1]
+
+    failing.clear()
+    df = df_client.get_df(max_workers=4)
+    assert df['region_id'].tolist() == [3, 2, 0, 1]
+    assert df['source_id'].tolist() == [3, 3, 3, 3]
+    assert df_client.get_data_points.call_count == 5
+
+
+def test_get_df_error():
+    df_client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    for region_id in range(4):
+        df_client.add_single_data_series({'metric_id': 1, 'item_id': 2, 'region_id': region_id,
+                                          'frequency_id': 9, 'source_id': 3})
+
+    def get_data_points(**selection):
+        if selection['region_id'] == 1:
+            raise Exception('region 1 failed')
+        return [{'start_date': '2017-01-01T00:00:00.000Z',
+                 'end_date': '2017-12-31T00:00:00.000Z',
+                 'value': 1, 'region_id': selection['region_id']}]
+    df_client.get_data_points = MagicMock(side_effect=get_data_points)
+
+    with pytest.raises(Exception, match='region 1 failed'):
+        df_client.get_df()
+    # One at a time: the series after the failed one are not requested, and are still queued
+    assert df_client.get_data_points.call_count == 3
+    assert [series['region_id'] for series in df_client._data_series_queue] == [0, 1]
+    assert df_client._data_frame['region_id'].tolist() == [3, 2]
+
+
+def test_gdh():
+    gdh_client = GroClient(MOCK_HOST, MOCK_TOKEN)
+
+    def get_data_points(**selection):
+        return [{'start_date': '{}-01-01T00:00:00.000Z'.format(year),
+                 'end_date': '{}-12-31T00:00:00.000Z'.format(year),
+                 'value': selection['region_id'] * year, 'metric_id': selection['metric_id'],
+                 'item_id': selection['item_id'], 'region_id': selection['region_id'],
+                 'partner_region_id': selection['partner_region_id'],
+                 'frequency_id': selection['frequency_id']} for year in [2017, 2018]]
+    gdh_client.get_data_points = MagicMock(side_effect=get_data_points)
+
+    df = gdh_client.GDH('860032-274-1231-0-14-9')
+    assert df.index.names == DATA_SERIES_UNIQUE_TYPES_ID
+    assert df['value'].tolist() == [1231 * 2017, 1231 * 2018]
+    df = gdh_client.GDH('860032-274-1215-0-14-9')
+    assert df.index.tolist() == [(860032, 274, 1215, 0, 14, 9)] * 2
+    assert gdh_client.GDH('860032-274-1231-0-14-9')['value'].tolist() == [1231 * 2017,
+                                                                          1231 * 2018]
+    assert gdh_client.get_data_points.call_count == 2
+    assert len(gdh_client.get_df(index_by_series=True)) == 4
+    gdh_client.get_data_points = MagicMock(return_value=[])
+    assert gdh_client.GDH('860032-274-1-0-14-9').empty
+
+
+def test_series_without_partner_region():
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+
+    def points(region_id, partner_region_id=None):
+        point = {'start_date': '2017-01-01T00:00:00.000Z', 'end_date': '2017-12-31T00:00:00.000Z',
+                 'value': region_id, 'metric_id': 1, 'item_id': 2, 'region_id': region_id,
+                 'frequency_id': 9}
+        if partner_region_id is not None:
+            point['partner_region_id'] = partner_region_id
+        return [point]
+
+    # Both series in one frame, and a frame without the partner_region_id column at all
+    client.add_points_to_df(None, {'source_id': 14}, points(1, 0) + points(2))
+    client.add_points_to_df(None, {'source_id': 14}, points(3))
+    client.get_df()
+    assert client._get_series_df((1, 2, 1, 0, 9, 14))['value'].tolist() == [1]
+    assert client._get_series_df((1, 2, 2, None, 9, 14))['value'].tolist() == [2]
+    assert client._get_series_df((1, 2, 3, float('nan'), 9, 14))['value'].tolist() == [3]
+
+
+def test_frame_without_partner_region_column():
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    client.get_data_points = MagicMock(return_value=[{
+        'start_date': '2017-01-01T00:00:00.000Z', 'end_date': '2017-12-31T00:00:00.000Z',
+        'value': 1, 'metric_id': 1, 'item_id': 2, 'region_id': 3, 'frequency_id': 9}])
+    # The points don't say which partner region they are of, so they aren't those of '...-0-...'
+    assert client.GDH('1-2-3-0-9-14').empty
+    assert 'partner_region_id' not in client.get_df().columns
+    df = client._get_series_df((1, 2, 3, None, 9, 14))
+    assert df.index.names == ['metric_id', 'item_id', 'region_id', 'frequency_id', 'source_id']
+    assert df['value'].tolist() == [1]
+
+
+def test_get_df_index_by_series_returns_a_copy():
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    client.add_points_to_df(None, {'source_id': 14}, [{
+        'start_date': '2017-01-01T00:00:00.000Z', 'end_date': '2017-12-31T00:00:00.000Z',
+        'value': 1, 'metric_id': 1, 'item_id': 2, 'region_id': 3, 'partner_region_id': 0,
+        'frequency_id': 9}])
+    df = client.get_df(index_by_series=True)
+    df['value'] = 2
+    assert client.get_df(index_by_series=True)['value'].tolist() == [1]
+
+
+def test_convert_unit_records():
+    points = [{'value': 1, 'unit_id': 10}, {'value': None, 'unit_id': 14},
+              {'value': 2, 'unit_id': 14}, {'value': 5, 'unit_id': None}]
+    assert client.convert_unit_records(points, 10) == [
+        {'value': 1, 'unit_id': 10}, {'value': None, 'unit_id': 10},
+        {'value': 2000, 'unit_id': 10}, {'value': 5, 'unit_id': None}]
+    assert client.convert_unit_records([], 10) == []
+
+    with pytest.raises(Exception):
+        client.convert_unit_records([{'value': 1, 'unit_id': 10}], 43)
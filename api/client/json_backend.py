@@ -0,0 +1,114 @@
+"""Decoding of JSON response bodies with the fastest JSON library installed.
+
+The standard json module decodes large /v2/data responses slowly. If orjson, pysimdjson or ujson
+is installed, response bodies are decoded with it instead, straight from the bytes received,
+without decoding them to a str first::
+
+    $ pip install orjson
+
+    from api.client import json_backend
+    json_backend.get_backend()  # 'orjson'
+    json_backend.set_backend('json')  # use the standard library again
+
+The backend can also be chosen with cfg.JSON_BACKEND. All the backends raise a ValueError for
+invalid JSON.
+"""
+
+import importlib
+import json
+
+from api.client import cfg
+
+# In order of preference
+BACKENDS = ('orjson', 'simdjson', 'ujson', 'json')
+
+_backend = None  # (name, loads function), chosen on first use
+
+
+def _stdlib_loads(data):
+    if isinstance(data, bytes) and not isinstance(data, str):
+        # json.loads only accepts bytes from Python 3.6
+        data = data.decode('utf-8')
+    return json.loads(data)
+
+
+def _get_loads(name):
+    if name == 'json':
+        return _stdlib_loads
+    return importlib.import_module(name).loads
+
+
+def set_backend(name=None):
+    """Choose the library JSON response bodies are decoded with.
+
+    >>> set_backend('json')
+    'json'
+
+    Parameters
+    ----------
+    name : {'orjson', 'simdjson', 'ujson', 'json'}, optional
+        By default, the first of them that is installed
+
+    Returns
+    -------
+    string
+        The name of the backend used
+
+    Raises
+    ------
+    ImportError
+        If the backend asked for is not installed
+
+    """
+    global _backend
+    if name is not None and name not in BACKENDS:
+        raise ValueError('Unknown JSON backend {!r}, expected one of {}'.format(
+            name, ', '.join(BACKENDS)))
+    for candidate in BACKENDS if name is None else [name]:
+        try:
+            _backend = (candidate, _get_loads(candidate))
+            return candidate
+        except ImportError:
+            if name is not None:
+                raise
+
+
+def get_backend():
+    """Get the name of the library JSON response bodies are decoded with."""
+    if _backend is None:
+        set_backend(cfg.JSON_BACKEND)
+    return _backend[0]
+
+
+def loads(data):
+    """Decode a JSON document.
+
+    >>> loads(b'{"data": [1, 2.5, null]}') == {'data': [1, 2.5, None]}
+    True
+
+    Parameters
+    ----------
+    data : bytes or string
+        bytes are assumed to be UTF-8, like all the API's responses
+
+    """
+    if _backend is None:
+        set_backend(cfg.JSON_BACKEND)
+    return _backend[1](data)
+
+
+def decode_response_json(response, *args, **kwargs):
+    """Make response.json() of a requests response decode its body with :func:`~.loads`.
+
+    Registered as a response hook of the shared session, see :mod:`api.client.session`.
+    """
+    response.json = lambda **kwargs: loads(response.content)
+    return response
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python json_backend.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
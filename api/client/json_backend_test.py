@@ -0,0 +1,53 @@
+import json
+
+import pytest
+import requests
+
+from api.client import cfg, json_backend
+from api.client.streaming import decode_json_stream
+
+
+@pytest.fixture
+def fast_backend():
+    # Stands in for orjson and the like, which may not be installed
+    calls = []
+
+    def loads(data):
+        calls.append(data)
+        return json.loads(data.decode('utf-8'))
+    previous = json_backend._backend
+    json_backend._backend = ('orjson', loads)
+    yield calls
+    json_backend._backend = previous
+
+
+def test_set_backend():
+    assert json_backend.set_backend('json') == 'json'
+    assert json_backend.get_backend() == 'json'
+    assert json_backend.loads(b'{"a": [1, 2.5]}') == {'a': [1, 2.5]}
+    assert json_backend.set_backend() in json_backend.BACKENDS
+    with pytest.raises(ValueError):
+        json_backend.set_backend('yaml')
+
+
+def test_invalid_json():
+    json_backend.set_backend('json')
+    with pytest.raises(ValueError):
+        json_backend.loads(b'{"a": ')
+
+
+def test_response_hook(fast_backend):
+    response = requests.Response()
+    response._content = b'{"data": [1]}'
+    json_backend.decode_response_json(response)
+    assert response.json() == {'data': [1]}
+    assert fast_backend == [b'{"data": [1]}']
+
+
+def test_stream_decoded_whole(fast_backend, monkeypatch):
+    assert list(decode_json_stream([b'[{"a": 1}, ', b'{"b": 2}]'])) == [{'a': 1}, {'b': 2}]
+    assert fast_backend == [b'[{"a": 1}, {"b": 2}]']
+    # Larger bodies are still decoded incrementally
+    monkeypatch.setattr(cfg, 'JSON_WHOLE_BODY_MAX_BYTES', 10)
+    assert list(decode_json_stream([b'[{"a": 1}, ', b'{"b": 2}]'])) == [{'a': 1}, {'b': 2}]
+    assert len(fast_backend) == 1
@@ -7,14 +7,28 @@ should appear in the client classes rather than here.
 
 from builtins import str
 from math import ceil
-from api.client import cfg
+from api.client import (cfg, circuit_breaker, columnar, disk_cache, json_backend, offline,
+                        ontology, rate_limit, retry, series_store)
+from api.client.points import list_of_series_to_points
+from api.client.retry import get_backoff_delay
+from api.client.streaming import decode_json_stream
+from api.client.context import RequestContext
+from api.client.memory_cache import LRUCache, cached
+from api.client.deadline import get_current_deadline
+from api.client.entity_store import EntityStore
+from api.client.singleflight import SingleFlight, WaitTimeout, request_key
+from api.client.session import get_session
 from api.client.constants import REGION_LEVELS
-from api.client.utils import dict_reformat_keys, str_snake_to_camel, str_camel_to_snake, list_chunk
-import json
+from api.client.utils import dict_reformat_keys, str_snake_to_camel, str_camel_to_snake
+import functools
 import logging
-import requests
 import time
 import platform
+try:
+    # Python 3.3+
+    from collections.abc import Iterator
+except ImportError:
+    from collections import Iterator
 from pkg_resources import get_distribution, DistributionNotFound
 try:
     # functools are native in Python 3.2.3+
@@ -23,15 +37,27 @@ except ImportError:
     from backports.functools_lru_cache import lru_cache as memoize
 
 
+def get_status_code(response):
+    """Get the status code of a requests or Tornado response, or None for an exception."""
+    return getattr(response, 'status_code', getattr(response, 'code', None))
+
+
+def get_json_body(response):
+    """Decode the JSON body of a requests or Tornado response."""
+    if hasattr(response, 'json'):
+        return response.json()
+    return json_backend.loads(response.body)
+
+
 class APIError(Exception):
     def __init__(self, response, retry_count, url, params):
         self.response = response
         self.retry_count = retry_count
         self.url = url
         self.params = params
-        self.status_code = self.response.status_code
+        self.status_code = get_status_code(response)
         try:
-            json_content = self.response.json()
+            json_content = get_json_body(self.response)
             # 'error' should be something like 'Not Found' or 'Bad Request'
             self.message = json_content.get('error', '')
             # Some error responses give additional info.
@@ -45,6 +71,51 @@ class APIError(Exception):
                                                                     else 'retries', response)
 
 
+class DeadlineExceeded(APIError):
+    """Raised when the deadline set with :func:`api.client.deadline.deadline` runs out."""
+    def __init__(self, response, retry_count, url, params):
+        self.response = response
+        self.retry_count = retry_count
+        self.url = url
+        self.params = params
+        self.status_code = get_status_code(response)
+        self.message = 'Deadline exceeded for {} after {} {}, last response: {}'.format(
+            self.url, self.retry_count, 'retry' if self.retry_count == 1 else 'retries', response)
+
+
+class CircuitOpenError(APIError):
+    """Raised without making a request when the circuit breaker of the endpoint is open.
+
+    See :mod:`api.client.circuit_breaker`. `retry_after` is the number of seconds until the
+    endpoint is probed again.
+    """
+    def __init__(self, response, retry_count, url, params, retry_after):
+        self.response = response
+        self.retry_count = retry_count
+        self.url = url
+        self.params = params
+        self.retry_after = retry_after
+        self.status_code = get_status_code(response)
+        self.message = ('Circuit breaker open for {} after repeated failures, '
+                        'retrying in {:.0f}s').format(circuit_breaker.get_endpoint(url),
+                                                      retry_after)
+
+
+class OfflineError(APIError):
+    """Raised instead of making a request while offline mode is enabled.
+
+    See :mod:`api.client.offline`. The request is recorded, see
+    :func:`api.client.offline.get_misses`.
+    """
+    def __init__(self, url, params):
+        self.response = None
+        self.retry_count = 0
+        self.url = url
+        self.params = params
+        self.status_code = None
+        self.message = 'Offline mode: {} {} is not available locally'.format(url, params or {})
+
+
 def get_default_logger():
     """Get a logging object using the default log level set in cfg.
 
@@ -83,13 +154,18 @@ def get_access_token(api_host, user_email, user_password, logger=None):
     accessToken : string
 
     """
+    if offline.is_offline():
+        url = 'https://' + api_host + '/api-token'
+        offline.record_miss(url, {'email': user_email})
+        raise OfflineError(url, {'email': user_email})
     retry_count = 0
     if not logger:
         logger = get_default_logger()
     while retry_count <= cfg.MAX_RETRIES:
-        get_api_token = requests.post('https://' + api_host + '/api-token',
-                                      data={'email': user_email,
-                                            'password': user_password})
+        get_api_token = get_session().post('https://' + api_host + '/api-token',
+                                           data={'email': user_email,
+                                                 'password': user_password},
+                                           timeout=cfg.REQUEST_TIMEOUT)
         if get_api_token.status_code == 200:
             logger.debug('Authentication succeeded in get_access_token')
             return get_api_token.json()['data']['accessToken']
@@ -132,6 +208,7 @@ def redirect(old_params, migration):
     return new_params
 
 
+@memoize(maxsize=None)
 def get_version_info():
     versions = dict()
 
@@ -145,7 +222,7 @@ def get_version_info():
     return versions
 
 
-def get_data(url, headers, params=None, logger=None):
+def get_data(url, headers, params=None, logger=None, stream=False):
     """General 'make api request' function.
 
     Assigns headers and builds in retries and logging.
@@ -156,14 +233,36 @@ def get_data(url, headers, params=None, logger=None):
     headers : dict
     params : dict
     logger : logging.Logger
+    stream : boolean, optional
+        If True, the body of a successful response is not downloaded until it is read, e.g. with
+        response.iter_content(). The caller must then read it fully or close the response.
 
     Returns
     -------
     data : list or dict
 
+    Raises
+    ------
+    APIError
+    DeadlineExceeded
+        If a deadline is set with :func:`api.client.deadline.deadline` and there isn't enough
+        time left to make another attempt. The timeout of each attempt is also limited to the
+        time left.
+    CircuitOpenError
+        If the endpoint has been failing and its circuit breaker is open. See
+        :mod:`api.client.circuit_breaker`.
+    OfflineError
+        If offline mode is enabled. See :mod:`api.client.offline`.
+
     """
+    if offline.is_offline():
+        offline.record_miss(url, params)
+        raise OfflineError(url, params)
     base_log_record = dict(route=url, params=params)
     retry_count = 0
+    response = None
+    deadline = get_current_deadline()
+    breaker = circuit_breaker.get_circuit_breaker(url)
 
     # append version info
     headers.update(get_version_info())
@@ -173,99 +272,289 @@ def get_data(url, headers, params=None, logger=None):
         logger.debug(url)
         logger.debug(params)
     while retry_count <= cfg.MAX_RETRIES:
+        # Checked before taking a rate limit token, which a request failing fast doesn't need
+        if deadline is not None and deadline.remaining() <= 0:
+            raise DeadlineExceeded(response, retry_count, url, params)
+        if breaker.retry_after():
+            raise CircuitOpenError(response, retry_count, url, params, breaker.retry_after())
+        delay = rate_limit.reserve(url, headers)
+        if deadline is not None and deadline.remaining() <= delay:
+            raise DeadlineExceeded(response, retry_count, url, params)
+        if delay:
+            logger.debug('Rate limited, waiting {:.3f}s'.format(delay))
+            time.sleep(delay)
+        # Again, the breaker may have opened while waiting
+        if not breaker.allow():
+            raise CircuitOpenError(response, retry_count, url, params, breaker.retry_after())
+        timeout = cfg.REQUEST_TIMEOUT
+        if deadline is not None:
+            timeout = min(timeout or deadline.remaining(), deadline.remaining())
         start_time = time.time()
         try:
-            response = requests.get(url, params=params, headers=headers, timeout=None)
+            response = get_session().get(url, params=params, headers=headers, timeout=timeout,
+                                         stream=stream)
         except Exception as e:
             response = e
         elapsed_time = time.time() - start_time
-        status_code = response.status_code if hasattr(response, 'status_code') else None
+        status_code = get_status_code(response)
+        breaker.record(status_code)
         log_record = dict(base_log_record)
         log_record['elapsed_time_in_ms'] = 1000 * elapsed_time
         log_record['retry_count'] = retry_count
         log_record['status_code'] = status_code
-        if status_code == 200:  # Success
+        action = retry.get_response_action(status_code)
+        if action == retry.SUCCESS:
             logger.debug('OK', extra=log_record)
             return response
-        if status_code in [204, 206]:  # Success with a caveat - warning
-            log_msg = {204: 'No Content', 206: 'Partial Content'}[status_code]
-            logger.warning(log_msg, extra=log_record)
+        if action == retry.WARNING:  # Success with a caveat
+            logger.warning(retry.WARNING_MESSAGES[status_code], extra=log_record)
             return response
         log_record['tag'] = 'failed_gro_api_request'
         if retry_count < cfg.MAX_RETRIES:
             logger.warning(response.text if hasattr(response, 'text') else response,
                            extra=log_record)
-        if status_code in [400, 401, 402, 404]:
+        if action == retry.FAIL:
             break  # Do not retry
-        if status_code == 301:
+        if action == retry.REDIRECT:
             new_params = redirect(params, response.json()['data'][0])
             logger.warning('Redirecting {} to {}'.format(params, new_params), extra=log_record)
             params = new_params
         else:
             logger.warning('{}'.format(response), extra=log_record)
-            if retry_count > 0:
-                # Retry immediately on first failure.
-                # Exponential backoff before retrying repeatedly failing requests.
-                time.sleep(2 ** retry_count)
+            if retry_count < cfg.MAX_RETRIES:
+                # Retry immediately on first failure, unless asked to wait with Retry-After.
+                # Jittered exponential backoff before retrying repeatedly failing requests.
+                delay = get_backoff_delay(retry_count, response)
+                if deadline is not None and deadline.remaining() <= delay:
+                    raise DeadlineExceeded(response, retry_count, url, params)
+                time.sleep(delay)
         retry_count += 1
     raise APIError(response, retry_count, url, params)
 
 
-@memoize(maxsize=None)
-def get_allowed_units(access_token, api_host, metric_id, item_id):
-    url = '/'.join(['https:', '', api_host, 'v2/units/allowed'])
-    headers = {'authorization': 'Bearer ' + access_token}
+def send_request(request):
+    """Make a request that has gone through the middleware chain of a RequestContext."""
+    return get_data(request.url, request.headers, request.params, request.logger, request.stream)
+
+
+def new_request_context(access_token, api_host):
+    """Create a RequestContext whose requests are made with :func:`~.get_data`."""
+    return RequestContext(api_host, access_token, send_request, get_version_info())
+
+
+# Bounded, so that a process serving many access tokens doesn't keep a context for each forever
+_shared_contexts = LRUCache(cfg.SHARED_CONTEXTS_MAXSIZE)
+
+
+def get_request_context(access_token, api_host):
+    """Get the RequestContext used by lib functions called without one.
+
+    It is shared by all such calls made with the same access token and host.
+    """
+    context = _shared_contexts.get((access_token, api_host))
+    if context is None:
+        context = new_request_context(access_token, api_host)
+        _shared_contexts.set((access_token, api_host), context)
+    return context
+
+
+_in_flight = SingleFlight()
+# Entities looked up with all access tokens, bounded by cfg.ENTITY_STORE_MAXSIZE in total. See
+# api.client.entity_store.
+entity_store = EntityStore()
+
+
+def coalesce(context, path, params, fetch, *key_extra):
+    """Call `fetch`, unless an identical request is already being made by another thread.
+
+    In that case, wait for it and return its result instead. See :mod:`api.client.singleflight`.
+
+    Parameters
+    ----------
+    context : RequestContext
+    path : string
+    params : dict or None
+    fetch : function
+        Makes the request with `context` and decodes the response. Takes no arguments.
+    key_extra : optional
+        Anything else than the request that the result of `fetch` depends on
+
+    Returns
+    -------
+    any
+        The return value of `fetch`
+
+    """
+    if not cfg.COALESCE_REQUESTS:
+        return fetch()
+    key = request_key(context.url(path), params, context.access_token) + key_extra
+    deadline = get_current_deadline()
+    try:
+        return _in_flight.do(key, fetch, deadline.remaining() if deadline is not None else None)
+    except WaitTimeout:
+        raise DeadlineExceeded(None, 0, context.url(path), params)
+
+
+def get_json(context, path, params=None, field=None):
+    """Make a request and decode the JSON body of the response.
+
+    Parameters
+    ----------
+    context : RequestContext
+    path : string
+    params : dict, optional
+    field : string, optional
+        If given, return only this field of the body, e.g. 'data'
+
+    Returns
+    -------
+    any
+
+    """
+    def fetch():
+        resp = context.get(path, params)
+        if field is None:
+            return resp.json()
+        try:
+            return resp.json()[field]
+        except KeyError:
+            raise Exception(resp.text)
+    return coalesce(context, path, params, fetch, field)
+
+
+def get_json_cached(context, kind, key_parts, path, params=None, field=None):
+    """Like :func:`~get_json`, but uses the disk cache if it is enabled.
+
+    See :mod:`api.client.disk_cache`.
+
+    Parameters
+    ----------
+    context : RequestContext
+    kind : string
+        The kind of response, which determines how long it is cached, e.g. 'search'
+    key_parts : tuple
+        What identifies the response among those of its kind, e.g. (entity_type, search_terms)
+    path : string
+    params : dict, optional
+    field : string, optional
+
+    """
+    cached = disk_cache.get_cached(kind, context.api_host, context.access_token, [key_parts])
+    if key_parts in cached:
+        return cached[key_parts]
+    result = get_json(context, path, params, field)
+    disk_cache.set_cached(kind, context.api_host, context.access_token, {key_parts: result})
+    return result
+
+
+@cached('get_allowed_units')
+def get_allowed_units(access_token, api_host, metric_id, item_id, context=None):
+    context = context or get_request_context(access_token, api_host)
     params = {'metricIds': metric_id}
     if item_id:
         params['itemIds'] = item_id
-    resp = get_data(url, headers, params)
-    return [unit['id'] for unit in resp.json()['data']]
+    allowed_units = get_json_cached(context, 'allowed_units', (metric_id, item_id),
+                                    'v2/units/allowed', params, 'data')
+    return [unit['id'] for unit in allowed_units]
 
 
-@memoize(maxsize=None)
-def get_available(access_token, api_host, entity_type):
-    url = '/'.join(['https:', '', api_host, 'v2', entity_type])
-    headers = {'authorization': 'Bearer ' + access_token}
-    resp = get_data(url, headers)
-    return resp.json()['data']
+@cached('get_available', maxsize=64)
+def get_available(access_token, api_host, entity_type, context=None):
+    context = context or get_request_context(access_token, api_host)
+    return get_json_cached(context, 'available', (entity_type,), 'v2/' + entity_type,
+                           field='data')
 
 
-def list_available(access_token, api_host, selected_entities):
-    url = '/'.join(['https:', '', api_host, 'v2/entities/list'])
-    headers = {'authorization': 'Bearer ' + access_token}
+def list_available(access_token, api_host, selected_entities, context=None):
+    context = context or get_request_context(access_token, api_host)
     params = dict([(str_snake_to_camel(key), value)
                    for (key, value) in list(selected_entities.items())])
-    resp = get_data(url, headers, params)
-    try:
-        return resp.json()['data']
-    except KeyError:
-        raise Exception(resp.text)
+    return get_json(context, 'v2/entities/list', params, 'data')
 
 
-def lookup(access_token, api_host, entity_type, entity_ids):
+def lookup(access_token, api_host, entity_type, entity_ids, context=None):
+    context = context or get_request_context(access_token, api_host)
     try:  # Convert iterable types like numpy arrays or tuples into plain lists
         entity_ids = list(entity_ids)
     except TypeError:  # Convert anything else, like strings or numpy integers, into plain integers
         entity_ids = int(entity_ids)
-    url = '/'.join(['https:', '', api_host, 'v2', entity_type])
-    headers = {'authorization': 'Bearer ' + access_token}
-    # If an integer is given, return only the dict with that id
-    if isinstance(entity_ids, int):
-        params = {'ids': [entity_ids]}
-        resp = get_data(url, headers, params)
-        try:
-            return resp.json()['data'].get(str(entity_ids))
-        except KeyError:
-            raise Exception(resp.text)
-    else:  # If a list of integers is given, return an dict of dicts, keyed by id
-        all_results = {}
-        for id_batch in list_chunk(entity_ids):
-            params = {'ids': id_batch}
-            resp = get_data(url, headers, params)
-            result = resp.json()['data']
-            for id_str in result.keys():
-                all_results[id_str] = result[id_str]
-        return all_results
+    path = 'v2/' + entity_type
+
+    def fetch(id_batch):
+        # Entities found in the disk cache, if enabled, are not requested
+        cached = disk_cache.get_cached('entities', context.api_host, context.access_token,
+                                       [(entity_type, str(entity_id)) for entity_id in id_batch])
+        result = dict((id_str, entity) for (_, id_str), entity in cached.items())
+        missing_ids = [entity_id for entity_id in id_batch if str(entity_id) not in result]
+        if missing_ids:
+            fetched = get_json(context, path, {'ids': missing_ids}, 'data')
+            disk_cache.set_cached('entities', context.api_host, context.access_token,
+                                  dict(((entity_type, id_str), entity)
+                                       for id_str, entity in fetched.items()))
+            result.update(fetched)
+        return result
+
+    scope = (context.api_host, context.access_token)
+    try:
+        # If an integer is given, return only the dict with that id
+        if isinstance(entity_ids, int):
+            return entity_store.get_many(entity_type, [entity_ids], fetch,
+                                         scope).get(str(entity_ids))
+        # If a list of integers is given, return an dict of dicts, keyed by id
+        return entity_store.get_many(entity_type, entity_ids, fetch, scope)
+    except WaitTimeout:
+        raise DeadlineExceeded(None, 0, context.url(path), {'ids': entity_ids})
+
+
+def get_stored_entities(context, entity_type, entity_ids):
+    """Get entities from the entity store or the disk cache, without making any request.
+
+    For clients that request the missing entities themselves, e.g. asynchronously, and keep them
+    with :func:`~store_entities`.
+
+    Parameters
+    ----------
+    context : RequestContext
+    entity_type : string
+    entity_ids : list of integers
+
+    Returns
+    -------
+    tuple
+        Entities keyed by id string, and the list of the ids that need to be requested
+
+    """
+    scope = (context.api_host, context.access_token)
+    entities, missing_ids = entity_store.get_stored(entity_type, entity_ids, scope)
+    cached = disk_cache.get_cached('entities', context.api_host, context.access_token,
+                                   [(entity_type, str(entity_id)) for entity_id in missing_ids])
+    if cached:
+        found = dict((id_str, entity) for (_, id_str), entity in cached.items())
+        entity_store.add(entity_type, found, scope)
+        entities.update(found)
+        missing_ids = [entity_id for entity_id in missing_ids if str(entity_id) not in found]
+    return entities, missing_ids
+
+
+def store_entities(context, entity_type, entities, requested_ids):
+    """Keep requested entities in the entity store and the disk cache, see
+    :func:`~get_stored_entities`.
+
+    Parameters
+    ----------
+    context : RequestContext
+    entity_type : string
+    entities : dict
+        The entities found, keyed by id string
+    requested_ids : list of integers
+        All the ids requested, including those of entities that don't exist
+
+    """
+    disk_cache.set_cached('entities', context.api_host, context.access_token,
+                          dict(((entity_type, id_str), entity)
+                               for id_str, entity in entities.items()))
+    entity_store.add(entity_type, entities, (context.api_host, context.access_token),
+                     [entity_id for entity_id in requested_ids if str(entity_id) not in entities])
 
 
 def get_params_from_selection(**selection):
@@ -341,33 +630,23 @@ def get_data_call_params(**selection):
     return params
 
 
-def get_data_series(access_token, api_host, **selection):
+def get_data_series(access_token, api_host, context=None, **selection):
     logger = get_default_logger()
-    url = '/'.join(['https:', '', api_host, 'v2/data_series/list'])
-    headers = {'authorization': 'Bearer ' + access_token}
+    context = context or get_request_context(access_token, api_host)
     params = get_params_from_selection(**selection)
-    resp = get_data(url, headers, params)
-    try:
-        response = resp.json()['data']
-        if any((series.get('metadata', {}).get('includes_historical_region', False))
-                for series in response):
-            logger.warning('Data series have some historical regions, '
-                           'see https://developers.gro-intelligence.com/faq.html')
-        return response
-    except KeyError:
-        raise Exception(resp.text)
-
-
-def get_top(access_token, api_host, entity_type, num_results=5, **selection):
-    url = '/'.join(['https:', '', api_host, 'v2/top/{}'.format(entity_type)])
-    headers = {'authorization': 'Bearer ' + access_token}
+    response = get_json(context, 'v2/data_series/list', params, 'data')
+    if any((series.get('metadata', {}).get('includes_historical_region', False))
+            for series in response):
+        logger.warning('Data series have some historical regions, '
+                       'see https://developers.gro-intelligence.com/faq.html')
+    return response
+
+
+def get_top(access_token, api_host, entity_type, num_results=5, context=None, **selection):
+    context = context or get_request_context(access_token, api_host)
     params = get_params_from_selection(**selection)
     params['n'] = num_results
-    resp = get_data(url, headers, params)
-    try:
-        return resp.json()
-    except KeyError:
-        raise Exception(resp.text)
+    return get_json(context, 'v2/top/' + entity_type, params)
 
 
 def make_key(key):
@@ -376,28 +655,28 @@ def make_key(key):
     return key
 
 
-def get_source_ranking(access_token, api_host, series):
+def get_source_ranking(access_token, api_host, series, context=None):
     """Given a series, return a list of ranked sources.
 
     :param access_token: API access token.
     :param api_host: API host.
     :param series: Series to calculate source raking for.
+    :param context: RequestContext, optional.
     :return: List of sources that match the series parameters, sorted by rank.
     """
+    context = context or get_request_context(access_token, api_host)
     params = dict((make_key(k), v) for k, v in iter(list(
         get_params_from_selection(**series).items())))
-    url = '/'.join(['https:', '', api_host, 'v2/available/sources'])
-    headers = {'authorization': 'Bearer ' + access_token}
-    return get_data(url, headers, params).json()
+    return get_json(context, 'v2/available/sources', params)
 
 
-def rank_series_by_source(access_token, api_host, series_list):
+def rank_series_by_source(access_token, api_host, series_list, context=None):
     for series in series_list:
         try:
             # Remove source if selected, to consider all sources.
             series.pop('source_name', None)
             series.pop('source_id', None)
-            source_ids = get_source_ranking(access_token, api_host, series)
+            source_ids = get_source_ranking(access_token, api_host, series, context)
         except ValueError:
             continue  # empty response
         for source_id in source_ids:
@@ -407,20 +686,26 @@ def rank_series_by_source(access_token, api_host, series_list):
             yield series_with_source
 
 
-def get_available_timefrequency(access_token, api_host, **series):
+def get_available_timefrequency(access_token, api_host, context=None, **series):
+    context = context or get_request_context(access_token, api_host)
     params = dict((make_key(k), v) for k, v in iter(list(
         get_params_from_selection(**series).items())))
-    url = '/'.join(['https:', '', api_host, 'v2/available/time-frequencies'])
-    headers = {'authorization': 'Bearer ' + access_token}
-    response = get_data(url, headers, params)
-    if response.status_code == 204:
-        return []
-    return [dict_reformat_keys(tf, str_camel_to_snake) for tf in response.json()]
+    path = 'v2/available/time-frequencies'
+
+    def fetch():
+        response = context.get(path, params)
+        if response.status_code == 204:
+            return []
+        return [dict_reformat_keys(tf, str_camel_to_snake) for tf in response.json()]
+    return coalesce(context, path, params, fetch)
 
 
 def list_of_series_to_single_series(series_list, add_belongs_to=False, include_historical=True):
     """Convert list_of_series format from API back into the familiar single_series output format.
 
+    series_list may also be an iterator, such as the one returned by decode_json_stream(), in which
+    case each series is converted as soon as it has been decoded.
+
     >>> list_of_series_to_single_series([{
     ...     'series': { 'metricId': 1, 'itemId': 2, 'regionId': 3, 'unitId': 4, 'inputUnitId': 5,
     ...                 'belongsTo': { 'itemId': 22 }
@@ -474,17 +759,12 @@ def list_of_series_to_single_series(series_list, add_belongs_to=False, include_h
     True
 
     """
-    if not isinstance(series_list, list):
+    if not isinstance(series_list, (list, Iterator)):
         # If the output is an error or None or something else that's not a list, just propagate
         return series_list
     output = []
     for series in series_list:
-        if not (isinstance(series, dict) and isinstance(series.get('data', []), list)):
-            continue
-        series_metadata = series.get('series', {}).get('metadata', {})
-        has_historical_regions = (series_metadata.get('includesHistoricalRegion', False) or
-                                  series_metadata.get('includesHistoricalPartnerRegion', False))
-        if not include_historical and has_historical_regions:
+        if not columnar.is_included(series, include_historical):
             continue
         # All the belongsTo keys are in camelCase. Convert them to snake_case.
         # Only need to do this once per series, so do this outside of the list
@@ -522,17 +802,72 @@ def list_of_series_to_single_series(series_list, add_belongs_to=False, include_h
     return output
 
 
-def get_data_points(access_token, api_host, **selection):
-    headers = {'authorization': 'Bearer ' + access_token}
-    url = '/'.join(['https:', '', api_host, 'v2/data'])
-    params = get_data_call_params(**selection)
-    resp = get_data(url, headers, params)
-    include_historical = selection.get('include_historical', True)
-    return list_of_series_to_single_series(resp.json(), False, include_historical)
+def _materialize(series_list):
+    return list(series_list) if isinstance(series_list, Iterator) else series_list
 
 
-@memoize(maxsize=None)
-def universal_search(access_token, api_host, search_terms):
+def get_list_of_series(context, params, decode=_materialize):
+    """Request data points in the list_of_series format and decode the response.
+
+    The response is decoded series by series as it is downloaded, rather than holding the whole
+    body and the whole decoded document in memory at once.
+
+    Parameters
+    ----------
+    context : RequestContext
+    params : dict
+        As returned by :func:`~get_data_call_params`
+    decode : function, optional
+        Takes the iterator of decoded series, or the decoded body as is if it is not a list, while
+        the response is still open, and returns the result. By default, the series are collected
+        in a list.
+
+    Returns
+    -------
+    list of dicts
+        Or the decoded body as is, if it is not a list, or whatever decode returns
+
+    """
+    resp = context.get('v2/data', params, stream=True)
+    try:
+        return decode(decode_json_stream(resp.iter_content(chunk_size=cfg.STREAM_CHUNK_SIZE)))
+    finally:
+        resp.close()
+
+
+def get_data_points(access_token, api_host, context=None, **selection):
+    """Get the data points of a selection.
+
+    With format='columns' or format='dataframe', they are decoded into NumPy arrays or a
+    DataFrame rather than a dict per point. See :mod:`api.client.columnar`. With
+    format='compact', into compact, dict-like points, see :mod:`api.client.points`.
+    """
+    context = context or get_request_context(access_token, api_host)
+    params = get_data_call_params(**selection)
+    include_historical = selection.get('include_historical', True)
+    data_format = selection.get('format', columnar.RECORDS)
+    columnar.check_format(data_format)
+
+    def decode(series_list):
+        if data_format == columnar.RECORDS:
+            return list_of_series_to_single_series(series_list, False, include_historical)
+        if data_format == columnar.COMPACT:
+            return list_of_series_to_points(series_list, include_historical)
+        return columnar.decode(series_list, data_format, include_historical)
+
+    def fetch():
+        store = series_store.get_series_store()
+        if store is not None and not selection.get('at_time'):
+            # Only the points that may have changed since the series were last requested are
+            # downloaded. See api.client.series_store.
+            return decode(store.get_list_of_series(context.api_host, context.access_token, params,
+                                                   functools.partial(get_list_of_series, context)))
+        return get_list_of_series(context, params, decode)
+    return coalesce(context, 'v2/data', params, fetch, include_historical, data_format)
+
+
+@cached('universal_search')
+def universal_search(access_token, api_host, search_terms, context=None):
     """Search across all entity types for the given terms.
 
     Parameters
@@ -540,6 +875,7 @@ def universal_search(access_token, api_host, search_terms):
     access_token : string
     api_host : string
     search_terms : string
+    context : RequestContext, optional
 
     Returns
     -------
@@ -550,71 +886,84 @@ def universal_search(access_token, api_host, search_terms):
             [[5604, 'item'], [10204, 'item'], [410032, 'metric'], ....]
 
     """
-    url_pieces = ['https:', '', api_host, 'v2/search']
-    url = '/'.join(url_pieces)
-    headers = {'authorization': 'Bearer ' + access_token}
-    resp = get_data(url, headers, {'q': search_terms})
-    return resp.json()
+    context = context or get_request_context(access_token, api_host)
+    return get_json_cached(context, 'search', (None, search_terms), 'v2/search',
+                           {'q': search_terms})
 
 
-@memoize(maxsize=None)
-def search(access_token, api_host, entity_type, search_terms):
-    url = '/'.join(['https:', '', api_host, 'v2/search', entity_type])
-    headers = {'authorization': 'Bearer ' + access_token}
-    resp = get_data(url, headers, {'q': search_terms})
-    return resp.json()
+@cached('search')
+def search(access_token, api_host, entity_type, search_terms, context=None):
+    context = context or get_request_context(access_token, api_host)
+    return get_json_cached(context, 'search', (entity_type, search_terms),
+                           'v2/search/' + entity_type, {'q': search_terms})
 
 
-def search_and_lookup(access_token, api_host, entity_type, search_terms, num_results=10):
-    search_results = search(access_token, api_host, entity_type, search_terms)[:num_results]
+def search_and_lookup(access_token, api_host, entity_type, search_terms, num_results=10,
+                      context=None):
+    search_results = search(access_token, api_host, entity_type, search_terms,
+                            context=context)[:num_results]
     search_result_ids = [result['id'] for result in search_results]
-    search_result_details = lookup(access_token, api_host, entity_type, search_result_ids)
+    search_result_details = lookup(access_token, api_host, entity_type, search_result_ids,
+                                   context=context)
     for search_result_id in search_result_ids:
         yield search_result_details[str(search_result_id)]
 
 
-def lookup_belongs(access_token, api_host, entity_type, entity_id):
-    parent_ids = lookup(access_token, api_host, entity_type, entity_id)['belongsTo']
-    parent_details = lookup(access_token, api_host, entity_type, parent_ids)
+def lookup_belongs(access_token, api_host, entity_type, entity_id, context=None):
+    graph = ontology.get_graph(entity_type)
+    if graph is not None and entity_id in graph:
+        parent_ids = graph.belongs_to(entity_id).tolist()
+    else:
+        parent_ids = lookup(access_token, api_host, entity_type, entity_id,
+                            context=context)['belongsTo']
+    parent_details = lookup(access_token, api_host, entity_type, parent_ids, context=context)
     for parent_id in parent_ids:
         yield parent_details[str(parent_id)]
 
 
-def get_geo_centre(access_token, api_host, region_id):
-    url = '/'.join(['https:', '', api_host, 'v2/geocentres?regionIds=' +
-                    str(region_id)])
-    headers = {'authorization': 'Bearer ' + access_token}
-    resp = get_data(url, headers)
-    return resp.json()['data']
+def get_geo_centre(access_token, api_host, region_id, context=None):
+    context = context or get_request_context(access_token, api_host)
+    return get_json(context, 'v2/geocentres', {'regionIds': region_id}, 'data')
 
 
-@memoize(maxsize=None)
-def get_geojson(access_token, api_host, region_id):
-    url = '/'.join(['https:', '', api_host, 'v2/geocentres?includeGeojson=True&regionIds=' +
-                    str(region_id)])
-    headers = {'authorization': 'Bearer ' + access_token}
-    resp = get_data(url, headers)
-    for region in resp.json()['data']:
-        return json.loads(region['geojson'])
+@cached('get_geojson', max_bytes=cfg.GEOJSON_CACHE_MAX_BYTES)
+def get_geojson(access_token, api_host, region_id, context=None):
+    context = context or get_request_context(access_token, api_host)
+    for region in get_json(context, 'v2/geocentres', {'includeGeojson': True,
+                                                      'regionIds': region_id}, 'data'):
+        return json_backend.loads(region['geojson'])
     return None
 
 
-def get_descendant_regions(access_token, api_host, region_id,
-                           descendant_level=False, include_historical=True, include_details=True):
-    url = '/'.join(['https:', '', api_host, 'v2/regions/contains'])
-    headers = {'authorization': 'Bearer ' + access_token}
+def get_descendant_regions(access_token, api_host, region_id, descendant_level=False,
+                           include_historical=True, include_details=True, context=None):
+    context = context or get_request_context(access_token, api_host)
+    graph = ontology.get_graph('regions')
+    if graph is not None and region_id in graph:
+        # No request needed, see api.client.ontology
+        descendant_region_ids = graph.descendants(region_id, descendant_level or None,
+                                                  include_historical).tolist()
+        if not include_details:
+            return [{'id': descendant_region_id}
+                    for descendant_region_id in descendant_region_ids]
+        region_details = lookup(access_token, api_host, 'regions', descendant_region_ids,
+                                context=context)
+        return [region_details[str(descendant_region_id)]
+                for descendant_region_id in descendant_region_ids]
+
     params = {'ids': [region_id]}
     if descendant_level:
         params['level'] = descendant_level
     else:
         params['distance'] = -1
 
-    resp = get_data(url, headers, params)
-    descendant_region_ids = resp.json()['data'][str(region_id)]
+    descendant_region_ids = get_json(context, 'v2/regions/contains', params,
+                                     'data')[str(region_id)]
 
     # Filter out regions with the 'historical' flag set to true
     if not include_historical or include_details:
-        region_details = lookup(access_token, api_host, 'regions', descendant_region_ids)
+        region_details = lookup(access_token, api_host, 'regions', descendant_region_ids,
+                                context=context)
 
         if not include_historical:
             descendant_region_ids = [region['id'] for region in region_details.values()
@@ -1,7 +1,8 @@
+import json
 import mock
 import numpy as np
 
-from api.client import lib
+from api.client import cfg, lib
 import platform
 from pkg_resources import get_distribution
 
@@ -33,11 +34,22 @@ def initialize_requests_mocker_and_get_mock_data(mock_requests_get, mock_data={
     ]}
 ):
     mock_requests_get.return_value.json.return_value = mock_data
+    mock_requests_get.return_value.iter_content.return_value = [
+        json.dumps(mock_data).encode('utf-8')
+    ]
     mock_requests_get.return_value.status_code = 200
     return mock_data
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.post')
+def test_get_access_token(mock_requests_post):
+    mock_requests_post.return_value.status_code = 200
+    mock_requests_post.return_value.json.return_value = {'data': {'accessToken': 'token'}}
+    assert lib.get_access_token(MOCK_HOST, 'user@example.com', 'password') == 'token'
+    assert mock_requests_post.call_args[1]['timeout'] == cfg.REQUEST_TIMEOUT
+
+
+@mock.patch('requests.Session.get')
 def test_get_available(mock_requests_get):
     mock_data = initialize_requests_mocker_and_get_mock_data(mock_requests_get)
 
@@ -48,7 +60,7 @@ def test_get_available(mock_requests_get):
         assert lib.get_available(MOCK_TOKEN, MOCK_HOST, ent_type) == mock_data['data']
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_list_available(mock_requests_get):
     # Tests the base functionality
     mock_data = initialize_requests_mocker_and_get_mock_data(mock_requests_get)
@@ -58,7 +70,7 @@ def test_list_available(mock_requests_get):
     assert lib.list_available(MOCK_TOKEN, MOCK_HOST, entities) == mock_data['data']
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_list_available_snake_to_camel(mock_requests_get):
     # Tests that the camel-ing fix is working properly.
     mock_data = initialize_requests_mocker_and_get_mock_data(mock_requests_get)
@@ -66,7 +78,7 @@ def test_list_available_snake_to_camel(mock_requests_get):
     assert lib.list_available(MOCK_TOKEN, MOCK_HOST, entities) == mock_data['data']
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_single_lookup(mock_requests_get):
     api_response = {'data': {'12345': {'id': 12345, 'name': 'Test', 'contains': []}}}
     initialize_requests_mocker_and_get_mock_data(mock_requests_get, api_response)
@@ -74,7 +86,7 @@ def test_single_lookup(mock_requests_get):
     assert lib.lookup(MOCK_TOKEN, MOCK_HOST, 'items', 12345) == expected_return
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_multiple_lookups(mock_requests_get):
     api_response = {
         'data': {
@@ -90,7 +102,7 @@ def test_multiple_lookups(mock_requests_get):
     assert lib.lookup(MOCK_TOKEN, MOCK_HOST, 'items', [12345, 67890]) == expected_return
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_lookup_with_numpy(mock_requests_get):
     api_response = {
         'data': {
@@ -109,7 +121,7 @@ def test_lookup_with_numpy(mock_requests_get):
                       np.array([12345])[0]) == expected_return['12345']
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_get_data_series(mock_requests_get):
     # Test general case
     mock_data = initialize_requests_mocker_and_get_mock_data(mock_requests_get)
@@ -119,7 +131,7 @@ def test_get_data_series(mock_requests_get):
     assert lib.get_data_series(MOCK_TOKEN, MOCK_HOST, **selection_dict) == mock_data['data']
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_get_data_points(mock_requests_get):
     list_of_series_format_data = [{
         'series': {},
@@ -150,7 +162,7 @@ def test_get_data_points(mock_requests_get):
     assert lib.get_data_points(MOCK_TOKEN, MOCK_HOST, **selection_dict) == single_series_format_data
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_search(mock_requests_get):
     mock_data = ['obj1', 'obj2', 'obj3']
     mock_data = initialize_requests_mocker_and_get_mock_data(mock_requests_get, mock_data=mock_data)
@@ -175,7 +187,7 @@ def test_search_and_lookup(search_mocked, lookup_mocked):
 
 
 @mock.patch('api.client.lib.lookup')
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_lookup_belongs(mock_requests_get, lookup_mocked):
     mock_requests_get.return_value.json.return_value = {'data': {'1': [3]}}
     mock_requests_get.return_value.status_code = 200
@@ -186,7 +198,7 @@ def test_lookup_belongs(mock_requests_get, lookup_mocked):
     assert lookup_belongs_result == [LOOKUP_MAP['regions']['3']]
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_get_source_ranking(mock_requests_get):
     mock_return = [60, 14, 2, 1]
     mock_requests_get.return_value.json.return_value = mock_return
@@ -198,7 +210,7 @@ def test_get_source_ranking(mock_requests_get):
     assert len(ranked_sources_list) == 4
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_rank_series_by_source(mock_requests_get):
     # for each series selection, mock ranking of 3 source ids
     mock_return = [11, 22, 33]
@@ -222,7 +234,7 @@ def test_rank_series_by_source(mock_requests_get):
     assert mock_return + mock_return == [x['source_id'] for x in c]
 
 
-def lookup_mock(MOCK_TOKEN, MOCK_HOST, entity_type, entity_ids):
+def lookup_mock(MOCK_TOKEN, MOCK_HOST, entity_type, entity_ids, context=None):
     if isinstance(entity_ids, int):
         return LOOKUP_MAP[entity_type][str(entity_ids)]
     if isinstance(entity_ids, list):
@@ -231,7 +243,7 @@ def lookup_mock(MOCK_TOKEN, MOCK_HOST, entity_type, entity_ids):
 
 
 @mock.patch('api.client.lib.lookup')
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_descendant_regions(mock_requests_get, lookup_mocked):
     mock_requests_get.return_value.json.return_value = {'data': {'3': [1, 2]}}
     mock_requests_get.return_value.status_code = 200
@@ -270,7 +282,7 @@ def test_descendant_regions(mock_requests_get, lookup_mocked):
                                       include_details=False) == [{'id': 2}]
 
 
-@mock.patch('requests.get')
+@mock.patch('requests.Session.get')
 def test_get_top(mock_requests_get):
     mock_response = [
         {'itemId': 274, 'value': 13175206696, 'unitId': 14},
@@ -281,3 +293,39 @@ def test_get_top(mock_requests_get):
     mock_requests_get.return_value.status_code = 200
     assert lib.get_top(MOCK_TOKEN, MOCK_HOST, 'items', metric_id=14) == mock_response
     assert lib.get_top(MOCK_TOKEN, MOCK_HOST, 'items', num_results=3, metric_id=14) == mock_response
+
+
+@mock.patch('requests.Session.get')
+def test_get_data_points_streamed(mock_requests_get):
+    # Body split across chunks at arbitrary points, including inside a multi-byte character
+    body = json.dumps([{
+        'series': {'metricId': 1, 'itemId': 2, 'regionId': region_id, 'unitId': 4},
+        'data': [['2000-01-01', '2000-12-31', 1.5], ['2001-01-01', '2001-12-31', 2, u'caf\xe9']]
+    } for region_id in range(3)], ensure_ascii=False).encode('utf-8')
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.iter_content.return_value = [body[i:i + 7]
+                                                                for i in range(0, len(body), 7)]
+
+    points = lib.get_data_points(MOCK_TOKEN, MOCK_HOST, metric_id=1, item_id=2, region_id=[0, 1, 2])
+    assert [(p['region_id'], p['value'], p['reporting_date']) for p in points] == [
+        (0, 1.5, None), (0, 2, u'caf\xe9'),
+        (1, 1.5, None), (1, 2, u'caf\xe9'),
+        (2, 1.5, None), (2, 2, u'caf\xe9')
+    ]
+    assert mock_requests_get.call_args[1]['stream']
+    mock_requests_get.return_value.close.assert_called_once_with()
+
+
+@mock.patch('requests.Session.get')
+def test_get_data_points_no_content(mock_requests_get):
+    mock_requests_get.return_value.status_code = 204
+    mock_requests_get.return_value.iter_content.return_value = []
+    assert lib.get_data_points(MOCK_TOKEN, MOCK_HOST, metric_id=1) == []
+
+
+@mock.patch('requests.Session.get')
+def test_get_data_points_not_a_list(mock_requests_get):
+    # Bodies that are not a list of series are passed through, as when they were decoded whole
+    mock_requests_get.return_value.status_code = 206
+    mock_requests_get.return_value.iter_content.return_value = [b'  {"error": ', b'"Partial"}']
+    assert lib.get_data_points(MOCK_TOKEN, MOCK_HOST, metric_id=1) == {'error': 'Partial'}
@@ -0,0 +1,218 @@
+"""Bounded in-memory caches for the results of lib functions.
+
+Unlike functools.lru_cache(maxsize=None), which the memoized lib functions used to be wrapped
+with, these caches are bounded in number of entries and in memory, expire entries after a time,
+can be invalidated explicitly and keep statistics, so that long-running processes can keep hot
+results without growing forever::
+
+    lib.search.cache_info()
+    # {'hits': 120, 'misses': 14, 'evictions': 0, 'expirations': 2, 'entries': 12,
+    #  'size': 48213, ...}
+    lib.search.cache_invalidate(access_token, api_host, 'items', 'corn')
+    memory_cache.clear_caches()  # all of them
+
+The memory used by a value is estimated as the length of its JSON encoding. It is smaller than
+the actual memory used by the decoded Python objects, but proportional to it.
+"""
+
+from collections import OrderedDict
+import functools
+import json
+import threading
+
+try:
+    # Python 3
+    from time import monotonic
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+
+from api.client import cfg
+from api.client.context import RequestContext
+
+
+def estimate_size(value):
+    """Estimate the memory used by a value, in bytes.
+
+    >>> estimate_size({'id': 1})
+    8
+
+    """
+    try:
+        return len(json.dumps(value, separators=(',', ':'), default=str))
+    except (TypeError, ValueError):
+        return 0
+
+
+class LRUCache(object):
+    """A thread-safe least recently used cache with optional expiry.
+
+    Parameters
+    ----------
+    maxsize : integer
+        Maximum number of entries
+    max_bytes : integer, optional
+        Maximum estimated memory used by the values, see :func:`~estimate_size`
+    ttl : float, optional
+        Seconds after which entries expire
+
+    >>> cache = LRUCache(maxsize=2)
+    >>> cache.set('a', 1); cache.set('b', 2); cache.get('a')
+    1
+    >>> cache.set('c', 3)  # evicts 'b', the least recently used
+    >>> cache.get('b') is None
+    True
+
+    """
+
+    def __init__(self, maxsize, max_bytes=None, ttl=None):
+        self.maxsize = maxsize
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (value, size, expires_at)
+        self._size = 0
+        self._hits = self._misses = self._evictions = self._expirations = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] is not None and entry[2] <= monotonic():
+                self._remove(key)
+                self._expirations += 1
+                entry = None
+            if entry is None:
+                self._misses += 1
+                return default
+            self._hits += 1
+            # Move to the most recently used end
+            del self._entries[key]
+            self._entries[key] = entry
+            return entry[0]
+
+    def set(self, key, value):
+        size = estimate_size(value) if self.max_bytes is not None else 0
+        if self.max_bytes is not None and size > self.max_bytes:
+            return  # Would evict everything else
+        expires_at = monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (value, size, expires_at)
+            self._size += size
+            while (len(self._entries) > self.maxsize or
+                   (self.max_bytes is not None and self._size > self.max_bytes)):
+                self._remove(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._size -= size
+
+    def invalidate(self, key):
+        """Remove an entry. Returns whether it was there."""
+        with self._lock:
+            if key not in self._entries:
+                return False
+            self._remove(key)
+            return True
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+
+    def get_stats(self):
+        """Get the number of hits, misses, evictions and expirations, and the current size.
+
+        Returns
+        -------
+        dict
+
+        """
+        with self._lock:
+            return {'hits': self._hits, 'misses': self._misses, 'evictions': self._evictions,
+                    'expirations': self._expirations, 'entries': len(self._entries),
+                    'size': self._size, 'maxsize': self.maxsize, 'max_bytes': self.max_bytes,
+                    'ttl': self.ttl}
+
+
+_caches = {}
+
+
+def _make_key(args, kwargs):
+    # The RequestContext a lib function is called with doesn't change its result: leave it out,
+    # so that clients with the same access token share entries.
+    args = tuple(arg for arg in args if not isinstance(arg, RequestContext))
+    kwargs = tuple(sorted((key, value) for key, value in kwargs.items()
+                          if not isinstance(value, RequestContext)))
+    return args + ((kwargs,) if kwargs else ())
+
+
+def cached(name, maxsize=None, max_bytes=None, ttl=None):
+    """Decorator caching the results of a function in an :class:`~LRUCache`.
+
+    The decorated function gets the methods `cache_info()`, `cache_clear()` and
+    `cache_invalidate(*args, **kwargs)`, which removes the result of one call.
+
+    Parameters
+    ----------
+    name : string
+        Under which the statistics of the cache are reported by :func:`~get_cache_stats`
+    maxsize : integer, optional
+        Defaults to cfg.MEMORY_CACHE_MAXSIZE
+    max_bytes : integer, optional
+        Defaults to cfg.MEMORY_CACHE_MAX_BYTES
+    ttl : float, optional
+        Defaults to cfg.MEMORY_CACHE_TTL
+
+    """
+    cache = LRUCache(maxsize or cfg.MEMORY_CACHE_MAXSIZE, max_bytes or cfg.MEMORY_CACHE_MAX_BYTES,
+                     ttl or cfg.MEMORY_CACHE_TTL)
+    _caches[name] = cache
+    missing = object()
+
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            key = _make_key(args, kwargs)
+            result = cache.get(key, missing)
+            if result is missing:
+                result = function(*args, **kwargs)
+                cache.set(key, result)
+            return result
+
+        def cache_invalidate(*args, **kwargs):
+            return cache.invalidate(_make_key(args, kwargs))
+
+        wrapper.cache_info = cache.get_stats
+        wrapper.cache_clear = cache.clear
+        wrapper.cache_invalidate = cache_invalidate
+        wrapper.__wrapped__ = function  # Not set by functools.wraps in Python 2
+        return wrapper
+    return decorator
+
+
+def get_cache_stats():
+    """Get the statistics of all caches, by name.
+
+    Returns
+    -------
+    dict
+
+    """
+    return dict((name, cache.get_stats()) for name, cache in _caches.items())
+
+
+def clear_caches():
+    """Empty all caches, e.g. after entities are known to have changed."""
+    for cache in _caches.values():
+        cache.clear()
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python memory_cache.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
@@ -0,0 +1,75 @@
+import mock
+
+from api.client import lib, memory_cache
+from api.client.memory_cache import LRUCache, cached
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.memory_cache.token'
+
+
+def test_lru_eviction():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    assert cache.get_stats()['evictions'] == 1
+
+
+def test_max_bytes():
+    cache = LRUCache(maxsize=100, max_bytes=20)
+    cache.set('a', 'x' * 8)  # 10 bytes as JSON
+    cache.set('b', 'y' * 8)
+    assert cache.get_stats()['size'] == 20
+    cache.set('c', 'z' * 8)
+    assert cache.get('a') is None
+    assert cache.get_stats()['size'] == 20
+    # Values too big for the cache are not stored
+    cache.set('d', 'x' * 100)
+    assert cache.get('d') is None
+    assert cache.get('c') == 'z' * 8
+
+
+def test_ttl():
+    cache = LRUCache(maxsize=10, ttl=60)
+    with mock.patch('api.client.memory_cache.monotonic', return_value=1000):
+        cache.set('a', 1)
+        assert cache.get('a') == 1
+    with mock.patch('api.client.memory_cache.monotonic', return_value=1061):
+        assert cache.get('a') is None
+    stats = cache.get_stats()
+    assert (stats['hits'], stats['misses'], stats['expirations']) == (1, 1, 1)
+
+
+def test_cached_decorator():
+    calls = []
+
+    @cached('test_cached_decorator', maxsize=10)
+    def square(x, context=None):
+        calls.append(x)
+        return x * x
+    context = lib.new_request_context(MOCK_TOKEN, MOCK_HOST)
+    assert square(3) == 9
+    # The RequestContext is not part of the key
+    assert square(3, context=context) == 9
+    assert calls == [3]
+    assert square.cache_invalidate(3)
+    assert square(3) == 9
+    assert calls == [3, 3]
+    assert memory_cache.get_cache_stats()['test_cached_decorator']['hits'] == 1
+    square.cache_clear()
+    assert square.cache_info()['entries'] == 0
+
+
+@mock.patch('requests.Session.get')
+def test_lib_search_is_cached(mock_requests_get):
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.json.return_value = [{'id': 274}]
+    lib.search(MOCK_TOKEN, MOCK_HOST, 'items', 'corn')
+    lib.search(MOCK_TOKEN, MOCK_HOST, 'items', 'corn')
+    assert mock_requests_get.call_count == 1
+    lib.search.cache_invalidate(MOCK_TOKEN, MOCK_HOST, 'items', 'corn')
+    lib.search(MOCK_TOKEN, MOCK_HOST, 'items', 'corn')
+    assert mock_requests_get.call_count == 2
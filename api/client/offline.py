@@ -0,0 +1,69 @@
+"""Offline mode: answer calls from local caches only, never from the API.
+
+Reproducible research runs and CI shouldn't depend on the API being reachable. In offline mode,
+Client, GroClient, BatchClient and AsyncGroClient methods are answered from what is kept
+locally:
+- the in-memory caches and the entity store;
+- the disk cache (:mod:`api.client.disk_cache`);
+- the series store (:mod:`api.client.series_store`);
+- RevalidationCache middleware (:mod:`api.client.revalidation`);
+- entity graphs (:mod:`api.client.ontology`).
+
+The asynchronous requests of BatchClient and AsyncGroClient go through the entity store, the disk
+cache and the series store, but not the in-memory caches of lib functions.
+
+A call that would need a request raises :class:`api.client.lib.OfflineError` instead, and is
+recorded, so that a run can report everything it would have requested::
+
+    from api.client import disk_cache, offline, series_store
+    disk_cache.enable_disk_cache()
+    series_store.enable_series_store()
+    run_notebook(client)  # online once, to fill the caches
+
+    offline.enable_offline_mode()
+    run_notebook(client)  # from the caches only
+    offline.get_misses()
+    # [{'url': 'https://api.gro-intelligence.com/v2/data', 'params': {...}}, ...]
+"""
+
+import threading
+
+_lock = threading.Lock()
+_offline = False
+_misses = []
+
+
+def enable_offline_mode():
+    """Stop making requests, in all threads. Clears the misses recorded so far."""
+    global _offline
+    with _lock:
+        _offline = True
+        del _misses[:]
+
+
+def disable_offline_mode():
+    global _offline
+    _offline = False
+
+
+def is_offline():
+    return _offline
+
+
+def record_miss(url, params):
+    """Record a request that couldn't be made because of offline mode."""
+    with _lock:
+        _misses.append({'url': url, 'params': dict(params) if params else {}})
+
+
+def get_misses():
+    """Get the requests that would have been made since offline mode was enabled.
+
+    Returns
+    -------
+    list of dicts
+        'url' and 'params' of each request, in the order they were attempted
+
+    """
+    with _lock:
+        return [dict(miss) for miss in _misses]
@@ -0,0 +1,103 @@
+import json
+import os
+import time
+
+import mock
+import pytest
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPRequest, HTTPResponse
+from tornado.httputil import HTTPHeaders
+
+from api.client import lib, offline, series_store
+from api.client.batch_client import BatchClient
+from api.client.disk_cache import DiskCache
+from api.client.gro_client import GroClient
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.offline.token'
+
+
+@pytest.fixture
+def offline_mode():
+    offline.enable_offline_mode()
+    yield
+    offline.disable_offline_mode()
+
+
+@mock.patch('requests.Session.get')
+def test_requests_are_refused(mock_requests_get, offline_mode):
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    with pytest.raises(lib.OfflineError) as err:
+        client.get_data_series(metric_id=1)
+    assert err.value.status_code is None
+    assert 'Offline mode' in err.value.message
+    assert not mock_requests_get.called
+    assert offline.get_misses() == [{'url': 'https://pytest.groclient.url/v2/data_series/list',
+                                     'params': {'metricId': 1}}]
+    with pytest.raises(lib.OfflineError):
+        lib.get_access_token(MOCK_HOST, 'user@example.com', 'password')
+    # The password is not recorded
+    assert offline.get_misses()[1]['params'] == {'email': 'user@example.com'}
+    offline.enable_offline_mode()
+    assert offline.get_misses() == []
+
+
+def test_expired_disk_cache_entries(tmpdir, offline_mode):
+    cache = DiskCache(os.path.join(str(tmpdir), 'cache.sqlite'))
+    cache.set('a', 1, ttl=60)
+    with mock.patch('time.time', return_value=time.time() + 120):
+        assert cache.get('a') == 1
+        offline.disable_offline_mode()
+        assert cache.get('a') is None
+
+
+@mock.patch('requests.Session.get')
+def test_series_store(mock_requests_get, tmpdir):
+    series_store.enable_series_store(os.path.join(str(tmpdir), 'series.sqlite'))
+    response = mock.Mock(status_code=200)
+    response.iter_content.return_value = [json.dumps([{
+        'series': {'metricId': 1, 'regionId': 1, 'unitId': 1},
+        'data': [['2019-01-01T00:00:00.000Z', '2019-01-01T00:00:00.000Z', 1]]}]).encode('utf-8')]
+    mock_requests_get.return_value = response
+    try:
+        client = GroClient(MOCK_HOST, MOCK_TOKEN)
+        points = client.get_data_points(metric_id=1, region_id=1)
+        offline.enable_offline_mode()
+        # Served as stored, without a delta download
+        assert client.get_data_points(metric_id=1, region_id=1) == points
+        assert mock_requests_get.call_count == 1
+        with pytest.raises(lib.OfflineError):
+            client.get_data_points(metric_id=2, region_id=1)
+        assert [miss['params']['metricId'] for miss in offline.get_misses()] == [2]
+    finally:
+        offline.disable_offline_mode()
+        series_store.disable_series_store()
+
+
+def test_batch_series_store(tmpdir):
+    series_store.enable_series_store(os.path.join(str(tmpdir), 'series.sqlite'))
+    body = json.dumps([{
+        'series': {'metricId': 1, 'regionId': 1, 'unitId': 1},
+        'data': [['2019-01-01T00:00:00.000Z', '2019-01-01T00:00:00.000Z', 1]]}]).encode('utf-8')
+
+    def fetch(http_request):
+        future = Future()
+        future.set_result(HTTPResponse(HTTPRequest(http_request.url), 200,
+                                       headers=HTTPHeaders(),
+                                       buffer=mock.Mock(getvalue=lambda: body)))
+        return future
+
+    client = BatchClient(MOCK_HOST, MOCK_TOKEN)
+    client._http_client = mock.Mock()
+    client._http_client.fetch.side_effect = fetch
+    try:
+        points = client.batch_async_get_data_points([{'metric_id': 1, 'region_id': 1}])
+        offline.enable_offline_mode()
+        results = client.batch_async_get_data_points([{'metric_id': 1, 'region_id': 1},
+                                                      {'metric_id': 2, 'region_id': 1}])
+        assert results[0] == points[0]
+        assert isinstance(results[1], lib.OfflineError)
+        assert client._http_client.fetch.call_count == 1
+    finally:
+        offline.disable_offline_mode()
+        series_store.disable_series_store()
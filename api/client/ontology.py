@@ -0,0 +1,326 @@
+"""Local snapshots of the entity graph, for hierarchy queries without requests.
+
+Regions, items and metrics form a graph through their 'contains' and 'belongsTo' relations.
+Walking it through the API takes a request per step. An :class:`EntityGraph` holds the whole
+graph of an entity type in NumPy arrays instead: ids, levels and historical flags, and the two
+relations in compressed sparse row (CSR) layout. Descendant, ancestor and level queries then run
+locally::
+
+    from api.client import ontology
+    graph = ontology.build_graph(client, 'regions')  # crawls the graph from the World region
+    graph.save('regions.npz')
+
+    ontology.set_graph(ontology.EntityGraph.load('regions.npz'))
+    client.get_descendant_regions(1215, 4, include_details=False)  # no request
+
+Once a graph is set, :func:`api.client.lib.get_descendant_regions` and
+:func:`api.client.lib.lookup_belongs`, and the same methods of AsyncGroClient, use it for the
+entities it contains, and fall back to the API for the others. Entity details are still looked
+up, unless they aren't asked for.
+"""
+
+import time
+
+import numpy as np
+
+from api.client.utils import list_chunk
+
+# Bumped when the layout of saved graphs changes. Graphs saved with another version can't be
+# loaded and must be built again.
+FORMAT_VERSION = 1
+
+# Level of entities that don't have one, such as items
+NO_LEVEL = -1
+
+_graphs = {}
+
+
+def _gather(indptr, indices, positions):
+    """Concatenate the rows at `positions` of a CSR matrix, without a Python loop.
+
+    >>> _gather(np.array([0, 2, 2, 3]), np.array([10, 11, 12]), np.array([0, 2]))
+    array([10, 11, 12])
+
+    """
+    starts = indptr[positions]
+    counts = indptr[positions + 1] - starts
+    total = int(counts.sum())
+    if not total:
+        return indices[:0]
+    # Index of every element of the rows: the start of its row plus its offset in the row
+    row_offsets = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return indices[row_offsets + np.arange(total)]
+
+
+def _to_csr(ids, relations):
+    """Build the CSR layout of a relation, given as lists of related ids by entity id."""
+    counts = np.array([len(relations.get(entity_id) or []) for entity_id in ids], dtype=np.int64)
+    indptr = np.zeros(len(ids) + 1, dtype=np.int64)
+    np.cumsum(counts, out=indptr[1:])
+    indices = np.array([related_id for entity_id in ids
+                        for related_id in relations.get(entity_id) or []], dtype=np.int32)
+    return indptr, indices
+
+
+class EntityGraph(object):
+    """The 'contains' and 'belongsTo' relations of the entities of one type.
+
+    Related entities are stored by id, so that a graph covering part of the entities, e.g. the
+    regions of one country, still knows the parents that it doesn't include.
+
+    Parameters
+    ----------
+    entity_type : string
+        e.g. 'regions'
+    ids : numpy array of integers
+        Sorted
+    levels : numpy array of integers
+        Level of each entity, NO_LEVEL if it has none
+    historical : numpy array of booleans
+    contains_indptr, contains : numpy arrays
+        CSR layout of the ids each entity contains
+    belongs_to_indptr, belongs_to : numpy arrays
+        CSR layout of the ids each entity belongs to
+    created_at : float, optional
+        Time the graph was built at, in seconds since the epoch
+
+    """
+
+    def __init__(self, entity_type, ids, levels, historical, contains_indptr, contains,
+                 belongs_to_indptr, belongs_to, created_at=None):
+        self.entity_type = entity_type
+        self.ids = ids
+        self.levels = levels
+        self.historical = historical
+        self._contains = (contains_indptr, contains)
+        self._belongs_to = (belongs_to_indptr, belongs_to)
+        self.created_at = created_at if created_at is not None else time.time()
+
+    @classmethod
+    def from_entities(cls, entity_type, entities):
+        """Build a graph from entity details, as returned by lookup().
+
+        >>> graph = EntityGraph.from_entities('regions', {
+        ...     '0': {'id': 0, 'level': 1, 'contains': [1215], 'belongsTo': []},
+        ...     '1215': {'id': 1215, 'level': 3, 'contains': [13100], 'belongsTo': [0]},
+        ...     '13100': {'id': 13100, 'level': 4, 'contains': [], 'belongsTo': [1215],
+        ...               'historical': False}})
+        >>> graph.descendants(0).tolist()
+        [1215, 13100]
+        >>> graph.descendants(0, level=4).tolist()
+        [13100]
+        >>> graph.ancestors(13100).tolist()
+        [1215, 0]
+        >>> graph.level(1215)
+        3
+
+        Parameters
+        ----------
+        entity_type : string
+        entities : dict
+            Entity details keyed by id
+
+        Returns
+        -------
+        EntityGraph
+
+        """
+        entities = dict((int(entity_id), entity) for entity_id, entity in entities.items())
+        ids = sorted(entities)
+        levels = np.array([NO_LEVEL if entities[entity_id].get('level') is None
+                           else entities[entity_id]['level'] for entity_id in ids], dtype=np.int16)
+        historical = np.array([bool(entities[entity_id].get('historical', False))
+                               for entity_id in ids], dtype=bool)
+        contains_indptr, contains = _to_csr(ids, dict(
+            (entity_id, entity.get('contains')) for entity_id, entity in entities.items()))
+        belongs_to_indptr, belongs_to = _to_csr(ids, dict(
+            (entity_id, entity.get('belongsTo')) for entity_id, entity in entities.items()))
+        return cls(entity_type, np.array(ids, dtype=np.int32), levels, historical,
+                   contains_indptr, contains, belongs_to_indptr, belongs_to)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, entity_id):
+        position = np.searchsorted(self.ids, entity_id)
+        return bool(position < len(self.ids) and self.ids[position] == entity_id)
+
+    def _positions(self, entity_ids):
+        """Positions of the given ids in the graph, leaving out those it doesn't have."""
+        entity_ids = np.asarray(entity_ids, dtype=self.ids.dtype)
+        if not len(self.ids) or not len(entity_ids):
+            return np.array([], dtype=np.int64)
+        positions = np.minimum(np.searchsorted(self.ids, entity_ids), len(self.ids) - 1)
+        return positions[self.ids[positions] == entity_ids]
+
+    def _position(self, entity_id):
+        if entity_id not in self:
+            raise KeyError(entity_id)
+        return np.searchsorted(self.ids, entity_id)
+
+    def level(self, entity_id):
+        level = int(self.levels[self._position(entity_id)])
+        return None if level == NO_LEVEL else level
+
+    def is_historical(self, entity_id):
+        return bool(self.historical[self._position(entity_id)])
+
+    def contains(self, entity_id):
+        """Ids of the entities the given entity contains directly."""
+        return _gather(self._contains[0], self._contains[1],
+                       np.array([self._position(entity_id)]))
+
+    def belongs_to(self, entity_id):
+        """Ids of the entities the given entity belongs to directly."""
+        return _gather(self._belongs_to[0], self._belongs_to[1],
+                       np.array([self._position(entity_id)]))
+
+    def _walk(self, entity_id, indptr, indices):
+        # Breadth-first, a whole level of the graph at a time
+        visited = np.array([entity_id], dtype=np.int32)
+        found = []
+        frontier = self._positions([entity_id])
+        while len(frontier):
+            related = np.unique(_gather(indptr, indices, frontier))
+            related = related[~np.isin(related, visited)]
+            visited = np.concatenate([visited, related])
+            found.append(related)
+            frontier = self._positions(related)
+        return np.concatenate(found) if found else np.array([], dtype=np.int32)
+
+    def descendants(self, entity_id, level=None, include_historical=True):
+        """Ids of all the entities the given entity contains, directly or not.
+
+        Parameters
+        ----------
+        entity_id : integer
+        level : integer, optional
+            Only return descendants of this level
+        include_historical : boolean, optional
+            If False, leave out historical entities
+
+        Returns
+        -------
+        numpy array of integers
+            Ordered by distance from the given entity
+
+        Raises
+        ------
+        KeyError
+            If the entity is not in the graph
+
+        """
+        self._position(entity_id)
+        descendants = self._walk(entity_id, *self._contains)
+        if level is None and include_historical:
+            return descendants
+        # Descendants that are not in the graph themselves are left out, their level is unknown
+        positions = self._positions(descendants)
+        keep = np.ones(len(positions), dtype=bool)
+        if level is not None:
+            keep &= self.levels[positions] == level
+        if not include_historical:
+            keep &= ~self.historical[positions]
+        return self.ids[positions[keep]]
+
+    def ancestors(self, entity_id):
+        """Ids of all the entities the given entity belongs to, directly or not, nearest first.
+
+        Raises
+        ------
+        KeyError
+            If the entity is not in the graph
+
+        """
+        self._position(entity_id)
+        return self._walk(entity_id, *self._belongs_to)
+
+    def save(self, path):
+        """Save the graph to a NumPy .npz file."""
+        np.savez_compressed(path, format_version=np.array(FORMAT_VERSION),
+                            entity_type=np.array(self.entity_type),
+                            created_at=np.array(self.created_at), ids=self.ids,
+                            levels=self.levels, historical=self.historical,
+                            contains_indptr=self._contains[0], contains=self._contains[1],
+                            belongs_to_indptr=self._belongs_to[0], belongs_to=self._belongs_to[1])
+
+    @classmethod
+    def load(cls, path):
+        """Load a graph saved with :meth:`~.save`.
+
+        Raises
+        ------
+        ValueError
+            If the graph was saved with another FORMAT_VERSION
+
+        """
+        with np.load(path, allow_pickle=False) as arrays:
+            if int(arrays['format_version']) != FORMAT_VERSION:
+                raise ValueError('{} was saved in format version {}, expected {}. Build it '
+                                 'again.'.format(path, int(arrays['format_version']),
+                                                 FORMAT_VERSION))
+            return cls(str(arrays['entity_type']), arrays['ids'], arrays['levels'],
+                       arrays['historical'], arrays['contains_indptr'], arrays['contains'],
+                       arrays['belongs_to_indptr'], arrays['belongs_to'],
+                       float(arrays['created_at']))
+
+    def __repr__(self):
+        return 'EntityGraph({!r}, {} entities)'.format(self.entity_type, len(self))
+
+
+def build_graph(client, entity_type='regions', root_ids=(0,), batch_size=1000):
+    """Build the graph of the entities contained by the given ones, looking them up with a client.
+
+    Parameters
+    ----------
+    client : api.client.Client
+    entity_type : string, optional
+    root_ids : list of integers, optional
+        The World region by default, which contains all regions
+    batch_size : integer, optional
+        Number of entities per lookup() call. Each call is made of chunked requests.
+
+    Returns
+    -------
+    EntityGraph
+
+    """
+    entities = {}
+    frontier = list(root_ids)
+    while frontier:
+        found = {}
+        for id_batch in list_chunk(frontier, batch_size):
+            found.update(client.lookup(entity_type, id_batch))
+        entities.update(found)
+        frontier = sorted(set(contained_id for entity in found.values()
+                              for contained_id in entity.get('contains') or []
+                              if str(contained_id) not in entities))
+    return EntityGraph.from_entities(entity_type, entities)
+
+
+def set_graph(graph):
+    """Use a graph for the hierarchy queries of its entity type. See the module docstring."""
+    _graphs[graph.entity_type] = graph
+
+
+def get_graph(entity_type):
+    """Get the graph set for an entity type.
+
+    Returns
+    -------
+    EntityGraph or None
+
+    """
+    return _graphs.get(entity_type)
+
+
+def clear_graphs():
+    _graphs.clear()
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python ontology.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
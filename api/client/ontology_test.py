@@ -0,0 +1,98 @@
+import os
+
+import mock
+import numpy as np
+import pytest
+
+from api.client import lib, ontology
+from api.client.ontology import EntityGraph
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.ontology.token'
+
+REGIONS = {
+    '0': {'id': 0, 'name': 'World', 'level': 1, 'contains': [1, 1215], 'belongsTo': []},
+    '1': {'id': 1, 'name': 'Soviet Union', 'level': 3, 'contains': [], 'belongsTo': [0],
+          'historical': True},
+    '1215': {'id': 1215, 'name': 'United States', 'level': 3, 'contains': [13100, 13101],
+             'belongsTo': [0]},
+    '13100': {'id': 13100, 'name': 'Wisconsin', 'level': 4, 'contains': [100000],
+              'belongsTo': [1215]},
+    '13101': {'id': 13101, 'name': 'Wyoming', 'level': 4, 'contains': [100000],
+              'belongsTo': [1215]},
+    '100000': {'id': 100000, 'name': 'Border county', 'level': 5, 'contains': [],
+               'belongsTo': [13100, 13101]},
+}
+
+
+@pytest.fixture
+def graph():
+    graph = EntityGraph.from_entities('regions', REGIONS)
+    ontology.set_graph(graph)
+    yield graph
+    ontology.clear_graphs()
+
+
+def test_queries(graph):
+    assert len(graph) == 6
+    assert 1215 in graph and 5 not in graph
+    assert graph.contains(1215).tolist() == [13100, 13101]
+    # Reached through two parents, listed once
+    assert graph.descendants(1215).tolist() == [13100, 13101, 100000]
+    assert graph.descendants(0, level=3).tolist() == [1, 1215]
+    assert graph.descendants(0, level=3, include_historical=False).tolist() == [1215]
+    assert graph.ancestors(100000).tolist() == [13100, 13101, 1215, 0]
+    assert graph.level(100000) == 5
+    assert graph.is_historical(1)
+    with pytest.raises(KeyError):
+        graph.descendants(5)
+
+
+def test_save_load(graph, tmpdir):
+    path = os.path.join(str(tmpdir), 'regions.npz')
+    graph.save(path)
+    loaded = EntityGraph.load(path)
+    assert loaded.entity_type == 'regions'
+    assert loaded.ids.dtype == np.int32
+    assert loaded.descendants(0).tolist() == graph.descendants(0).tolist()
+    assert loaded.created_at == graph.created_at
+    with mock.patch.object(ontology, 'FORMAT_VERSION', ontology.FORMAT_VERSION + 1):
+        with pytest.raises(ValueError):
+            EntityGraph.load(path)
+
+
+def test_build_graph():
+    client = mock.Mock()
+    client.lookup.side_effect = lambda entity_type, ids: dict(
+        (str(entity_id), REGIONS[str(entity_id)]) for entity_id in ids)
+    graph = ontology.build_graph(client, 'regions', [1215])
+    assert graph.ids.tolist() == [1215, 13100, 13101, 100000]
+    # Parents outside of the graph are known
+    assert graph.belongs_to(1215).tolist() == [0]
+    # One lookup per level of the graph
+    assert client.lookup.call_count == 3
+
+
+@mock.patch('requests.Session.get')
+def test_get_descendant_regions_uses_graph(mock_requests_get, graph):
+    assert lib.get_descendant_regions(MOCK_TOKEN, MOCK_HOST, 0, 4, include_details=False) == [
+        {'id': 13100}, {'id': 13101}]
+    assert not mock_requests_get.called
+
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.json.return_value = {'data': {'13100': REGIONS['13100'],
+                                                                 '13101': REGIONS['13101']}}
+    assert [region['name'] for region in lib.get_descendant_regions(
+        MOCK_TOKEN, MOCK_HOST, 1215, 4)] == ['Wisconsin', 'Wyoming']
+    # Only the details are requested
+    assert mock_requests_get.call_count == 1
+    assert mock_requests_get.call_args[0][0].endswith('/v2/regions')
+
+
+@mock.patch('requests.Session.get')
+def test_lookup_belongs_uses_graph(mock_requests_get, graph):
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.json.return_value = {'data': {'1215': REGIONS['1215']}}
+    assert [region['name'] for region in lib.lookup_belongs(
+        MOCK_TOKEN, MOCK_HOST, 'regions', 13100)] == ['United States']
+    assert mock_requests_get.call_args[1]['params'] == {'ids': [1215]}
@@ -0,0 +1,219 @@
+"""Compact data points, for callers that need points one by one but not a dict for each.
+
+A data point dict repeats the attributes of its series (metric_id, item_id, ..., and the
+deprecated input_unit_id and input_unit_scale) and has its own copies of the date strings.
+With format='compact', :meth:`~api.client.Client.get_data_points` returns :class:`DataPoint`
+objects instead. They hold the fields of the point in slots and share one
+:class:`SeriesAttributes` per series, and identical date strings are shared too::
+
+    points = client.get_data_points(metric_id=2540047, item_id=3457, region_id=[...],
+                                    frequency_id=1, source_id=26, format='compact')
+    points[0]['value']
+    points[0]['region_id']
+    dict(points[0])  # the same dict as with the default format
+
+Points are read-only mappings, except that their fields can be set like those of a dict.
+Setting a series attribute gives the point its own copy of them.
+
+DataPoint is registered as a Mapping rather than derived from it: on Python 2, the Mapping ABCs
+have no __slots__, and every point would get a __dict__ anyway.
+"""
+
+try:
+    # Python 3.3+
+    from collections.abc import Iterator, Mapping
+except ImportError:
+    from collections import Iterator, Mapping
+
+from api.client.columnar import is_included
+
+# Fields of points, in the order of the dicts returned by get_data_points()
+KEYS = ('start_date', 'end_date', 'value', 'unit_id', 'input_unit_id', 'input_unit_scale',
+        'reporting_date', 'metric_id', 'item_id', 'region_id', 'partner_region_id',
+        'frequency_id')
+
+POINT_KEYS = ('start_date', 'end_date', 'value', 'reporting_date')
+
+# Series attributes: key in points, key in the response, default
+SERIES_KEYS = (
+    ('unit_id', 'unitId', None),
+    ('metric_id', 'metricId', None),
+    ('item_id', 'itemId', None),
+    ('region_id', 'regionId', None),
+    ('partner_region_id', 'partnerRegionId', 0),
+    ('frequency_id', 'frequencyId', None),
+)
+
+
+class SeriesAttributes(object):
+    """The attributes of a series, shared by all its points."""
+
+    __slots__ = tuple(key for key, _, _ in SERIES_KEYS)
+
+    def __init__(self, unit_id=None, metric_id=None, item_id=None, region_id=None,
+                 partner_region_id=0, frequency_id=None):
+        self.unit_id = unit_id
+        self.metric_id = metric_id
+        self.item_id = item_id
+        self.region_id = region_id
+        self.partner_region_id = partner_region_id
+        self.frequency_id = frequency_id
+
+    @classmethod
+    def from_series(cls, series):
+        """Get the attributes of a series of a list_of_series response."""
+        return cls(*[series.get(response_key, default)
+                     for _, response_key, default in SERIES_KEYS])
+
+    def replace(self, **attributes):
+        """Get a copy with some attributes changed."""
+        copy = SeriesAttributes(*[getattr(self, key) for key, _, _ in SERIES_KEYS])
+        for key, value in attributes.items():
+            setattr(copy, key, value)
+        return copy
+
+    def __repr__(self):
+        return 'SeriesAttributes({})'.format(', '.join(
+            '{}={!r}'.format(key, getattr(self, key)) for key, _, _ in SERIES_KEYS))
+
+
+class DataPoint(object):
+    """A data point, with the same keys and values as the dicts returned by get_data_points().
+
+    >>> series = SeriesAttributes(unit_id=14, metric_id=1, item_id=2, region_id=3)
+    >>> point = DataPoint('2001-01-01', '2001-12-31', 123, None, series)
+    >>> point['value'], point['region_id'], point['input_unit_scale']
+    (123, 3, 1)
+    >>> point == {'start_date': '2001-01-01', 'end_date': '2001-12-31', 'value': 123,
+    ...           'unit_id': 14, 'input_unit_id': 14, 'input_unit_scale': 1,
+    ...           'reporting_date': None, 'metric_id': 1, 'item_id': 2, 'region_id': 3,
+    ...           'partner_region_id': 0, 'frequency_id': None}
+    True
+    >>> point['unit_id'] = 10
+    >>> point['unit_id'], series.unit_id
+    (10, 14)
+    >>> isinstance(point, Mapping), hasattr(point, '__dict__')
+    (True, False)
+
+    """
+
+    __slots__ = POINT_KEYS + ('series',)
+
+    def __init__(self, start_date, end_date, value, reporting_date, series):
+        self.start_date = start_date
+        self.end_date = end_date
+        self.value = value
+        self.reporting_date = reporting_date
+        self.series = series
+
+    def __getitem__(self, key):
+        if key in POINT_KEYS:
+            return getattr(self, key)
+        if key == 'input_unit_id':
+            # Deprecated, see list_of_series_to_single_series()
+            return self.series.unit_id
+        if key == 'input_unit_scale':
+            return 1
+        if key in SeriesAttributes.__slots__:
+            return getattr(self.series, key)
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in POINT_KEYS:
+            setattr(self, key, value)
+        elif key in SeriesAttributes.__slots__:
+            # The attributes are shared with the other points of the series
+            self.series = self.series.replace(**{key: value})
+        else:
+            raise KeyError(key)
+
+    def __iter__(self):
+        return iter(KEYS)
+
+    def __len__(self):
+        return len(KEYS)
+
+    def __contains__(self, key):
+        return key in KEYS
+
+    def get(self, key, default=None):
+        return self[key] if key in KEYS else default
+
+    def keys(self):
+        return list(KEYS)
+
+    def values(self):
+        return [self[key] for key in KEYS]
+
+    def items(self):
+        return [(key, self[key]) for key in KEYS]
+
+    def __eq__(self, other):
+        if not isinstance(other, Mapping):
+            return NotImplemented
+        return dict(self.items()) == dict(other.items())
+
+    def __ne__(self, other):
+        equal = self.__eq__(other)
+        return equal if equal is NotImplemented else not equal
+
+    __hash__ = None  # Mutable, like a dict
+
+    def __repr__(self):
+        return 'DataPoint({!r})'.format(dict(self))
+
+
+Mapping.register(DataPoint)
+
+
+def list_of_series_to_points(series_list, include_historical=True):
+    """Convert a list_of_series response into compact points.
+
+    >>> points = list_of_series_to_points([{
+    ...     'series': {'metricId': 1, 'itemId': 2, 'regionId': 3, 'unitId': 4},
+    ...     'data': [['2001-01-01T00:00:00.000Z', '2001-12-31T00:00:00.000Z', 123],
+    ...              ['2002-01-01T00:00:00.000Z', '2002-12-31T00:00:00.000Z', 456,
+    ...               '2003-01-15T00:00:00.000Z']]}])
+    >>> [(point['start_date'][:4], point['value'], point['reporting_date']) for point in points]
+    [('2001', 123, None), ('2002', 456, '2003-01-15T00:00:00.000Z')]
+    >>> points[0].series is points[1].series
+    True
+
+    Parameters
+    ----------
+    series_list : list or iterator of dicts
+        As decoded from a /v2/data response, or returned by
+        :func:`api.client.streaming.decode_json_stream`
+    include_historical : boolean, optional
+
+    Returns
+    -------
+    list of DataPoints
+        If `series_list` is not a list, e.g. an error body, it is returned as is.
+
+    """
+    if not isinstance(series_list, (list, Iterator)):
+        return series_list
+    # Daily and weekly series of many regions have the same dates: keep one copy of each
+    dates = {}
+    output = []
+    for series in series_list:
+        if not is_included(series, include_historical):
+            continue
+        attributes = SeriesAttributes.from_series(series.get('series', {}))
+        for point in series.get('data', []):
+            start_date = dates.setdefault(point[0], point[0])
+            end_date = dates.setdefault(point[1], point[1])
+            reporting_date = point[3] if len(point) > 3 else None
+            if reporting_date is not None:
+                reporting_date = dates.setdefault(reporting_date, reporting_date)
+            output.append(DataPoint(start_date, end_date, point[2], reporting_date, attributes))
+    return output
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python points.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
@@ -0,0 +1,60 @@
+import copy
+import json
+
+import mock
+import pandas
+
+from api.client.gro_client import GroClient
+from api.client.points import DataPoint, SeriesAttributes
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.points.token'
+
+LIST_OF_SERIES = [
+    {'series': {'metricId': 1, 'itemId': 2, 'regionId': region_id, 'frequencyId': 9,
+                'unitId': 10},
+     'data': [['2017-01-01T00:00:00.000Z', '2017-12-31T00:00:00.000Z', 1000],
+              ['2018-01-01T00:00:00.000Z', '2018-12-31T00:00:00.000Z', None,
+               '2019-01-15T00:00:00.000Z']]}
+    for region_id in [3, 4]
+]
+
+UNITS = {10: {'id': 10, 'baseConvFactor': {'factor': 1}},
+         14: {'id': 14, 'baseConvFactor': {'factor': 1000}}}
+
+
+@mock.patch('requests.Session.get')
+def test_same_as_records(mock_requests_get):
+    def get(url, params=None, **kwargs):
+        response = mock.Mock(status_code=200)
+        response.iter_content.return_value = [json.dumps(LIST_OF_SERIES).encode('utf-8')]
+        return response
+    mock_requests_get.side_effect = get
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    points = client.get_data_points(metric_id=1, item_id=2, region_id=[3, 4], format='compact')
+    records = client.get_data_points(metric_id=1, item_id=2, region_id=[3, 4])
+    assert points == records
+    assert [dict(point) for point in points] == records
+    assert pandas.DataFrame(points).equals(pandas.DataFrame(records))
+    # Shared within a series, and dates across series
+    assert points[0].series is points[1].series
+    assert points[0].series is not points[2].series
+    assert points[0]['start_date'] is points[2]['start_date']
+    assert not hasattr(points[0], '__dict__')
+
+    client.lookup = mock.Mock(side_effect=lambda entity_type, unit_id: UNITS[unit_id])
+    points = client.get_data_points(metric_id=1, item_id=2, region_id=[3, 4], unit_id=14,
+                                    format='compact')
+    assert [point['value'] for point in points] == [1, None, 1, None]
+    assert [point['unit_id'] for point in points] == [14] * 4
+    assert points[0].series is points[1].series
+    # Factors are looked up once per unit
+    assert client.lookup.call_count == 2
+
+
+def test_copies():
+    point = DataPoint('2017-01-01', '2017-12-31', 1, None, SeriesAttributes(unit_id=10))
+    copied = copy.deepcopy(point)
+    assert copied == point and copied is not point
+    copied['value'] = 2
+    assert point['value'] == 1
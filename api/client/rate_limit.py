@@ -0,0 +1,189 @@
+"""Process-wide rate limiting of requests made to the Gro API.
+
+Every request path (lib.get_data, BatchClient and AsyncGroClient) reserves a slot from a token
+bucket before each attempt and waits for the returned delay, with time.sleep, gen.sleep or
+asyncio.sleep respectively. Since the buckets are shared by the whole process, several clients or
+threads using the same access token are limited together.
+
+By default each access token gets a bucket refilled at cfg.MAX_QUERIES_PER_SECOND. Limits can be
+overridden per token and additional limits can be set on individual endpoints::
+
+    rate_limit.set_rate_limit(5)  # all tokens, all endpoints
+    rate_limit.set_rate_limit(2, endpoint='v2/data')  # additionally, at most 2 /v2/data per second
+    rate_limit.set_rate_limit(20, access_token=my_token)  # a token with a higher quota
+"""
+
+import threading
+
+try:
+    # Python 3
+    from time import monotonic
+    from urllib.parse import urlparse
+except ImportError:
+    # Python 2
+    from time import time as monotonic
+    from urlparse import urlparse
+
+from api.client import cfg
+
+
+class TokenBucket(object):
+    """A bucket holding up to `burst` tokens, refilled continuously at `rate` tokens per second.
+
+    Callers take a token with :meth:`~.reserve` and wait for the delay it returns. A caller is
+    allowed to take a token the bucket doesn't have yet, which puts the bucket in debt, so that
+    concurrent callers are spaced out at the configured rate in the order they arrived instead of
+    all retrying at once.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = float(rate)
+        self.burst = float(burst) if burst is not None else max(self.rate, 1.0)
+        self._tokens = self.burst
+        self._last_refill = monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last_refill) * self.rate)
+        self._last_refill = now
+
+    def reserve(self, tokens=1):
+        """Take tokens from the bucket.
+
+        Returns
+        -------
+        float
+            Number of seconds the caller must wait before making its request.
+
+        """
+        with self._lock:
+            self._refill()
+            self._tokens -= tokens
+            return max(0.0, -self._tokens / self.rate)
+
+    def wait_time(self, tokens=1):
+        """Number of seconds a request made now would have to wait, without taking any tokens."""
+        with self._lock:
+            self._refill()
+            return max(0.0, (tokens - self._tokens) / self.rate)
+
+
+class RateLimiter(object):
+    """Registry of token buckets keyed by access token and endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._limits = {}  # (access_token or None, endpoint or None) -> (rate, burst)
+        self._buckets = {}  # (access_token, endpoint or None) -> TokenBucket or None
+
+    def set_limit(self, rate, burst=None, endpoint=None, access_token=None):
+        with self._lock:
+            self._limits[(access_token, endpoint)] = (rate, burst)
+            # Recreate the affected buckets with the new limits on next use
+            for key in list(self._buckets):
+                if endpoint == key[1] and access_token in (None, key[0]):
+                    del self._buckets[key]
+
+    def _get_limit(self, access_token, endpoint):
+        for key in [(access_token, endpoint), (None, endpoint)]:
+            if key in self._limits:
+                return self._limits[key]
+        if endpoint is None:
+            return (cfg.MAX_QUERIES_PER_SECOND, None)
+        return (None, None)
+
+    def _get_buckets(self, access_token, endpoint):
+        buckets = []
+        keys = [(access_token, None)] + ([(access_token, endpoint)] if endpoint else [])
+        with self._lock:
+            for key in keys:
+                if key not in self._buckets:
+                    rate, burst = self._get_limit(*key)
+                    self._buckets[key] = TokenBucket(rate, burst) if rate else None
+                if self._buckets[key] is not None:
+                    buckets.append(self._buckets[key])
+        return buckets
+
+    def reserve(self, access_token, endpoint):
+        return max([bucket.reserve() for bucket in self._get_buckets(access_token, endpoint)]
+                   or [0.0])
+
+    def wait_time(self, access_token, endpoint=None):
+        return max([bucket.wait_time() for bucket in self._get_buckets(access_token, endpoint)]
+                   or [0.0])
+
+
+_limiter = RateLimiter()
+
+
+def get_endpoint(url):
+    """Get the endpoint that a request url is rate limited under.
+
+    >>> get_endpoint('https://api.gro-intelligence.com/v2/geocentres?regionIds=1215')
+    'v2/geocentres'
+
+    """
+    return urlparse(url).path.strip('/')
+
+
+def get_access_token(headers):
+    """Extract the access token from request headers.
+
+    >>> get_access_token({'authorization': 'Bearer abc123'})
+    'abc123'
+
+    """
+    authorization = headers.get('authorization') or ''
+    return authorization[len('Bearer '):] if authorization.startswith('Bearer ') else None
+
+
+def set_rate_limit(rate, burst=None, endpoint=None, access_token=None):
+    """Set the maximum request rate.
+
+    Parameters
+    ----------
+    rate : float or None
+        Requests per second. None removes the limit.
+    burst : integer, optional
+        Number of requests that can be made at once after a quiet period. Defaults to one
+        second's worth of requests.
+    endpoint : string, optional
+        e.g. 'v2/data'. If given, the limit applies to that endpoint in addition to the overall
+        limit of the access token.
+    access_token : string, optional
+        If given, the limit applies only to requests made with this token.
+
+    """
+    _limiter.set_limit(rate, burst, endpoint.strip('/') if endpoint else None, access_token)
+
+
+def reserve(url, headers):
+    """Reserve a slot for a request and return how many seconds to wait before making it."""
+    return _limiter.reserve(get_access_token(headers), get_endpoint(url))
+
+
+def get_wait_time(access_token, endpoint=None):
+    """Get how long a request made now would be delayed by the rate limiter.
+
+    Parameters
+    ----------
+    access_token : string
+    endpoint : string, optional
+        If not given, only the overall limit of the token is considered.
+
+    Returns
+    -------
+    float
+        Seconds
+
+    """
+    return _limiter.wait_time(access_token, endpoint.strip('/') if endpoint else None)
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python rate_limit.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
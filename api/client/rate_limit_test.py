@@ -0,0 +1,79 @@
+import mock
+import pytest
+
+from api.client import lib, rate_limit
+from api.client.deadline import deadline
+from api.client.rate_limit import RateLimiter, TokenBucket
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.token'
+
+
+def test_token_bucket():
+    bucket = TokenBucket(rate=10, burst=2)
+    with mock.patch('api.client.rate_limit.monotonic', return_value=bucket._last_refill):
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert bucket.wait_time() == 0.1
+        # Requests beyond the burst are spaced out at the configured rate
+        assert bucket.reserve() == 0.1
+        assert bucket.reserve() == 0.2
+        assert bucket.wait_time() == 0.3
+    with mock.patch('api.client.rate_limit.monotonic', return_value=bucket._last_refill + 1):
+        # Refills up to the burst size only
+        assert bucket.wait_time() == 0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0
+        assert bucket.reserve() == 0.1
+
+
+def test_limits_per_token_and_endpoint():
+    limiter = RateLimiter()
+    limiter.set_limit(1000)
+    limiter.set_limit(1, endpoint='v2/data')
+    limiter.set_limit(None, access_token='unlimited')
+
+    assert limiter.reserve('token1', 'v2/data') == 0
+    assert limiter.reserve('token1', 'v2/data') > 0.9
+    assert limiter.wait_time('token1', 'v2/data') > 1.9
+    # Other endpoints and tokens are not affected
+    assert limiter.reserve('token1', 'v2/items') == 0
+    assert limiter.reserve('token2', 'v2/data') == 0
+    # The token has no overall limit but the endpoint limit still applies
+    assert limiter.reserve('unlimited', 'v2/items') == 0
+    assert limiter.reserve('unlimited', 'v2/data') == 0
+    assert limiter.reserve('unlimited', 'v2/data') > 0.9
+
+
+@mock.patch('requests.Session.get')
+@mock.patch('time.sleep')
+def test_get_data_is_rate_limited(sleep_mocked, mock_requests_get):
+    mock_requests_get.return_value.status_code = 200
+    rate_limit.set_rate_limit(1, burst=1, access_token='rate.limited.token')
+    url = 'https://{}/v2/items'.format(MOCK_HOST)
+    headers = {'authorization': 'Bearer rate.limited.token'}
+    lib.get_data(url, headers)
+    assert not sleep_mocked.called
+    lib.get_data(url, headers)
+    assert sleep_mocked.call_args[0][0] > 0.9
+    rate_limit.set_rate_limit(None, access_token='rate.limited.token')
+
+
+@mock.patch('requests.Session.get')
+@mock.patch('time.sleep')
+def test_failing_fast_takes_no_token(sleep_mocked, mock_requests_get):
+    mock_requests_get.return_value.status_code = 200
+    rate_limit.set_rate_limit(1, burst=1, access_token='fail.fast.token')
+    url = 'https://{}/v2/items'.format(MOCK_HOST)
+    headers = {'authorization': 'Bearer fail.fast.token'}
+    with pytest.raises(lib.DeadlineExceeded):
+        with deadline(0):
+            lib.get_data(url, headers)
+    # Open
+    with mock.patch('api.client.circuit_breaker.CircuitBreaker.retry_after', return_value=30):
+        with pytest.raises(lib.CircuitOpenError):
+            lib.get_data(url, headers)
+    # The token of the burst is still there
+    lib.get_data(url, headers)
+    assert not sleep_mocked.called
+    rate_limit.set_rate_limit(None, access_token='fail.fast.token')
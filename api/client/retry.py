@@ -0,0 +1,179 @@
+"""Retry policy shared by all request paths: lib, BatchClient and AsyncGroClient.
+
+:func:`~get_response_action` decides what to do with the response to an attempt, so that the
+request paths handle status codes the same way.
+
+Delays use "full jitter" exponential backoff: a delay drawn uniformly between 0 and an
+exponentially growing cap, so that many workers failing at the same time don't all retry at the
+same time. If the API sends a Retry-After header, the delay is at least that long, up to
+cfg.MAX_BACKOFF.
+"""
+
+from email.utils import mktime_tz, parsedate_tz
+import random
+import threading
+import time
+
+from api.client import cfg
+
+# What to do with the response to an attempt, see get_response_action()
+SUCCESS = 'success'  # Including 304 Not Modified, answering a conditional request
+WARNING = 'warning'  # Success with a caveat, logged as a warning
+REDIRECT = 'redirect'  # Retry with the migrated ids given in the body
+FAIL = 'fail'  # Give up without retrying
+RETRY = 'retry'  # Retry after a backoff delay
+
+WARNING_MESSAGES = {204: 'No Content', 206: 'Partial Content'}
+NO_RETRY_STATUS_CODES = (400, 401, 402, 404)
+
+
+def get_response_action(status_code):
+    """Decide what to do with the response to an attempt.
+
+    >>> get_response_action(200)
+    'success'
+    >>> get_response_action(304)
+    'success'
+    >>> get_response_action(204)
+    'warning'
+    >>> get_response_action(404)
+    'fail'
+    >>> get_response_action(503)
+    'retry'
+    >>> get_response_action(None)  # Connection error, timeout, etc.
+    'retry'
+
+    Parameters
+    ----------
+    status_code : integer or None
+        None if no response was received
+
+    Returns
+    -------
+    string
+        One of SUCCESS, WARNING, REDIRECT, FAIL or RETRY
+
+    """
+    if status_code in (200, 304):
+        return SUCCESS
+    if status_code in WARNING_MESSAGES:
+        return WARNING
+    if status_code == 301:
+        return REDIRECT
+    if status_code in NO_RETRY_STATUS_CODES:
+        return FAIL
+    return RETRY
+
+
+def parse_retry_after(value):
+    """Convert the value of a Retry-After header to a number of seconds.
+
+    >>> parse_retry_after('120')
+    120.0
+    >>> parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0
+    True
+    >>> parse_retry_after('soon') is None
+    True
+
+    Parameters
+    ----------
+    value : string
+        Either a number of seconds or an HTTP date
+
+    Returns
+    -------
+    float or None
+
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    parsed_date = parsedate_tz(value)
+    if parsed_date is None:
+        return None
+    return max(0.0, mktime_tz(parsed_date) - time.time())
+
+
+def get_retry_after(response):
+    """Get the Retry-After delay requested by a response, if any.
+
+    Parameters
+    ----------
+    response : requests.Response or tornado.httpclient.HTTPResponse or Exception
+
+    Returns
+    -------
+    float or None
+
+    """
+    headers = getattr(response, 'headers', None)
+    if headers is None:
+        return None
+    return parse_retry_after(headers.get('Retry-After'))
+
+
+def get_backoff_delay(retry_count, response=None):
+    """Get how long to wait before making retry number `retry_count + 1` of a request.
+
+    The first retry is immediate unless the API asked to wait with a Retry-After header. The
+    delay never exceeds cfg.MAX_BACKOFF, whatever the Retry-After header asks for.
+
+    Parameters
+    ----------
+    retry_count : integer
+        Number of retries already made
+    response : optional
+        The failed response
+
+    Returns
+    -------
+    float
+        Seconds
+
+    """
+    delay = 0.0
+    if retry_count > 0:
+        delay = random.uniform(0, min(cfg.MAX_BACKOFF, cfg.BACKOFF_BASE * 2 ** retry_count))
+    retry_after = get_retry_after(response)
+    if retry_after is not None:
+        delay = max(delay, min(retry_after, cfg.MAX_BACKOFF))
+    return delay
+
+
+class RetryBudget(object):
+    """A number of retries shared by a batch of requests.
+
+    When many requests of a batch fail, for example because the API is overloaded, retrying all
+    of them makes things worse. Once the budget is spent, failed requests are given up on
+    immediately.
+    """
+
+    def __init__(self, retries):
+        self.remaining = retries
+        self._lock = threading.Lock()
+
+    def spend(self):
+        """Take one retry from the budget.
+
+        Returns
+        -------
+        boolean
+            False if the budget is exhausted and the request should not be retried.
+
+        """
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python retry.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
@@ -0,0 +1,87 @@
+import mock
+import pytest
+from tornado import gen
+from tornado.httpclient import HTTPError, HTTPResponse, HTTPRequest
+from tornado.httputil import HTTPHeaders
+from tornado.ioloop import IOLoop
+
+from api.client import cfg, lib
+from api.client.batch_client import BatchClient, BatchError
+from api.client.retry import RetryBudget, get_backoff_delay
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.token'
+
+
+def test_get_backoff_delay():
+    assert get_backoff_delay(0) == 0
+    for retry_count in range(1, 10):
+        delay = get_backoff_delay(retry_count)
+        assert 0 <= delay <= min(cfg.MAX_BACKOFF, cfg.BACKOFF_BASE * 2 ** retry_count)
+
+
+def test_get_backoff_delay_retry_after():
+    response = mock.Mock(headers={'Retry-After': '7'})
+    assert get_backoff_delay(0, response) == 7
+    assert get_backoff_delay(1, response) == 7
+
+
+def test_get_backoff_delay_huge_retry_after():
+    response = mock.Mock(headers={'Retry-After': '86400'})
+    assert get_backoff_delay(0, response) == cfg.MAX_BACKOFF
+    assert get_backoff_delay(5, response) == cfg.MAX_BACKOFF
+
+
+def test_retry_budget():
+    budget = RetryBudget(2)
+    assert budget.spend()
+    assert budget.spend()
+    assert not budget.spend()
+
+
+@mock.patch('requests.Session.get')
+@mock.patch('time.sleep')
+def test_get_data_retry_after(sleep_mocked, mock_requests_get):
+    failure = mock.Mock(status_code=429, headers={'Retry-After': '3'})
+    success = mock.Mock(status_code=200)
+    mock_requests_get.side_effect = [failure, success]
+    assert lib.get_data('https://{}/v2/items'.format(MOCK_HOST),
+                        {'authorization': 'Bearer retry.token'}) is success
+    sleep_mocked.assert_called_once_with(3.0)
+
+
+def mock_http_error(code, headers=None):
+    request = HTTPRequest('https://{}/v2/data'.format(MOCK_HOST))
+    return HTTPError(code, response=HTTPResponse(request, code, headers=HTTPHeaders(headers or {})))
+
+
+@mock.patch.object(cfg, 'BACKOFF_BASE', 0.001)
+@mock.patch('time.sleep')
+def test_batch_backoff_does_not_block(sleep_mocked):
+    client = BatchClient(MOCK_HOST, MOCK_TOKEN)
+    client._http_client = mock.Mock()
+    client._http_client.fetch.side_effect = mock_http_error(503, {'Retry-After': '0.01'})
+
+    @gen.coroutine
+    def get_data():
+        yield client.get_data('https://{}/v2/data'.format(MOCK_HOST),
+                              {'authorization': 'Bearer ' + MOCK_TOKEN}, {'metricId': 1})
+
+    with pytest.raises(BatchError):
+        IOLoop.current().run_sync(get_data)
+    assert not sleep_mocked.called
+    # The same number of attempts as lib.get_data
+    assert client._http_client.fetch.call_count == cfg.MAX_RETRIES + 1
+
+
+@mock.patch.object(cfg, 'BACKOFF_BASE', 0.001)
+def test_batch_retry_budget():
+    client = BatchClient(MOCK_HOST, MOCK_TOKEN)
+    client._http_client = mock.Mock()
+    client._http_client.fetch.side_effect = mock_http_error(503)
+    # Keep the circuit breaker from opening, see circuit_breaker_test.py
+    with mock.patch.multiple(cfg, BATCH_RETRY_BUDGET=0, CIRCUIT_MIN_REQUESTS=100):
+        results = client.batch_async_get_data_points([{'metric_id': i} for i in range(10)])
+    assert all(isinstance(result, BatchError) for result in results)
+    # One attempt per request plus the cfg.MAX_RETRIES retries allowed for the whole batch
+    assert client._http_client.fetch.call_count == 10 + cfg.MAX_RETRIES
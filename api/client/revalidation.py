@@ -0,0 +1,214 @@
+"""Conditional requests, to avoid downloading responses that haven't changed.
+
+:class:`RevalidationCache` is a middleware (see :mod:`api.client.context`) keeping the body of
+every response that came with an ETag or Last-Modified header. When the same request is made again,
+it is sent with If-None-Match/If-Modified-Since. If the response hasn't changed, the API answers
+304 Not Modified without a body, and the kept body is returned instead::
+
+    from api.client.revalidation import RevalidationCache
+    client.add_middleware(RevalidationCache())
+
+    # Also keep the bodies on disk, for new processes to revalidate rather than download them
+    client.add_middleware(RevalidationCache(disk_cache=disk_cache.enable_disk_cache()))
+
+Unchanged responses then cost a round trip, but not their download. In offline mode (see
+:mod:`api.client.offline`), kept bodies are returned without revalidating them.
+"""
+
+import logging
+import sqlite3
+import threading
+import zlib
+
+from requests import Response
+from requests.structures import CaseInsensitiveDict
+
+from api.client import cfg, json_backend, offline
+from api.client.disk_cache import make_key
+from api.client.memory_cache import LRUCache
+from api.client.singleflight import canonical_params
+
+_logger = logging.getLogger(__name__)
+
+
+def get_validators(response):
+    """Get the validators of a response, if it has any.
+
+    Parameters
+    ----------
+    response : requests.Response
+
+    Returns
+    -------
+    dict
+        'etag' and/or 'last_modified', empty if the response has neither
+
+    """
+    headers = getattr(response, 'headers', None) or {}
+    validators = {}
+    if headers.get('ETag'):
+        validators['etag'] = headers['ETag']
+    if headers.get('Last-Modified'):
+        validators['last_modified'] = headers['Last-Modified']
+    return validators
+
+
+def make_response(request, entry):
+    """Build the response to return for a kept body.
+
+    Parameters
+    ----------
+    request : api.client.context.Request
+    entry : dict
+        As kept by :class:`RevalidationCache`
+
+    Returns
+    -------
+    requests.Response
+
+    """
+    response = Response()
+    response.status_code = 200
+    response.url = request.url
+    response.encoding = 'utf-8'
+    response.headers = CaseInsensitiveDict({'Content-Type': entry['content_type']})
+    if 'etag' in entry:
+        response.headers['ETag'] = entry['etag']
+    if 'last_modified' in entry:
+        response.headers['Last-Modified'] = entry['last_modified']
+    # Already read, so that iter_content() of a streamed request iterates over it
+    response._content = entry['body'].encode('utf-8')
+    response._content_consumed = True
+    return json_backend.decode_response_json(response)
+
+
+class RevalidationCache(object):
+    """Middleware making conditional requests for responses it has seen before.
+
+    Parameters
+    ----------
+    maxsize : integer, optional
+        Maximum number of responses kept in memory. Defaults to cfg.MEMORY_CACHE_MAXSIZE.
+    max_bytes : integer, optional
+        Maximum size of the responses kept in memory. Defaults to cfg.REVALIDATION_MAX_BYTES.
+    disk_cache : api.client.disk_cache.DiskCache, optional
+        If given, responses are kept there too, for cfg.REVALIDATION_TTL seconds.
+
+    """
+
+    def __init__(self, maxsize=None, max_bytes=None, disk_cache=None):
+        self._entries = LRUCache(maxsize or cfg.MEMORY_CACHE_MAXSIZE,
+                                 max_bytes or cfg.REVALIDATION_MAX_BYTES)
+        self._disk_cache = disk_cache
+        self._lock = threading.Lock()
+        self._not_modified = self._modified = 0
+
+    def _get(self, key):
+        entry = self._entries.get(key)
+        if entry is None and self._disk_cache is not None:
+            try:
+                entry = self._disk_cache.get(key)
+            except (sqlite3.Error, zlib.error, ValueError) as e:
+                _logger.warning('Disk cache read failed: {}'.format(e))
+            if entry is not None:
+                self._entries.set(key, entry)
+        return entry
+
+    def _set(self, key, entry):
+        self._entries.set(key, entry)
+        if self._disk_cache is not None:
+            try:
+                self._disk_cache.set(key, entry, cfg.REVALIDATION_TTL)
+            except sqlite3.Error as e:
+                _logger.warning('Disk cache write failed: {}'.format(e))
+
+    def __call__(self, request, next_handler):
+        # Only a hash of the access token is part of the key, see disk_cache.make_key()
+        key = make_key('revalidation', request.url, request.headers.get('authorization', ''),
+                       canonical_params(request.params))
+        entry = self._get(key)
+        if entry is not None and offline.is_offline():
+            # Can't be revalidated, the kept body is the best there is
+            return make_response(request, entry)
+        if entry is not None:
+            if 'etag' in entry:
+                request.headers['If-None-Match'] = entry['etag']
+            if 'last_modified' in entry:
+                request.headers['If-Modified-Since'] = entry['last_modified']
+        response = next_handler(request)
+        status_code = getattr(response, 'status_code', None)
+        if status_code == 304 and entry is not None:
+            response.close()
+            with self._lock:
+                self._not_modified += 1
+            return make_response(request, entry)
+        if status_code == 304:
+            # Validated against headers set by someone else, e.g. the caller, and there is no
+            # body to answer with: ask for it
+            response.close()
+            request.headers.pop('If-None-Match', None)
+            request.headers.pop('If-Modified-Since', None)
+            response = next_handler(request)
+            status_code = getattr(response, 'status_code', None)
+        if status_code != 200:
+            return response
+        validators = get_validators(response)
+        if not validators:
+            return response
+        if request.stream:
+            # Kept as it is read, so that it is still decoded as it is downloaded
+            return self._tee(key, validators, response)
+        self._keep(key, validators, response, response.content)
+        return response
+
+    def _keep(self, key, validators, response, content):
+        try:
+            body = content.decode('utf-8')
+        except UnicodeDecodeError:
+            return
+        with self._lock:
+            self._modified += 1
+        validators['body'] = body
+        validators['content_type'] = response.headers.get('Content-Type', 'application/json')
+        self._set(key, validators)
+
+    def _tee(self, key, validators, response):
+        """Keep the body of a streamed response once it has all been read with iter_content().
+
+        Bodies larger than the memory cache are not kept, nor read into memory.
+        """
+        iter_content = response.iter_content
+        max_bytes = self._entries.max_bytes
+
+        def tee(*args, **kwargs):
+            chunks = []
+            size = 0
+            for chunk in iter_content(*args, **kwargs):
+                if chunks is not None:
+                    size += len(chunk)
+                    if size > max_bytes or not isinstance(chunk, bytes):
+                        chunks = None
+                    else:
+                        chunks.append(chunk)
+                yield chunk
+            if chunks is not None:
+                self._keep(key, validators, response, b''.join(chunks))
+
+        response.iter_content = tee
+        return response
+
+    def clear(self):
+        self._entries.clear()
+
+    def get_stats(self):
+        """Get the number of responses that were not modified, and of those that were.
+
+        Returns
+        -------
+        dict
+
+        """
+        with self._lock:
+            stats = {'not_modified': self._not_modified, 'modified': self._modified}
+        stats.update(('memory_' + key, value) for key, value in self._entries.get_stats().items())
+        return stats
@@ -0,0 +1,126 @@
+import io
+import json
+import os
+
+import mock
+import requests
+
+from api.client import disk_cache
+from api.client.context import Request
+from api.client.gro_client import GroClient
+from api.client.revalidation import RevalidationCache
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.revalidation.token'
+
+
+class MockServer(object):
+    """Answers requests with the current version of a body, and conditional requests with 304."""
+
+    def __init__(self, body, etag=None, last_modified=None):
+        self.body = body
+        self.etag = etag
+        self.last_modified = last_modified
+        self.requests = []
+
+    def get(self, url, params=None, headers=None, **kwargs):
+        self.requests.append(dict(headers))
+        response = requests.Response()
+        if ((self.etag and headers.get('If-None-Match') == self.etag) or
+                (self.last_modified and headers.get('If-Modified-Since') == self.last_modified)):
+            response.status_code = 304
+            response.raw = io.BytesIO(b'')
+            return response
+        response.status_code = 200
+        response.raw = io.BytesIO(json.dumps(self.body).encode('utf-8'))
+        if self.etag:
+            response.headers['ETag'] = self.etag
+        if self.last_modified:
+            response.headers['Last-Modified'] = self.last_modified
+        return response
+
+
+def test_etag():
+    server = MockServer({'data': [{'metric_id': 1}]}, etag='"v1"')
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    cache = RevalidationCache()
+    client.add_middleware(cache)
+    with mock.patch('requests.Session.get', side_effect=server.get):
+        assert client.get_data_series(metric_id=1) == [{'metric_id': 1}]
+        assert client.get_data_series(metric_id=1) == [{'metric_id': 1}]
+        assert server.requests[1]['If-None-Match'] == '"v1"'
+        assert cache.get_stats()['not_modified'] == 1
+
+        # Changed: downloaded again
+        server.body, server.etag = {'data': [{'metric_id': 2}]}, '"v2"'
+        assert client.get_data_series(metric_id=1) == [{'metric_id': 2}]
+        assert cache.get_stats()['modified'] == 2
+
+
+def test_last_modified_streamed_data_points():
+    server = MockServer([{'series': {'metricId': 1, 'unitId': 1},
+                          'data': [['2000-01-01', '2000-12-31', 1]]}],
+                        last_modified='Wed, 21 Oct 2015 07:28:00 GMT')
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    client.add_middleware(RevalidationCache())
+    with mock.patch('requests.Session.get', side_effect=server.get):
+        points = client.get_data_points(metric_id=1)
+        assert client.get_data_points(metric_id=1) == points
+    assert points[0]['value'] == 1
+    assert server.requests[1]['If-Modified-Since'] == 'Wed, 21 Oct 2015 07:28:00 GMT'
+
+
+def test_streamed_body_is_not_read_up_front():
+    server = MockServer([{'series': {'metricId': 1}, 'data': []}] * 100, etag='"v1"')
+    cache = RevalidationCache()
+    request = Request('https://{}/v2/data'.format(MOCK_HOST), {}, {'metricId': 1}, stream=True)
+    response = cache(request, lambda request: server.get(request.url, request.params,
+                                                         request.headers))
+    chunks = response.iter_content(chunk_size=100)
+    next(chunks)
+    assert response.raw.tell() < len(json.dumps(server.body))
+    assert cache.get_stats()['modified'] == 0
+    list(chunks)
+    # Kept once read
+    assert cache.get_stats()['modified'] == 1
+    response = cache(request, lambda request: server.get(request.url, request.params,
+                                                         request.headers))
+    assert json.loads(b''.join(response.iter_content(chunk_size=100))) == server.body
+    assert cache.get_stats()['not_modified'] == 1
+
+
+def test_not_modified_without_kept_body():
+    server = MockServer({'data': [{'metric_id': 1}]}, etag='"v1"')
+    cache = RevalidationCache()
+    request = Request('https://{}/v2/data_series/list'.format(MOCK_HOST),
+                      {'If-None-Match': '"v1"'}, {'metricId': 1})
+    response = cache(request, lambda request: server.get(request.url, request.params,
+                                                         request.headers))
+    # Requested again without the validator, rather than returning an empty 304
+    assert response.status_code == 200
+    assert response.json() == server.body
+    assert len(server.requests) == 2
+    assert 'If-None-Match' not in server.requests[1]
+    assert cache.get_stats()['modified'] == 1
+
+
+def test_no_validators():
+    server = MockServer({'data': []})
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    client.add_middleware(RevalidationCache())
+    with mock.patch('requests.Session.get', side_effect=server.get):
+        client.get_data_series(metric_id=1)
+        client.get_data_series(metric_id=1)
+    assert 'If-None-Match' not in server.requests[1]
+
+
+def test_kept_on_disk(tmpdir):
+    server = MockServer({'data': [{'metric_id': 1}]}, etag='"v1"')
+    cache = disk_cache.DiskCache(os.path.join(str(tmpdir), 'cache.sqlite'))
+    with mock.patch('requests.Session.get', side_effect=server.get):
+        for _ in range(2):
+            # e.g. two processes
+            client = GroClient(MOCK_HOST, MOCK_TOKEN)
+            client.add_middleware(RevalidationCache(disk_cache=cache))
+            assert client.get_data_series(metric_id=1) == [{'metric_id': 1}]
+    assert server.requests[1]['If-None-Match'] == '"v1"'
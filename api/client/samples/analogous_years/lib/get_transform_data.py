@@ -8,6 +8,8 @@ from dateutil.parser import parse
 from dateutil.relativedelta import relativedelta
 import pandas as pd
 
+from api.client.dates import parse_dates
+
 
 def get_data(client, metric_id, item_id, region_id, source_id, frequency_id, start_date):
     """
@@ -28,7 +30,8 @@ def get_data(client, metric_id, item_id, region_id, source_id, frequency_id, sta
                    'start_date': start_date}
     client.add_single_data_series(data_series)
     data = client.get_df()
-    start_date = pd.to_datetime(start_date)
+    # In UTC, like the dates of get_df(), whether given as 'YYYY-MM-DD' or as returned by the API
+    start_date = parse_dates([start_date], utc=True)[0]
     # TODO: Do not drop the series start_date column, use that to build an interpolation function
     #  for non daily frequency values
     data = data.loc[data.end_date >= start_date][['end_date', 'value']]
@@ -11,11 +11,12 @@ if the transformed dataframe has different columns as the original one.
 Eventually these could be incorporated into the API to reduce client side complexity for customers.
 """
 
-import dateparser
 import numpy as np
 from sklearn.base import TransformerMixin
 from scipy.fftpack import fft
-from datetime import datetime, timedelta
+from datetime import timedelta
+
+from api.client.dates import parse_dates
 
 class Transformer(TransformerMixin):
     """
@@ -87,12 +88,12 @@ def _fill_in_blank_days(num_of_points, start_datetime, pulled_dataset):
 
     ptr_idx_incomplete_list = 0
 
-    their_start_date = dateparser.parse(pulled_dataset[0]["start_date"])
+    their_start_date = parse_dates([pulled_dataset[0]["start_date"]]).astype('datetime64[D]')[0]
 
     date_delta = 0
 
-    if their_start_date.date() < start_datetime.date():
-        date_delta = (start_datetime.date() - their_start_date.date()).days
+    if their_start_date < np.datetime64(start_datetime.date()):
+        date_delta = int((np.datetime64(start_datetime.date()) - their_start_date) / np.timedelta64(1, 'D'))
 
     ptr_idx_incomplete_list += date_delta
 
@@ -112,17 +113,13 @@ def _fill_in_blank_days(num_of_points, start_datetime, pulled_dataset):
 def _impute(num_of_points, period_length_days, start_datetime, pulled_dataset):
     x_output = np.arange(0, period_length_days * num_of_points, period_length_days)
 
-    x_input = []
-    y_input = []
-
-    num_of_valid_points_pulled_dataset = 0
+    values = np.array([datapoint["value"] for datapoint in pulled_dataset], dtype=float)
+    valid = ~np.isnan(values)
+    start_dates = parse_dates([datapoint["start_date"] for datapoint in pulled_dataset])[valid]
+    x_input = (start_dates.astype('datetime64[D]') - np.datetime64(start_datetime.date())) / np.timedelta64(1, 'D')
+    y_input = values[valid]
 
-    for datapoint in pulled_dataset:
-        if datapoint["value"] is not None:
-            delta = (datetime.strptime(datapoint["start_date"][0:10], "%Y-%m-%d").date() - start_datetime.date()).days
-            x_input.append(delta)
-            y_input.append(datapoint["value"])
-            num_of_valid_points_pulled_dataset += 1
+    num_of_valid_points_pulled_dataset = len(y_input)
 
     # num data points to interpolate
     if len(x_input) == 0:
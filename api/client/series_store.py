@@ -0,0 +1,303 @@
+"""Local copies of data series, refreshed by downloading only what changed.
+
+Data series such as daily weather or prices go back decades, but from one day to the next only
+their last few points change. With the series store enabled, the list_of_series response of every
+:func:`api.client.lib.get_data_points` selection, and of the get_data_points requests of
+BatchClient and AsyncGroClient, is kept in a SQLite database. The next time the
+same selection is requested, only the points ending on or after the last stored end date are
+requested, and merged into the stored copy::
+
+    from api.client import series_store
+    series_store.enable_series_store()  # ~/.cache/gro/series.sqlite by default
+    client.get_df()  # full download the first time, only new points afterwards
+
+Points of earlier periods can be revised too. To pick those up, a full download is made again once
+a stored copy is older than cfg.SERIES_STORE_FULL_REFRESH_INTERVAL. Selections with at_time are
+not stored, since they are not expected to change.
+"""
+
+from collections import OrderedDict
+import os
+import threading
+
+from api.client import cfg, offline
+from api.client.disk_cache import DiskCache, make_key
+from api.client.singleflight import canonical_params
+
+# Fields of the 'series' attributes of a list_of_series element that identify the series
+SERIES_KEY_FIELDS = ('metricId', 'itemId', 'regionId', 'partnerRegionId', 'frequencyId',
+                     'sourceId', 'unitId')
+
+
+def get_default_path():
+    """Get the default location of the series database, in the user's cache directory."""
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'),
+                                                                   '.cache')
+    return os.path.join(cache_home, 'gro', 'series.sqlite')
+
+
+def get_series_key(series):
+    """Identify an element of a list_of_series response.
+
+    >>> get_series_key({'series': {'metricId': 1, 'regionId': 2, 'metadata': {}}, 'data': []})
+    (1, None, 2, None, None, None, None)
+
+    """
+    attributes = series.get('series', {})
+    return tuple(attributes.get(field) for field in SERIES_KEY_FIELDS)
+
+
+def get_window_start(series_list):
+    """Get the date from which a stored list_of_series response needs to be requested again.
+
+    That is the last end date of the series that ends first, so that no series misses any points.
+    The points ending on that date are requested again too, since the latest period of a series
+    is often updated.
+
+    >>> get_window_start([
+    ...     {'series': {'regionId': 1}, 'data': [['2019-01-01T00:00:00.000Z',
+    ...                                           '2019-01-01T00:00:00.000Z', 1]]},
+    ...     {'series': {'regionId': 2}, 'data': [['2019-01-02T00:00:00.000Z',
+    ...                                           '2019-01-02T00:00:00.000Z', 2]]}])
+    '2019-01-01'
+    >>> get_window_start([{'series': {'regionId': 1}, 'data': []}]) is None
+    True
+
+    Parameters
+    ----------
+    series_list : list of dicts
+        In the list_of_series format
+
+    Returns
+    -------
+    string or None
+        YYYY-MM-DD, or None if some series have no points and everything must be requested
+
+    """
+    window_start = None
+    for series in series_list:
+        end_dates = [point[1][:10] for point in series.get('data') or [] if point[1]]
+        if not end_dates:
+            return None
+        if window_start is None or max(end_dates) < window_start:
+            window_start = max(end_dates)
+    return window_start
+
+
+def merge_list_of_series(stored, update, window_start):
+    """Merge the response to a request starting at `window_start` into a stored response.
+
+    The points of the stored series ending on or after `window_start` are replaced by those of
+    the update. New series are added.
+
+    >>> merge_list_of_series(
+    ...     [{'series': {'regionId': 1}, 'data': [['2019-01-01', '2019-01-01', 1],
+    ...                                           ['2019-01-02', '2019-01-02', 2]]}],
+    ...     [{'series': {'regionId': 1}, 'data': [['2019-01-02', '2019-01-02', 2.5],
+    ...                                           ['2019-01-03', '2019-01-03', 3]]}],
+    ...     '2019-01-02')
+    [{'series': {'regionId': 1}, 'data': [['2019-01-01', '2019-01-01', 1], \
+['2019-01-02', '2019-01-02', 2.5], ['2019-01-03', '2019-01-03', 3]]}]
+
+    Parameters
+    ----------
+    stored : list of dicts
+    update : list of dicts
+    window_start : string
+        YYYY-MM-DD
+
+    Returns
+    -------
+    list of dicts
+
+    """
+    merged = OrderedDict()
+    for series in stored:
+        merged[get_series_key(series)] = dict(series, data=[
+            point for point in series.get('data') or [] if (point[1] or '')[:10] < window_start])
+    for series in update:
+        key = get_series_key(series)
+        kept = merged[key]['data'] if key in merged else []
+        # The attributes of the update, e.g. its metadata, are the most recent
+        merged[key] = dict(series, data=kept + list(series.get('data') or []))
+    return list(merged.values())
+
+
+class SeriesStore(object):
+    """Stored list_of_series responses, by API host, access token and request parameters.
+
+    Parameters
+    ----------
+    path : string
+        Location of the database file. Created if it doesn't exist.
+    max_size : integer, optional
+        Maximum total size of the stored responses in bytes, compressed. Defaults to
+        cfg.SERIES_STORE_MAX_SIZE.
+    full_refresh_interval : float, optional
+        Seconds after which a full download is made again. Defaults to
+        cfg.SERIES_STORE_FULL_REFRESH_INTERVAL.
+
+    """
+
+    def __init__(self, path, max_size=None, full_refresh_interval=None):
+        # Stored copies expire when their next full download is due
+        self._cache = DiskCache(path, max_size or cfg.SERIES_STORE_MAX_SIZE)
+        self.full_refresh_interval = (full_refresh_interval or
+                                      cfg.SERIES_STORE_FULL_REFRESH_INTERVAL)
+        self._lock = threading.Lock()
+        self._full_downloads = self._delta_downloads = 0
+
+    @property
+    def path(self):
+        return self._cache.path
+
+    def get_list_of_series(self, api_host, access_token, params, fetch):
+        """Get the list_of_series response to a request, downloading only what is new.
+
+        Parameters
+        ----------
+        api_host : string
+        access_token : string
+        params : dict
+            Parameters of the /v2/data request
+        fetch : function
+            Takes request parameters and returns the decoded list_of_series response
+
+        Returns
+        -------
+        list of dicts
+            Or whatever `fetch` returned if it is not a list, e.g. an error body. In offline mode
+            (see :mod:`api.client.offline`), the stored copy as is.
+
+        """
+        refresh, request_params = self.start_refresh(api_host, access_token, params)
+        return self.finish_refresh(refresh, fetch(request_params)
+                                   if request_params is not None else None)
+
+    def start_refresh(self, api_host, access_token, params):
+        """Start getting the list_of_series response to a request, for callers making the request
+        themselves, e.g. asynchronously.
+
+        Example::
+
+            refresh, request_params = store.start_refresh(api_host, access_token, params)
+            response = None
+            if request_params is not None:
+                response = yield client.get_data(url, headers, request_params)
+            series_list = store.finish_refresh(refresh, response)
+
+        Returns
+        -------
+        tuple
+            What to pass to :meth:`~finish_refresh`, and the parameters of the /v2/data request
+            to make, or None if no request is needed
+
+        """
+        key = make_key('series', api_host, access_token, canonical_params(params))
+        stored = self._cache.get(key)
+        window_start = get_window_start(stored['series']) if stored else None
+        if window_start is None:
+            return (key, None, None), params
+        if offline.is_offline():
+            # The stored copy is as recent as it gets
+            return (key, stored['series'], None), None
+        if params.get('endDate'):
+            window_start = min(window_start, params['endDate'][:10])
+        return (key, stored['series'], window_start), dict(params, startDate=window_start)
+
+    def finish_refresh(self, refresh, update):
+        """Merge the response to the request returned by :meth:`~start_refresh` into the store.
+
+        Parameters
+        ----------
+        refresh : tuple
+            As returned by :meth:`~start_refresh`
+        update : list of dicts or None
+            The decoded response, or None if no request was needed
+
+        Returns
+        -------
+        See :meth:`~get_list_of_series`
+
+        """
+        key, stored_series, window_start = refresh
+        if stored_series is None:
+            if isinstance(update, list):
+                self._cache.set(key, {'series': update}, self.full_refresh_interval)
+            with self._lock:
+                self._full_downloads += 1
+            return update
+        if window_start is None:
+            return stored_series
+        with self._lock:
+            self._delta_downloads += 1
+        if not isinstance(update, list):
+            return update
+        series_list = merge_list_of_series(stored_series, update, window_start)
+        # Keeps the expiry of the stored copy, at which the next full download is due
+        self._cache.update(key, {'series': series_list})
+        return series_list
+
+    def clear(self):
+        self._cache.clear()
+
+    def get_stats(self):
+        """Get the number of full and delta downloads made, and the size of the store."""
+        stats = self._cache.get_stats()
+        with self._lock:
+            stats['full_downloads'] = self._full_downloads
+            stats['delta_downloads'] = self._delta_downloads
+        return stats
+
+    def close(self):
+        self._cache.close()
+
+
+_store = None
+
+
+def enable_series_store(path=None, max_size=None):
+    """Keep local copies of the data series requested, and refresh them incrementally.
+
+    Parameters
+    ----------
+    path : string, optional
+        Location of the database. Defaults to :func:`~get_default_path`.
+    max_size : integer, optional
+        Maximum size of the stored series in bytes. Defaults to cfg.SERIES_STORE_MAX_SIZE.
+
+    Returns
+    -------
+    SeriesStore
+
+    """
+    global _store
+    disable_series_store()
+    _store = SeriesStore(path or get_default_path(), max_size)
+    return _store
+
+
+def disable_series_store():
+    global _store
+    store, _store = _store, None
+    if store is not None:
+        store.close()
+
+
+def get_series_store():
+    """Get the enabled series store.
+
+    Returns
+    -------
+    SeriesStore or None
+
+    """
+    return _store
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python series_store.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
@@ -0,0 +1,118 @@
+import json
+import os
+import time
+
+import mock
+import pytest
+from tornado.concurrent import Future
+from tornado.httpclient import HTTPRequest, HTTPResponse
+from tornado.httputil import HTTPHeaders
+
+from api.client import lib, series_store
+from api.client.batch_client import BatchClient
+from api.client.gro_client import GroClient
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.series_store.token'
+
+
+@pytest.fixture
+def store(tmpdir):
+    store = series_store.enable_series_store(os.path.join(str(tmpdir), 'series.sqlite'))
+    yield store
+    series_store.disable_series_store()
+
+
+def daily_points(start_day, end_day, value=1):
+    return [['2019-01-{:02d}T00:00:00.000Z'.format(day), '2019-01-{:02d}T00:00:00.000Z'.format(day),
+             value] for day in range(start_day, end_day + 1)]
+
+
+def mock_data_response(mock_requests_get, *data):
+    """Respond to /v2/data requests with the given list_of_series data, one per call."""
+    bodies = [json.dumps([{'series': {'metricId': 1, 'regionId': 1, 'unitId': 1},
+                           'data': points}]).encode('utf-8') for points in data]
+
+    def get(url, params=None, **kwargs):
+        response = mock.Mock(status_code=200)
+        response.iter_content.return_value = [bodies.pop(0)]
+        return response
+    mock_requests_get.side_effect = get
+
+
+@mock.patch('requests.Session.get')
+def test_delta_refresh(mock_requests_get, store):
+    mock_data_response(mock_requests_get, daily_points(1, 10),
+                       daily_points(10, 12, value=2))
+    points = lib.get_data_points(MOCK_TOKEN, MOCK_HOST, metric_id=1, region_id=1)
+    assert len(points) == 10
+    assert 'startDate' not in mock_requests_get.call_args[1]['params']
+
+    # Only the points from the last stored end date are requested again
+    points = lib.get_data_points(MOCK_TOKEN, MOCK_HOST, metric_id=1, region_id=1)
+    assert mock_requests_get.call_args[1]['params']['startDate'] == '2019-01-10'
+    assert [(point['end_date'][:10], point['value']) for point in points] == [
+        ('2019-01-{:02d}'.format(day), 1) for day in range(1, 10)] + [
+        ('2019-01-{:02d}'.format(day), 2) for day in range(10, 13)]
+    assert store.get_stats()['full_downloads'] == 1
+    assert store.get_stats()['delta_downloads'] == 1
+
+
+def test_full_refresh_when_expired(tmpdir):
+    store = series_store.SeriesStore(os.path.join(str(tmpdir), 'series.sqlite'),
+                                     full_refresh_interval=60)
+    fetch = mock.Mock(return_value=[{'series': {'regionId': 1}, 'data': daily_points(1, 2)}])
+    store.get_list_of_series(MOCK_HOST, MOCK_TOKEN, {'metricId': 1}, fetch)
+    store.get_list_of_series(MOCK_HOST, MOCK_TOKEN, {'metricId': 1}, fetch)
+    assert fetch.call_args[0][0] == {'metricId': 1, 'startDate': '2019-01-02'}
+    with mock.patch('time.time', return_value=time.time() + 120):
+        store.get_list_of_series(MOCK_HOST, MOCK_TOKEN, {'metricId': 1}, fetch)
+    assert fetch.call_args[0][0] == {'metricId': 1}
+    assert store.get_stats()['full_downloads'] == 2
+
+
+@mock.patch('requests.Session.get')
+def test_get_df_delta_refresh(mock_requests_get, store):
+    mock_data_response(mock_requests_get, daily_points(1, 5), daily_points(5, 6))
+    selection = {'metric_id': 1, 'item_id': 2, 'region_id': 1, 'partner_region_id': 0,
+                 'frequency_id': 1, 'source_id': 3}
+    for num_points in (5, 6):
+        # e.g. the same script run on consecutive days
+        client = GroClient(MOCK_HOST, MOCK_TOKEN)
+        client.add_single_data_series(dict(selection))
+        assert len(client.get_df()) == num_points
+    assert mock_requests_get.call_args[1]['params']['startDate'] == '2019-01-05'
+
+
+def test_batch_delta_refresh(store):
+    bodies = [[{'series': {'metricId': 1, 'regionId': 1, 'unitId': 1}, 'data': points}]
+              for points in (daily_points(1, 10), daily_points(10, 12, value=2))]
+    requests = []
+
+    def fetch(http_request):
+        requests.append(http_request.url)
+        body = json.dumps(bodies.pop(0)).encode('utf-8')
+        future = Future()
+        future.set_result(HTTPResponse(HTTPRequest(http_request.url), 200,
+                                       headers=HTTPHeaders(),
+                                       buffer=mock.Mock(getvalue=lambda: body)))
+        return future
+
+    client = BatchClient(MOCK_HOST, MOCK_TOKEN)
+    client._http_client = mock.Mock()
+    client._http_client.fetch.side_effect = fetch
+    assert len(client.batch_async_get_data_points([{'metric_id': 1, 'region_id': 1}])[0]) == 10
+    assert 'startDate' not in requests[0]
+    points = client.batch_async_get_data_points([{'metric_id': 1, 'region_id': 1}])[0]
+    assert 'startDate=2019-01-10' in requests[1]
+    assert len(points) == 12
+    assert store.get_stats()['delta_downloads'] == 1
+
+
+def test_at_time_is_not_stored(store):
+    with mock.patch.object(store, 'get_list_of_series') as get_list_of_series, \
+            mock.patch('requests.Session.get') as mock_requests_get:
+        mock_requests_get.return_value.status_code = 200
+        mock_requests_get.return_value.iter_content.return_value = [b'[]']
+        lib.get_data_points(MOCK_TOKEN, MOCK_HOST, metric_id=1, at_time='2019-01-01')
+    assert not get_list_of_series.called
@@ -0,0 +1,108 @@
+"""Connection pooling for requests made to the Gro API.
+
+All of the synchronous lib functions, and hence every Client and GroClient method, send their
+requests through a single process-wide requests.Session. Reusing the session keeps TCP+TLS
+connections to the API host alive between calls instead of paying for a new handshake on every
+request.
+
+The session is created lazily and is shared by all threads and all client instances. A new one is
+created automatically after a fork, since pooled sockets must not be shared between processes.
+"""
+
+import atexit
+import os
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from api.client import cfg, json_backend
+
+
+_lock = threading.Lock()
+_session = None
+_session_pid = None
+_pool_options = {
+    'pool_connections': cfg.POOL_CONNECTIONS,
+    'pool_maxsize': cfg.POOL_MAXSIZE,
+    'pool_block': cfg.POOL_BLOCK
+}
+
+
+def _new_session():
+    session = requests.Session()
+    # pool_connections is the number of distinct hosts to keep a pool for, pool_maxsize is the
+    # number of keep-alive connections held open to each of those hosts.
+    adapter = HTTPAdapter(**_pool_options)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    # response.json() decodes with the fastest JSON library installed
+    session.hooks['response'].append(json_backend.decode_response_json)
+    return session
+
+
+def get_session():
+    """Get the shared, connection-pooled session, creating it if necessary.
+
+    Returns
+    -------
+    requests.Session
+
+    """
+    global _session, _session_pid
+    session = _session
+    if session is not None and _session_pid == os.getpid():
+        return session
+    with _lock:
+        if _session is None or _session_pid != os.getpid():
+            # Don't close a session inherited from a parent process: its sockets still belong to
+            # the parent.
+            _session = _new_session()
+            _session_pid = os.getpid()
+        return _session
+
+
+def configure_session(pool_connections=None, pool_maxsize=None, pool_block=None):
+    """Change the connection pool settings of the shared session.
+
+    The current session, if any, is closed. The next request opens a new one with the given
+    settings. Arguments that are not given keep their current value.
+
+    Parameters
+    ----------
+    pool_connections : integer, optional
+        Number of hosts to keep a connection pool for.
+    pool_maxsize : integer, optional
+        Maximum number of keep-alive connections to keep open to each host. Set this to at least
+        the number of threads making requests concurrently.
+    pool_block : boolean, optional
+        If True, requests wait for a free connection when the pool of a host is exhausted instead
+        of opening a connection that is discarded afterwards.
+
+    """
+    with _lock:
+        if pool_connections is not None:
+            _pool_options['pool_connections'] = pool_connections
+        if pool_maxsize is not None:
+            _pool_options['pool_maxsize'] = pool_maxsize
+        if pool_block is not None:
+            _pool_options['pool_block'] = pool_block
+    close_session()
+
+
+def close_session():
+    """Close all pooled connections of the shared session.
+
+    Safe to call at any time: a later request transparently opens a new session. This is
+    registered to run at interpreter exit.
+    """
+    global _session, _session_pid
+    with _lock:
+        session, _session = _session, None
+        owned = _session_pid == os.getpid()
+        _session_pid = None
+    if session is not None and owned:
+        session.close()
+
+
+atexit.register(close_session)
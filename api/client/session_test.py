@@ -0,0 +1,46 @@
+import os
+import threading
+
+import mock
+
+from api.client import cfg, session
+
+
+def test_get_session_is_shared():
+    session.close_session()
+    first = session.get_session()
+    assert session.get_session() is first
+
+    sessions = []
+    threads = [threading.Thread(target=lambda: sessions.append(session.get_session()))
+               for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert all(s is first for s in sessions)
+
+
+def test_close_session():
+    first = session.get_session()
+    with mock.patch.object(first, 'close') as close_mocked:
+        session.close_session()
+        close_mocked.assert_called_once_with()
+    assert session.get_session() is not first
+
+
+def test_configure_session():
+    adapter = session.get_session().get_adapter('https://pytest.groclient.url')
+    assert adapter._pool_maxsize == cfg.POOL_MAXSIZE
+    try:
+        session.configure_session(pool_maxsize=cfg.POOL_MAXSIZE + 1)
+        adapter = session.get_session().get_adapter('https://pytest.groclient.url')
+        assert adapter._pool_maxsize == cfg.POOL_MAXSIZE + 1
+    finally:
+        session.configure_session(pool_maxsize=cfg.POOL_MAXSIZE)
+
+
+def test_new_session_after_fork():
+    first = session.get_session()
+    with mock.patch('os.getpid', return_value=os.getpid() + 1):
+        assert session.get_session() is not first
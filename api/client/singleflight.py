@@ -0,0 +1,155 @@
+"""Coalescing of identical requests made at the same time.
+
+In multi-threaded applications many threads often ask for the same thing at the same moment, e.g.
+the same lookup('units', id) or the same get_data_points() selection. Only the first of them makes
+the request. The others wait for it to finish and get a copy of its decoded result, or the same
+exception, instead of each making their own request.
+
+Requests are identical if they are for the same URL with the same query parameters and the same
+access token. Each waiting caller gets its own deep copy of the result, since callers may modify
+it, e.g. GroClient converts the units of data points in place.
+"""
+
+import copy
+import threading
+
+
+def canonical_params(params):
+    """Convert query parameters to a hashable form that is the same for equivalent parameters.
+
+    Parameters are compared as they are sent: values are strings, None values are dropped and
+    the order of the keys does not matter. The order of values in a list is kept.
+
+    >>> canonical_params({'ids': [2, 1], 'q': 'corn'}) == canonical_params({'q': 'corn',
+    ...                                                                     'ids': ['2', '1']})
+    True
+    >>> canonical_params({'ids': [1, 2]}) == canonical_params({'ids': [2, 1]})
+    False
+    >>> canonical_params(None) == canonical_params({'level': None})
+    True
+
+    Parameters
+    ----------
+    params : dict or None
+
+    Returns
+    -------
+    tuple
+
+    """
+    canonical = []
+    for key, value in (params or {}).items():
+        if value is None:
+            continue
+        if isinstance(value, (list, tuple)):
+            value = tuple(str(element) for element in value)
+        else:
+            value = str(value)
+        canonical.append((str(key), value))
+    return tuple(sorted(canonical))
+
+
+def request_key(url, params, access_token):
+    """Get the key identifying a request, for identical requests to share.
+
+    Parameters
+    ----------
+    url : string
+    params : dict or None
+    access_token : string
+
+    Returns
+    -------
+    tuple
+
+    """
+    return (url, canonical_params(params), access_token)
+
+
+class WaitTimeout(Exception):
+    """Raised when waiting for a request made by another thread takes too long."""
+
+
+class _Call(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """Runs at most one function at a time per key, sharing its result with concurrent callers.
+
+    >>> SingleFlight().do(('url', (), 'token'), lambda: 42)
+    42
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+        self.coalesced = 0  # number of calls that got the result of another thread's call
+
+    def do(self, key, function, timeout=None):
+        """Call `function`, or wait for the result of the call with the same key in progress.
+
+        The caller that calls `function` gets its return value, the callers that wait for it get a
+        deep copy.
+
+        Parameters
+        ----------
+        key : hashable
+        function : function
+            Takes no arguments
+        timeout : float, optional
+            Seconds to wait for a call in progress in another thread
+
+        Returns
+        -------
+        any
+            The return value of `function`, or a copy of it
+
+        Raises
+        ------
+        WaitTimeout
+            If the call in progress did not finish within `timeout`
+        Exception
+            Whatever exception `function` raised
+
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if leader:
+            try:
+                call.result = function()
+            except Exception as e:
+                call.error = e
+                raise
+            finally:
+                with self._lock:
+                    del self._calls[key]
+                call.done.set()
+            return call.result
+        if not call.done.wait(timeout):
+            raise WaitTimeout(key)
+        if call.error is not None:
+            raise call.error
+        return copy.deepcopy(call.result)
+
+    def in_flight(self):
+        """Get the number of calls in progress."""
+        with self._lock:
+            return len(self._calls)
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python singleflight.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
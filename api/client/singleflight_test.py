@@ -0,0 +1,172 @@
+import json
+import threading
+
+import mock
+import pytest
+
+from api.client import lib
+from api.client.gro_client import GroClient
+from api.client.deadline import deadline
+from api.client.singleflight import SingleFlight, WaitTimeout
+
+MOCK_HOST = 'pytest.groclient.url'
+MOCK_TOKEN = 'pytest.groclient.singleflight.token'
+
+
+def run_concurrently(function, num_threads):
+    results = [None] * num_threads
+    errors = [None] * num_threads
+
+    def target(i):
+        try:
+            results[i] = function()
+        except Exception as e:
+            errors[i] = e
+    threads = [threading.Thread(target=target, args=(i,)) for i in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    return threads, results, errors
+
+
+def test_concurrent_calls_share_one_result():
+    flight = SingleFlight()
+    release = threading.Event()
+    calls = []
+
+    def slow_call():
+        calls.append(1)
+        release.wait()
+        return {'id': 1}
+    threads, results, errors = run_concurrently(lambda: flight.do('key', slow_call), 5)
+    while flight.coalesced < 4:
+        release.wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert errors == [None] * 5
+    assert results == [{'id': 1}] * 5
+    # Callers may modify their result without affecting the others
+    assert len(set(id(result) for result in results)) == 5
+    assert flight.in_flight() == 0
+    # Calls made once the first one finished make a new call
+    assert flight.do('key', lambda: 'new result') == 'new result'
+
+
+def test_errors_are_shared():
+    flight = SingleFlight()
+    release = threading.Event()
+
+    def failing_call():
+        release.wait()
+        raise ValueError('failed')
+    threads, results, errors = run_concurrently(lambda: flight.do('key', failing_call), 3)
+    while flight.coalesced < 2:
+        release.wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert all(isinstance(error, ValueError) for error in errors)
+    assert flight.in_flight() == 0
+
+
+def test_wait_timeout():
+    flight = SingleFlight()
+    release = threading.Event()
+    threads, _, _ = run_concurrently(lambda: flight.do('key', release.wait), 1)
+    while flight.in_flight() == 0:
+        release.wait(0.01)
+    with pytest.raises(WaitTimeout):
+        flight.do('key', lambda: None, timeout=0.01)
+    release.set()
+    threads[0].join()
+
+
+@mock.patch('requests.Session.get')
+def test_identical_requests_make_one_request(mock_requests_get):
+    release = threading.Event()
+    started = threading.Event()
+
+    def get(*args, **kwargs):
+        started.set()
+        release.wait()
+        return mock.DEFAULT
+    mock_requests_get.side_effect = get
+    mock_requests_get.return_value.json.return_value = {'data': [{'metric_id': 1}]}
+    mock_requests_get.return_value.status_code = 200
+
+    coalesced = lib._in_flight.coalesced
+    threads, results, errors = run_concurrently(
+        lambda: lib.get_data_series(MOCK_TOKEN, MOCK_HOST, metric_id=1), 4)
+    started.wait()
+    while lib._in_flight.coalesced < coalesced + 3:
+        release.wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert mock_requests_get.call_count == 1
+    assert results == [[{'metric_id': 1}]] * 4
+    # A different token is a different request
+    assert lib.get_data_series(MOCK_TOKEN + '2', MOCK_HOST, metric_id=1) == [{'metric_id': 1}]
+    assert mock_requests_get.call_count == 2
+
+
+@mock.patch('requests.Session.get')
+def test_waiting_respects_deadline(mock_requests_get):
+    release = threading.Event()
+    started = threading.Event()
+
+    def get(*args, **kwargs):
+        started.set()
+        release.wait()
+        return mock.DEFAULT
+    mock_requests_get.side_effect = get
+    mock_requests_get.return_value.json.return_value = {'data': [{'metric_id': 1}]}
+    mock_requests_get.return_value.status_code = 200
+
+    threads, _, _ = run_concurrently(
+        lambda: lib.get_data_series(MOCK_TOKEN, MOCK_HOST, metric_id=1), 1)
+    started.wait()
+    with pytest.raises(lib.DeadlineExceeded):
+        with deadline(0.01):
+            lib.get_data_series(MOCK_TOKEN, MOCK_HOST, metric_id=1)
+    release.set()
+    threads[0].join()
+
+
+@mock.patch('requests.Session.get')
+def test_coalesced_data_points_are_copies(mock_requests_get):
+    # Each caller converts the same coalesced points to its own unit in place
+    release = threading.Event()
+    started = threading.Event()
+    body = json.dumps([{'series': {'metricId': 1, 'unitId': 1},
+                        'data': [['2000-01-01', '2000-12-31', 1]]}]).encode('utf-8')
+
+    def get(*args, **kwargs):
+        started.set()
+        release.wait()
+        return mock.DEFAULT
+    mock_requests_get.side_effect = get
+    mock_requests_get.return_value.status_code = 200
+    mock_requests_get.return_value.iter_content.return_value = [body]
+
+    client = GroClient(MOCK_HOST, MOCK_TOKEN)
+    client.lookup = mock.Mock(side_effect=lambda entity_type, unit_id: {
+        'id': unit_id, 'baseConvFactor': {'factor': 10 ** (3 * (unit_id - 1))}})
+    results = {}
+
+    def get_data_points(unit_id):
+        results[unit_id] = client.get_data_points(metric_id=1, unit_id=unit_id)
+    coalesced = lib._in_flight.coalesced
+    threads = [threading.Thread(target=get_data_points, args=(unit_id,)) for unit_id in (2, 3)]
+    for thread in threads:
+        thread.start()
+    started.wait()
+    while lib._in_flight.coalesced < coalesced + 1:
+        release.wait(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert mock_requests_get.call_count == 1
+    assert dict((unit_id, [(point['value'], point['unit_id']) for point in points])
+                for unit_id, points in results.items()) == {2: [(0.001, 2)], 3: [(0.000001, 3)]}
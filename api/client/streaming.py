@@ -0,0 +1,215 @@
+"""Incremental decoding of JSON response bodies.
+
+A /v2/data response for many regions or long daily series can be many megabytes. Rather than
+holding the whole body and the whole decoded document in memory at once, the elements of the
+top-level array (one per series in the list_of_series format) are decoded one at a time as the
+bytes arrive. Bodies that are not an array, such as an error object, are decoded whole by
+:func:`~decode_json_stream`.
+
+Incremental decoding is only possible with the standard json module. When a faster JSON library
+is used, see :mod:`api.client.json_backend`, bodies of up to cfg.JSON_WHOLE_BODY_MAX_BYTES are
+decoded whole with it instead, which is faster than decoding them incrementally. Larger bodies
+are still decoded incrementally.
+"""
+
+import codecs
+import itertools
+import json
+
+from api.client import cfg, json_backend
+
+_WHITESPACE = ' \t\n\r'
+
+
+class JSONArrayDecoder(object):
+    """Push decoder for the elements of a top-level JSON array.
+
+    >>> decoder = JSONArrayDecoder()
+    >>> decoder.feed(b'[{"a": 1}, {"b"') == [{'a': 1}]
+    True
+    >>> decoder.feed(b': [2, 3]}, 4') == [{'b': [2, 3]}]
+    True
+    >>> decoder.feed(b'5]')
+    [45]
+    >>> decoder.close()
+    []
+
+    """
+
+    def __init__(self):
+        self._json_decoder = json.JSONDecoder()
+        self._text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self._buffer = ''
+        self._pos = 0
+        self._pending = []  # text not yet appended to the buffer
+        self._pending_length = 0
+        # 'start': expecting '['. 'first': expecting a value or ']'. 'value': expecting a value.
+        # 'separator': expecting ',' or ']'. 'end': done.
+        self._state = 'start'
+        # When an element is incomplete, don't try to decode it again until the buffer has grown
+        # enough, so that decoding a large element stays linear in its size.
+        self._retry_length = 0
+
+    def _skip_whitespace(self):
+        while self._pos < len(self._buffer) and self._buffer[self._pos] in _WHITESPACE:
+            self._pos += 1
+        return self._pos < len(self._buffer)
+
+    def feed(self, data, final=False):
+        """Add bytes to the decoder.
+
+        Parameters
+        ----------
+        data : bytes
+        final : boolean, optional
+            True if no more data will be added
+
+        Returns
+        -------
+        list
+            The array elements completed by this data
+
+        """
+        text = self._text_decoder.decode(data, final)
+        if text:
+            self._pending.append(text)
+            self._pending_length += len(text)
+        if (not final and
+                len(self._buffer) - self._pos + self._pending_length < self._retry_length):
+            return []
+        if self._pending:
+            self._buffer = self._buffer[self._pos:] + ''.join(self._pending)
+            self._pos = 0
+            self._pending = []
+            self._pending_length = 0
+        elements = []
+        while self._state != 'end' and self._skip_whitespace():
+            char = self._buffer[self._pos]
+            if self._state == 'start':
+                if char != '[':
+                    raise ValueError('Expected a JSON array, got {!r}'.format(
+                        self._buffer[self._pos:self._pos + 20]))
+                self._pos += 1
+                self._state = 'first'
+            elif self._state == 'separator' or (self._state == 'first' and char == ']'):
+                if char == ']':
+                    self._pos += 1
+                    self._state = 'end'
+                elif char == ',':
+                    self._pos += 1
+                    self._state = 'value'
+                else:
+                    raise ValueError('Expected , or ] at position {}'.format(self._pos))
+            else:
+                try:
+                    element, end = self._json_decoder.raw_decode(self._buffer, self._pos)
+                except ValueError:
+                    if final:
+                        raise
+                    self._retry_length = 2 * (len(self._buffer) - self._pos)
+                    break
+                if (end == len(self._buffer) and not final and
+                        isinstance(element, (int, float)) and not isinstance(element, bool)):
+                    # A number at the end of the buffer may continue in the next chunk
+                    self._retry_length = len(self._buffer) - self._pos + 1
+                    break
+                elements.append(element)
+                self._pos = end
+                self._retry_length = 0
+                self._state = 'separator'
+        return elements
+
+    def close(self):
+        """Signal the end of the data.
+
+        Returns
+        -------
+        list
+            The array elements completed by the end of the data
+
+        Raises
+        ------
+        ValueError
+            If the data ends in the middle of the array. An empty body is treated as an empty
+            array, as for 204 No Content responses.
+
+        """
+        elements = self.feed(b'', final=True)
+        if self._state not in ('start', 'end') or self._buffer[self._pos:].strip():
+            raise ValueError('Unexpected end of JSON array')
+        return elements
+
+
+def iter_json_array(chunks):
+    """Yield the elements of a JSON array as the byte chunks making it up are read.
+
+    >>> list(iter_json_array([b'[1, {"a": ', b'"b"}', b']'])) == [1, {'a': 'b'}]
+    True
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+        e.g. requests.Response.iter_content()
+
+    Yields
+    ------
+    any
+        Each decoded element
+
+    """
+    decoder = JSONArrayDecoder()
+    for chunk in chunks:
+        for element in decoder.feed(chunk):
+            yield element
+    for element in decoder.close():
+        yield element
+
+
+def decode_json_stream(chunks):
+    """Decode a JSON body read in byte chunks, streaming its elements if it is an array.
+
+    >>> list(decode_json_stream([b' [1, ', b'2]']))
+    [1, 2]
+    >>> decode_json_stream([b'{"error": ', b'"Not Found"}']) == {'error': 'Not Found'}
+    True
+
+    Parameters
+    ----------
+    chunks : iterable of bytes
+
+    Returns
+    -------
+    iterator or any
+        If the body is a JSON array (or empty), an iterator over its elements as returned by
+        :func:`~iter_json_array`. Otherwise, the decoded body.
+
+    """
+    chunks = iter(chunks)
+    head = []
+    for chunk in chunks:
+        head.append(chunk)
+        start = chunk.lstrip()
+        if start:
+            break
+    else:
+        return iter_json_array(head)  # Empty body
+    if start[:1] != b'[':
+        return json_backend.loads(b''.join(itertools.chain(head, chunks)))
+    if json_backend.get_backend() != 'json':
+        size = sum(len(chunk) for chunk in head)
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size > cfg.JSON_WHOLE_BODY_MAX_BYTES:
+                break
+        else:
+            return iter(json_backend.loads(b''.join(head)))
+    return iter_json_array(itertools.chain(head, chunks))
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python streaming.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)
@@ -0,0 +1,139 @@
+"""Conversion of data point values between units.
+
+Each unit has a factor and an offset converting its values to the base unit of its kind, e.g.
+tonnes to kilograms, in the baseConvFactor field of its details. A :class:`ConversionTable` looks
+these up once per unit, and converts whole arrays of values, in whatever mix of units, with one
+NumPy expression::
+
+    table = ConversionTable(lambda unit_id: client.lookup('units', unit_id))
+    table.convert(values, unit_ids, target_unit_id=14)
+"""
+
+import numpy as np
+import pandas
+
+
+class ConversionTable(object):
+    """Factors and offsets converting units to their base unit, cached by unit id.
+
+    >>> units = {10: {'baseConvFactor': {'factor': 1}},
+    ...          14: {'baseConvFactor': {'factor': 1000}},
+    ...          43: {'baseConvFactor': {'factor': None}}}
+    >>> table = ConversionTable(units.get)
+    >>> table.convert([1, 2.5, None], [14, 10, 14], 10).tolist()
+    [1000.0, 2.5, nan]
+    >>> table.convert([1], [10], 43)
+    Traceback (most recent call last):
+    ...
+    Exception: unit_id 43 is not convertible
+
+    """
+
+    def __init__(self, lookup_unit):
+        """
+        Parameters
+        ----------
+        lookup_unit : function
+            Takes a unit id and returns the details of the unit, e.g. Client.lookup('units', ...)
+
+        """
+        self._lookup_unit = lookup_unit
+        # unit id: (factor, offset), with a factor of None if the unit is not convertible
+        self._conversions = {}
+
+    def get_conversion(self, unit_id):
+        """Get the factor and offset converting values in a unit to its base unit.
+
+        Raises
+        ------
+        Exception
+            If the unit is not convertible
+
+        """
+        unit_id = int(unit_id)
+        if unit_id not in self._conversions:
+            self.add_unit(unit_id, self._lookup_unit(unit_id))
+        factor, offset = self._conversions[unit_id]
+        if factor is None:
+            raise Exception('unit_id {} is not convertible'.format(unit_id))
+        return factor, offset
+
+    def get_unknown(self, unit_ids):
+        """Get the units that would need to be looked up to convert values in the given units.
+
+        For callers that look units up themselves, e.g. asynchronously, and add them with
+        :meth:`~add_unit` before converting values.
+
+        >>> table = ConversionTable(None)
+        >>> table.add_unit(10, {'baseConvFactor': {'factor': 1}})
+        >>> table.get_unknown([14, 10, None, 14.0])
+        [14]
+
+        Returns
+        -------
+        list of integers
+
+        """
+        unit_ids = set(int(unit_id) for unit_id in unit_ids if not pandas.isnull(unit_id))
+        return sorted(unit_ids.difference(self._conversions))
+
+    def add_unit(self, unit_id, unit):
+        """Keep the conversion of a unit.
+
+        Parameters
+        ----------
+        unit_id : integer
+        unit : dict or None
+            The details of the unit, as returned by lookup_unit
+
+        """
+        convert_factor = (unit or {}).get('baseConvFactor') or {}
+        self._conversions[int(unit_id)] = (convert_factor.get('factor') or None,
+                                           convert_factor.get('offset') or 0)
+
+    def convert(self, values, unit_ids, target_unit_id):
+        """Convert values to a unit.
+
+        Parameters
+        ----------
+        values : array-like
+            None or NaN for missing values
+        unit_ids : array-like
+            The unit of each value. Values without a unit, or already in the target unit, are
+            left as they are.
+        target_unit_id : integer
+
+        Returns
+        -------
+        NumPy array of float64
+
+        Raises
+        ------
+        Exception
+            If one of the units, or the target unit, is not convertible
+
+        """
+        values = np.array(values, dtype=np.float64)
+        unit_ids = np.asarray(unit_ids)
+        to_convert = ~pandas.isnull(unit_ids)
+        to_convert[to_convert] = unit_ids[to_convert] != target_unit_id
+        if not to_convert.any():
+            return values
+        from_unit_ids = unit_ids[to_convert].astype(np.int64)
+        units = np.unique(from_unit_ids)  # sorted
+        conversions = [self.get_conversion(unit_id) for unit_id in units]
+        to_factor, to_offset = self.get_conversion(target_unit_id)
+        factors = np.array([factor for factor, _ in conversions], dtype=np.float64)
+        offsets = np.array([offset for _, offset in conversions], dtype=np.float64)
+        positions = np.searchsorted(units, from_unit_ids)
+        values[to_convert] = ((values[to_convert] * factors[positions] + offsets[positions] -
+                               to_offset) / to_factor)
+        return values
+
+
+if __name__ == '__main__':
+    # To run doctests:
+    # $ python units.py -v
+    import doctest
+    doctest.testmod(raise_on_error=True,
+                    optionflags=doctest.NORMALIZE_WHITESPACE | doctest.ELLIPSIS)